@@ -1,22 +1,43 @@
 import os
+import math
 import time
 import json
+import fcntl
 import requests
 import threading
 
 import secrets
 import hashlib
+import itertools
 import jwt
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from datetime import datetime, timedelta
+from collections import deque
+
+import metrics
+import profiler
+from detector import StaLtaDetector
+from clock_sync import ClockSync
+from shared_store import ShardedDeviceStore, MAX_ID_BYTES
 
 # Variables
 app = Flask(__name__)
 
+# Request metrics
+@app.before_request
+def before_request():
+    g.request_start = time.perf_counter()
+
 # CORS
 @app.after_request
 def after_request(response):
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, route)
+        metrics.REQUESTS.inc(route, request.method, response.status_code)
+    
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Accept,Cache-Control')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
@@ -34,7 +55,39 @@ HISTORICAL_DATA_FILE = os.path.join(os.path.dirname(__file__), "historical_data.
 LOCATION_CACHE_FILE = os.path.join(os.path.dirname(__file__), "location_cache.json")
 
 EEWS_DEVICES: dict = {}
-EEWS_STORE: dict = {}
+REGISTERED_DEVICES = {"ids": frozenset(), "mtime": None}   # Ids in EEWS_DEVICES_FILE, reloaded when the file changes
+EEWS_COMMANDS: dict = {}
+COMMANDS_LOCK = threading.Lock()
+DEVICES_FILE_LOCK_FILE = EEWS_DEVICES_FILE + ".lock"
+
+# Live device table, set EEWS_SHARED_STORE (e.g. /dev/shm/eews_live.bin) to keep it in a memory mapped file that
+# outlives a worker restart. Run one worker with threads either way: queued commands, STA/LTA channels, clock sync,
+# alerts, event samples, feature frames and profiles live in process memory, so every post of a device has to reach
+# the same process. A second worker on the same table refuses to start (gunicorn --preload is not supported).
+EEWS_SHARED_STORE = os.environ.get("EEWS_SHARED_STORE")
+EEWS_SHARED_SLOTS = int(os.environ.get("EEWS_SHARED_SLOTS", 16384))
+WORKER_LOCK_WAIT_SECONDS = 30          # A restarting worker waits this long for the one it replaces to exit
+
+def claim_single_worker(path):
+    """Hold an exclusive lock next to the shared table for the life of this process, raise if another worker has it"""
+    lock = open(path + ".worker", "a")
+    deadline = time.monotonic() + WORKER_LOCK_WAIT_SECONDS
+    while True:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock
+        except BlockingIOError:
+            if time.monotonic() > deadline:
+                lock.close()
+                raise RuntimeError(f"Another worker is using {path}, the EEWS API runs as a single worker process")
+            time.sleep(0.1)
+
+if EEWS_SHARED_STORE:
+    from shared_store import SharedDeviceTable
+    WORKER_LOCK = claim_single_worker(EEWS_SHARED_STORE)
+    EEWS_STORE = SharedDeviceTable(EEWS_SHARED_STORE, EEWS_SHARED_SLOTS)
+else:
+    EEWS_STORE = ShardedDeviceStore()
 
 # Security constants
 SECRET_KEY = secrets.token_hex(32)
@@ -46,6 +99,53 @@ MIN_DEVICES_FOR_WARNING = 2            # Default is 5
 
 EEWS_EXPIRY_SECONDS = 15
 
+# Per-device PGA thresholds from the noise floor each device measures, G_FORCE_THRESHOLD is for devices that send no PGA
+PGA_NOISE_FACTOR = 20.0                # Trigger at this many times the device's noise floor
+PGA_MIN_THRESHOLD = 0.05               # But never below this, g of dynamic acceleration
+PGA_DEFAULT_THRESHOLD = 0.35           # Until a device reports its noise floor, G_FORCE_THRESHOLD on a level mount
+
+# STA/LTA trigger on sample times, alongside the fixed thresholds, which act alone until a device has a full LTA window
+STA_SECONDS = 0.5
+LTA_SECONDS = 10.0
+STA_LTA_ON_RATIO = 4.0
+STA_LTA_OFF_RATIO = 1.5
+
+DETECTOR = StaLtaDetector(STA_SECONDS, LTA_SECONDS, STA_LTA_ON_RATIO, STA_LTA_OFF_RATIO)
+
+# Device clocks, offset and drift per device from post round trips, readings are stored on the server's timebase
+CLOCKS = ClockSync()
+COMMAND_EXPIRY_SECONDS = 300           # Undelivered commands are dropped after this
+
+# Command ids keep increasing across restarts so devices never mistake a new command for an old one
+COMMAND_IDS = itertools.count(int(time.time()))
+
+# Alert latency tracking
+ALERT_HISTORY = 100                    # Closed warning events kept for /alerts/latency
+ALERT_MAX_CLIENTS = 1000               # Clients tracked per event
+MICROPYTHON_EPOCH_OFFSET = 946684800   # Seconds from 1970 to 2000, devices on ports with the 2000 epoch post epoch=2000
+DEVICE_TIME_MAX_SKEW = 86400           # Sample times further than this from server time are treated as missing
+
+ALERT_EVENTS = deque(maxlen=ALERT_HISTORY)
+ALERT_STATE = {"active": None}
+ALERT_LOCK = threading.Lock()
+ALERT_IDS = itertools.count(1)
+
+# Store-and-forward event samples, devices number them per boot and resend until acknowledged
+EVENT_SAMPLE_HISTORY = 2000            # Samples kept per device for /events
+
+EVENT_SAMPLES: dict = {}               # device_id -> deque of samples
+EVENT_SEEN: dict = {}                  # device_id -> set of (boot, seq) in EVENT_SAMPLES
+EVENTS_LOCK = threading.Lock()
+
+# Feature frames, per-window PGA, RMS, zero-crossing rate and dominant frequency that devices send instead of raw samples
+FEATURE_FRAME_HISTORY = 500            # Frames kept per device for /features
+
+FEATURE_FRAMES: dict = {}              # device_id -> deque of frames
+FEATURE_SEEN: dict = {}                # device_id -> set of (boot, window) in FEATURE_FRAMES
+
+# Last /post per device, frame-only devices never reach EEWS_STORE but their state still has to be pruned
+LAST_POST: dict = {}                   # device_id -> server seconds
+
 # Location cache
 LOCATION_CACHE = {}
 
@@ -76,6 +176,7 @@ def create_id(pipeline_id: str, pipeline_key: str) -> bool:
         key_file_path = os.path.join(folder_location, 'key.txt')
         with open(key_file_path, 'a') as key_file:
             key_file.write(pipeline_key)
+        metrics.FILE_WRITES.inc("key")
         
         if os.path.isdir(folder_location) and os.path.exists(key_file_path):
             return True
@@ -103,6 +204,7 @@ def update_key(pipeline_id: str, pipeline_new_key: str) -> None:
     key_file_path = os.path.join(folder_location, 'key.txt')
     with open(key_file_path, 'w') as file:
         file.write(pipeline_new_key)
+    metrics.FILE_WRITES.inc("key")
 
 def data_available(pipeline_id: str) -> bool:
     hex_folder_name = hex(int(pipeline_id))
@@ -116,6 +218,7 @@ def store_data(pipeline_id: str, data: dict) -> None:
         os.makedirs(folder_location)
     with open(os.path.join(folder_location, 'stream.json'), 'w') as f:
         json.dump(data, f)
+    metrics.FILE_WRITES.inc("stream")
 
 def read_data(pipeline_id: str) -> dict:
     hex_folder_name = hex(int(pipeline_id))
@@ -135,22 +238,27 @@ def get_server_public_ip() -> str:
 
 # Location cache functions
 def load_location_cache():
-    """Load location cache from file"""
+    """Load location cache from file, merged so other workers' entries are kept"""
     global LOCATION_CACHE
     if os.path.exists(LOCATION_CACHE_FILE):
         try:
             with open(LOCATION_CACHE_FILE, 'r') as f:
-                LOCATION_CACHE = json.load(f)
+                LOCATION_CACHE.update(json.load(f))
         except:
-            LOCATION_CACHE = {}
+            pass
     return LOCATION_CACHE
 
 def save_location_cache():
     """Save location cache to file"""
     global LOCATION_CACHE
     try:
-        with open(LOCATION_CACHE_FILE, 'w') as f:
+        # Pick up entries written by other workers before overwriting the file
+        load_location_cache()
+        tmp_file = f"{LOCATION_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
             json.dump(LOCATION_CACHE, f, indent=2)
+        os.replace(tmp_file, LOCATION_CACHE_FILE)
+        metrics.FILE_WRITES.inc("location_cache")
     except:
         pass
 
@@ -177,14 +285,19 @@ def get_city_from_coordinates(latitude, longitude):
         # Create cache key (rounded to 3 decimal places for approximate location)
         cache_key = f"{lat:.3f},{lon:.3f}"
         
-        # Load cache if not already loaded
-        if not LOCATION_CACHE:
-            load_location_cache()
-        
         # Check cache first
         if cache_key in LOCATION_CACHE:
+            metrics.GEOCODER_LOOKUPS.inc("hit")
             return LOCATION_CACHE[cache_key]
         
+        # Another worker may have resolved it already
+        load_location_cache()
+        if cache_key in LOCATION_CACHE:
+            metrics.GEOCODER_LOOKUPS.inc("hit")
+            return LOCATION_CACHE[cache_key]
+        
+        metrics.GEOCODER_LOOKUPS.inc("miss")
+        
         # Use OpenStreetMap Nominatim API
         url = "https://nominatim.openstreetmap.org/reverse"
         params = {
@@ -203,7 +316,8 @@ def get_city_from_coordinates(latitude, longitude):
         }
         
         # Make request with timeout
-        response = requests.get(url, params=params, headers=headers, timeout=5)
+        with metrics.NOMINATIM_LATENCY.time():
+            response = requests.get(url, params=params, headers=headers, timeout=5)
         
         if response.status_code == 200:
             data = response.json()
@@ -283,6 +397,7 @@ def load_eews_users():
         }
         with open(USERS_FILE, "w") as f:
             json.dump(default_users, f, indent=2)
+        metrics.FILE_WRITES.inc("users")
         return default_users
     
     with open(USERS_FILE, "r") as f:
@@ -312,10 +427,22 @@ def load_eews_users():
         if migrated:
             with open(USERS_FILE, "w") as f:
                 json.dump(users, f, indent=2)
+            metrics.FILE_WRITES.inc("users")
         
         return users
 
 def save_eews_devices(device):
+    # Read-modify-write of the registry file, concurrent registrations would drop each other;
+    # flock on its own open file serializes threads as well as processes
+    os.makedirs(os.path.dirname(EEWS_DEVICES_FILE), exist_ok=True)
+    with open(DEVICES_FILE_LOCK_FILE, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            return _save_eews_devices(device)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _save_eews_devices(device):
     os.makedirs(os.path.dirname(EEWS_DEVICES_FILE), exist_ok=True)
 
     if os.path.exists(EEWS_DEVICES_FILE):
@@ -361,6 +488,7 @@ def save_eews_devices(device):
             "updated_at": datetime.now().isoformat(),
             "total_devices": len(devices)
         }, f, indent=2)
+    metrics.FILE_WRITES.inc("devices")
 
     return device_record
 
@@ -374,34 +502,288 @@ def load_eews_devices():
             return []
     return []
 
+def refresh_registered_devices():
+    """Reload the registered device ids when the registry file changed"""
+    try:
+        mtime = os.stat(EEWS_DEVICES_FILE).st_mtime
+    except OSError:
+        mtime = None
+    if mtime != REGISTERED_DEVICES["mtime"]:
+        REGISTERED_DEVICES["ids"] = frozenset(d.get("device_id") for d in load_eews_devices())
+        REGISTERED_DEVICES["mtime"] = mtime
+
+def is_expired(device_id, device_data, now=None):
+    now = now or datetime.now()
+    ts_str = device_data.get("server_timestamp")
+    if not ts_str:
+        return True
+    try:
+        ts = datetime.fromisoformat(ts_str)
+        return now - ts > timedelta(seconds=EEWS_EXPIRY_SECONDS)
+    except Exception:
+        return True
+
 def cleanup_eews_store():
     now = datetime.now()
-    expired_devices = []
-
-    for device_id, device_data in list(EEWS_STORE.items()):
-        ts_str = device_data.get("server_timestamp")
-        if not ts_str:
-            expired_devices.append(device_id)
-            continue
-        try:
-            ts = datetime.fromisoformat(ts_str)
-            if now - ts > timedelta(seconds=EEWS_EXPIRY_SECONDS):
-                expired_devices.append(device_id)
-        except Exception:
-            expired_devices.append(device_id)
-
-    for device_id in expired_devices:
-        EEWS_STORE.pop(device_id, None)
+    # Scanned without the store's lock, remove_if rechecks each match under it so a reading written since is kept
+    removed = EEWS_STORE.remove_if(lambda device_id, device_data: is_expired(device_id, device_data, now))
+    DETECTOR.forget(removed)
+    refresh_registered_devices()
+    
+    # A removed device that stopped posting takes its other state along, ids come from unauthenticated posts;
+    # devices still sending frames or late samples only are kept
+    cutoff = time.time() - EEWS_EXPIRY_SECONDS
+    gone = [device_id for device_id, posted_at in list(LAST_POST.items()) if posted_at < cutoff]
+    for device_id in gone:
+        LAST_POST.pop(device_id, None)
+    DETECTOR.forget(gone)
+    CLOCKS.forget(gone)
+    forget_device_history(gone)
+    expire_device_commands()
+    metrics.CLEANUP_SWEEP.observe(len(removed))
+    return removed
         
 def cleanup_loop():
     while True:
         cleanup_eews_store()
         time.sleep(1)
 
+# Downlink command functions
+def queue_device_command(device_id, command, **args):
+    """Queue a command, delivered in the response to the device's next /post"""
+    entry = {"id": next(COMMAND_IDS), "cmd": command, **args}
+    with COMMANDS_LOCK:
+        EEWS_COMMANDS.setdefault(device_id, []).append((time.time(), entry))
+    return entry
+
+def expire_device_commands(now=None):
+    """Drop commands nobody collected in time, devices that stopped posting never prune their own queue"""
+    now = now or time.time()
+    with COMMANDS_LOCK:
+        for device_id in list(EEWS_COMMANDS):
+            pending = [(issued_at, entry) for issued_at, entry in EEWS_COMMANDS[device_id] if now - issued_at < COMMAND_EXPIRY_SECONDS]
+            if pending:
+                EEWS_COMMANDS[device_id] = pending
+            else:
+                del EEWS_COMMANDS[device_id]
+
+def parse_command_acks(ack_str):
+    """Parse a comma separated list of acknowledged command ids"""
+    acks = set()
+    for part in (ack_str or "").split(","):
+        part = part.strip()
+        if part.isdigit():
+            acks.add(int(part))
+    return acks
+
+def pending_device_commands(device_id, acks=None):
+    """Drop acknowledged or expired commands and return those still pending"""
+    if device_id not in EEWS_COMMANDS:
+        return []
+
+    now = time.time()
+    acks = acks or set()
+
+    with COMMANDS_LOCK:
+        queue = EEWS_COMMANDS.get(device_id, [])
+        pending = [
+            (issued_at, entry) for issued_at, entry in queue
+            if entry["id"] not in acks and now - issued_at < COMMAND_EXPIRY_SECONDS
+        ]
+
+        if pending:
+            EEWS_COMMANDS[device_id] = pending
+        else:
+            EEWS_COMMANDS.pop(device_id, None)
+
+    return [entry for _, entry in pending]
+
+# Alert latency functions
+def parse_device_timestamp(value, epoch=1970):
+    """Device sample time as unix seconds, or None when missing or invalid; epoch is the year the device counts from"""
+    try:
+        ts = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(ts) or ts <= 0:
+        return None
+    if ts > 1e11:
+        ts /= 1000.0                   # Sent in milliseconds
+    if epoch == 2000:
+        ts += MICROPYTHON_EPOCH_OFFSET
+    return ts
+
+def parse_clock_sync(value, epoch=1970):
+    """Round trip from a post's sync field as (sent, server, received, anchor), unix seconds, or None"""
+    try:
+        sent, server, received, anchor = value.split(",")
+        sent = parse_device_timestamp(sent, epoch)
+        received = parse_device_timestamp(received, epoch)
+        if sent is None or received is None:
+            return None
+        return sent, int(server) / 1000.0, received, int(anchor)
+    except (AttributeError, ValueError):
+        return None
+
+def open_alert_event(result, detected_at):
+    devices = []
+    for d in result["devices"]:
+        received_at = datetime.fromisoformat(d["server_timestamp"]).timestamp()
+        devices.append({
+            "device_id": d["device_id"],
+            "g_force": d["g_force"],
+            "sampled_at": d.get("sampled_at"),
+            "received_at": received_at,
+            "triggered_since": d.get("triggered_since") or received_at
+        })
+    devices.sort(key=lambda d: d["triggered_since"])
+
+    # The condition became true when the last device needed for a warning first exceeded its threshold
+    triggered_at = devices[min(MIN_DEVICES_FOR_WARNING, len(devices)) - 1]["triggered_since"]
+    first_sample_at = min(d["sampled_at"] or d["received_at"] for d in devices)
+
+    event = {
+        "event_id": next(ALERT_IDS),
+        "location": result["location"],
+        "devices": devices,
+        "first_sample_at": first_sample_at,
+        "triggered_at": triggered_at,
+        "detected_at": detected_at,
+        "fetches": {},
+        "ended_at": None
+    }
+
+    for d in devices:
+        if d["sampled_at"] is not None:
+            metrics.ALERT_LATENCY.observe(d["received_at"] - d["sampled_at"], "sample_to_receive")
+    metrics.ALERT_LATENCY.observe(triggered_at - first_sample_at, "sample_to_trigger")
+    metrics.ALERT_LATENCY.observe(detected_at - triggered_at, "trigger_to_detect")
+    return event
+
+def track_warning(result, detected_at):
+    """Open or close the alert event as the warning flips, returns the active event"""
+    with ALERT_LOCK:
+        active = ALERT_STATE["active"]
+        if result.get("warning"):
+            if active is None or active["location"] != result["location"]:
+                if active is not None:
+                    active["ended_at"] = detected_at
+                    ALERT_EVENTS.append(active)
+                active = ALERT_STATE["active"] = open_alert_event(result, detected_at)
+            return active
+
+        if active is not None:
+            active["ended_at"] = detected_at
+            ALERT_EVENTS.append(active)
+            ALERT_STATE["active"] = None
+        return None
+
+def record_warning_fetch(event, client_id, fetched_at):
+    """Remember the first time each client was served the warning"""
+    with ALERT_LOCK:
+        if client_id in event["fetches"] or len(event["fetches"]) >= ALERT_MAX_CLIENTS:
+            return
+        event["fetches"][client_id] = fetched_at
+    metrics.ALERT_LATENCY.observe(fetched_at - event["detected_at"], "detect_to_fetch")
+    metrics.ALERT_LATENCY.observe(fetched_at - event["first_sample_at"], "sample_to_fetch")
+
+def alert_event_summary(event):
+    ms = lambda seconds: round(seconds * 1000, 1) if seconds is not None else None
+    fetches = sorted(event["fetches"].values())
+    first_fetch = fetches[0] if fetches else None
+    return {
+        "event_id": event["event_id"],
+        "location": event["location"],
+        "started_at": datetime.fromtimestamp(event["first_sample_at"]).isoformat(),
+        "ended_at": datetime.fromtimestamp(event["ended_at"]).isoformat() if event["ended_at"] else None,
+        "clients": len(fetches),
+        "latency_ms": {
+            "sample_to_trigger": ms(event["triggered_at"] - event["first_sample_at"]),
+            "trigger_to_detect": ms(event["detected_at"] - event["triggered_at"]),
+            "detect_to_first_fetch": ms(first_fetch - event["detected_at"]) if first_fetch else None,
+            "sample_to_first_fetch": ms(first_fetch - event["first_sample_at"]) if first_fetch else None,
+            "sample_to_last_fetch": ms(fetches[-1] - event["first_sample_at"]) if fetches else None
+        },
+        "devices": [
+            {
+                "device_id": d["device_id"],
+                "g_force": d["g_force"],
+                "sample_to_receive_ms": ms(d["received_at"] - d["sampled_at"]) if d["sampled_at"] else None
+            }
+            for d in event["devices"]
+        ]
+    }
+
+# Event sample functions
+def record_event_sample(device_id, boot, seq, sample):
+    """Keep one store-and-forward sample, False when it was already received"""
+    key = (boot, seq)
+    with EVENTS_LOCK:
+        seen = EVENT_SEEN.setdefault(device_id, set())
+        if key in seen:
+            return False
+
+        samples = EVENT_SAMPLES.setdefault(device_id, deque(maxlen=EVENT_SAMPLE_HISTORY))
+        if len(samples) == samples.maxlen:
+            oldest = samples[0]
+            seen.discard((oldest["boot"], oldest["seq"]))
+        samples.append(dict(sample, boot=boot, seq=seq))
+        seen.add(key)
+        return True
+
+def forget_device_history(device_ids):
+    """Drop the event samples and feature frames of devices that went away"""
+    with EVENTS_LOCK:
+        for device_id in device_ids:
+            EVENT_SAMPLES.pop(device_id, None)
+            EVENT_SEEN.pop(device_id, None)
+            FEATURE_FRAMES.pop(device_id, None)
+            FEATURE_SEEN.pop(device_id, None)
+
+def event_samples(device_id):
+    """Samples in device order, with the sequence numbers still missing per boot"""
+    with EVENTS_LOCK:
+        samples = sorted(EVENT_SAMPLES.get(device_id, ()), key=lambda s: (s["boot"], s["seq"]))
+
+    missing = {}
+    for boot, group in itertools.groupby(samples, key=lambda s: s["boot"]):
+        seqs = [s["seq"] for s in group]
+        gap = seqs[-1] - seqs[0] + 1 - len(seqs)
+        if gap:
+            missing[str(boot)] = gap
+    return samples, missing
+
+def record_feature_frame(device_id, boot, window, frame):
+    """Keep one feature frame, False when it was already received"""
+    key = (boot, window)
+    with EVENTS_LOCK:
+        seen = FEATURE_SEEN.setdefault(device_id, set())
+        if key in seen:
+            return False
+
+        frames = FEATURE_FRAMES.setdefault(device_id, deque(maxlen=FEATURE_FRAME_HISTORY))
+        if len(frames) == frames.maxlen:
+            oldest = frames[0]
+            seen.discard((oldest["boot"], oldest["window"]))
+        frames.append(dict(frame, boot=boot, window=window))
+        seen.add(key)
+        return True
+
+def feature_frames(device_id):
+    """Frames in device order"""
+    with EVENTS_LOCK:
+        return sorted(FEATURE_FRAMES.get(device_id, ()), key=lambda f: (f["boot"], f["window"]))
+
+def latest_feature_frame(device_id):
+    with EVENTS_LOCK:
+        frames = FEATURE_FRAMES.get(device_id)
+        return frames[-1] if frames else None
+
 def get_device_location_map():
     devices = load_eews_devices()
     return {d["device_id"]: d.get("location", "Unknown") for d in devices}
     
+@metrics.DETECT_LATENCY.timed
 def detect_earthquake_warning():
     cleanup_eews_store()
 
@@ -410,7 +792,10 @@ def detect_earthquake_warning():
 
     for device_id, data in EEWS_STORE.items():
         g_force = data.get("g_force")
-        if g_force is None or g_force <= G_FORCE_THRESHOLD:
+        triggered = data.get("triggered")
+        if triggered is None:
+            triggered = exceeds_threshold(data)
+        if not triggered:
             continue
 
         location = device_location_map.get(device_id)
@@ -423,6 +808,13 @@ def detect_earthquake_warning():
         location_hits[location].append({
             "device_id": device_id,
             "g_force": g_force,
+            "pga": data.get("pga"),
+            "sta_lta": data.get("sta_lta"),
+            "features": latest_feature_frame(device_id),
+            "device_timestamp": data.get("device_timestamp"),
+            "corrected_timestamp": data.get("corrected_timestamp"),
+            "sampled_at": data.get("sampled_at"),
+            "triggered_since": data.get("triggered_since"),
             "server_timestamp": data.get("server_timestamp")
         })
 
@@ -442,6 +834,20 @@ def detect_earthquake_warning():
         "message": "No earthquake detected"
     }
 
+def device_pga_threshold(noise=None):
+    """PGA trigger level for a device with the given noise floor"""
+    if noise is None:
+        return PGA_DEFAULT_THRESHOLD
+    return max(PGA_MIN_THRESHOLD, PGA_NOISE_FACTOR * noise)
+
+def exceeds_threshold(data) -> bool:
+    """Fixed-threshold trigger: PGA against the device's own threshold, or g_force for devices without PGA"""
+    pga = data.get("pga")
+    if pga is not None:
+        return pga > (data.get("pga_threshold") or PGA_DEFAULT_THRESHOLD)
+    g_force = data.get("g_force")
+    return g_force is not None and g_force > G_FORCE_THRESHOLD
+
 # Initialize historical data structure
 def init_historical_data():
     if not os.path.exists(HISTORICAL_DATA_FILE):
@@ -452,6 +858,7 @@ def init_historical_data():
         }
         with open(HISTORICAL_DATA_FILE, 'w') as f:
             json.dump(default_data, f, indent=2)
+        metrics.FILE_WRITES.inc("historical")
         return default_data
     
     with open(HISTORICAL_DATA_FILE, 'r') as f:
@@ -461,6 +868,7 @@ def init_historical_data():
 def save_historical_data(data):
     with open(HISTORICAL_DATA_FILE, 'w') as f:
         json.dump(data, f, indent=2)
+    metrics.FILE_WRITES.inc("historical")
 
 # Process historical data for different time ranges
 def process_historical_data():
@@ -909,6 +1317,7 @@ def earthquake_early_warning_system_reset_password():
         # Save updated users
         with open(USERS_FILE, 'w') as f:
             json.dump(users, f, indent=2)
+        metrics.FILE_WRITES.inc("users")
 
         return jsonify({
             "success": True,
@@ -1002,6 +1411,7 @@ def change_password():
         # Save updated users
         with open(USERS_FILE, 'w') as f:
             json.dump(users, f, indent=2)
+        metrics.FILE_WRITES.inc("users")
         
         return jsonify({
             "success": True,
@@ -1082,6 +1492,7 @@ def update_recovery_key():
         # Save updated users
         with open(USERS_FILE, 'w') as f:
             json.dump(users, f, indent=2)
+        metrics.FILE_WRITES.inc("users")
         
         return jsonify({
             "success": True,
@@ -1379,6 +1790,8 @@ def earthquake_early_warning_system_post_device_id():
     
 @app.route('/pipeline/eews/post', methods=['POST', 'GET'])
 def earthquake_early_warning_system_post():
+    # Arrival time for the device's next round trip, taken before any work is done
+    server_ms = int(time.time() * 1000)
     timestamp = datetime.now().isoformat()
     
     try:
@@ -1387,24 +1800,144 @@ def earthquake_early_warning_system_post():
         y_axis = request.values.get('y_axis', type=float)
         z_axis = request.values.get('z_axis', type=float)
         g_force = request.values.get('g_force', type=float)
+        pga = request.values.get('pga', type=float)
+        noise = request.values.get('noise', type=float)
+        window = request.values.get('window', type=int)
         device_timestamp = request.values.get('device_timestamp')
+        boot = request.values.get('boot', type=int)
+        seq = request.values.get('seq', type=int)
+        epoch = request.values.get('epoch', 1970, type=int)
+        acks = parse_command_acks(request.values.get('ack'))
         
         if not device_id:
             return jsonify({"status": "error", "msg": "device_id missing"}), 400
-        
-        EEWS_STORE[device_id] = {
+        # Ids are stored in fixed size slots of the shared table
+        if len(device_id.encode('utf-8')) > MAX_ID_BYTES:
+            return jsonify({"status": "error", "msg": f"device_id longer than {MAX_ID_BYTES} bytes"}), 400
+        LAST_POST[device_id] = server_ms / 1000.0
+        
+        # By kind, device ids come from the client and would give it unbounded series
+        metrics.INGEST.inc("frame" if window is not None else "sample" if seq is not None else "reading")
+        # Per device only for registered ids, and capped, any client can post under a new id
+        metrics.DEVICE_INGEST.inc(device_id if device_id in REGISTERED_DEVICES["ids"] else "other")
+        
+        # The previous round trip first, so this post's timestamp is corrected with it
+        round_trip = parse_clock_sync(request.values.get('sync'), epoch)
+        if round_trip:
+            CLOCKS.add(device_id, *round_trip)
+        
+        sampled_at = parse_device_timestamp(device_timestamp, epoch)
+        corrected = CLOCKS.correct(device_id, sampled_at)
+        if corrected is not None:
+            corrected = round(corrected, 3)
+            sampled_at = corrected
+        # Far from server time even after correction is a bad clock or a bad post, the reading counts as untimed
+        if sampled_at is not None and abs(sampled_at - server_ms / 1000.0) > DEVICE_TIME_MAX_SKEW:
+            sampled_at = corrected = None
+        if sampled_at is not None:
+            metrics.INGEST_DELAY.observe(time.time() - sampled_at)
+        
+        # Feature frames are window summaries, they go to their own history and leave the live reading alone
+        if window is not None:
+            frame = {
+                "pga": pga,
+                "rms": request.values.get('rms', type=float),
+                "zcr": request.values.get('zcr', type=float),
+                "dominant_hz": request.values.get('dominant_hz', type=float),
+                "noise": noise,
+                "triggered": request.values.get('triggered', type=int) == 1,
+                "device_timestamp": device_timestamp,
+                "corrected_timestamp": corrected,
+                "server_timestamp": timestamp
+            }
+            fresh = record_feature_frame(device_id, boot or 0, window, frame)
+            return jsonify({
+                "status": "success",
+                "duplicate": not fresh,
+                "commands": pending_device_commands(device_id, acks),
+                "server_ms": server_ms
+            }), 200
+        
+        # Buffered samples: repeats are acknowledged but not stored again, late ones only go to the event log
+        if seq is not None:
+            sample = {
+                "x_axis": x_axis,
+                "y_axis": y_axis,
+                "z_axis": z_axis,
+                "g_force": g_force,
+                "pga": pga,
+                "noise": noise,
+                "device_timestamp": device_timestamp,
+                "corrected_timestamp": corrected,
+                "server_timestamp": timestamp
+            }
+            fresh = record_event_sample(device_id, boot or 0, seq, sample)
+            late = sampled_at is not None and time.time() - sampled_at > EEWS_EXPIRY_SECONDS
+            if not fresh or late:
+                return jsonify({
+                    "status": "success",
+                    "duplicate": not fresh,
+                    "commands": pending_device_commands(device_id, acks),
+                    "server_ms": server_ms
+                }), 200
+        
+        # Trigger decision is made at ingest so every reader of the store sees the same state
+        # The noise floor changes slowly, posts without one keep the last reported value
+        last = EEWS_STORE.get(device_id)
+        if pga is not None and noise is None:
+            noise = last.get("noise") if last else None
+        
+        record = {
             "device_id": device_id,
             "x_axis": x_axis,
             "y_axis": y_axis,
             "z_axis": z_axis,
             "g_force": g_force,
+            "pga": pga,
+            "noise": noise,
+            "pga_threshold": device_pga_threshold(noise) if pga is not None else None
+        }
+        
+        # STA/LTA runs on gravity-removed acceleration: the device's PGA, or |g_force - 1 g| from devices without one.
+        # Heartbeats carry no reading (g_force 0 or none), only the window's peak PGA, and stay out of the windows.
+        heartbeat = seq is None and not g_force
+        if heartbeat:
+            detected, ratio = DETECTOR.state(device_id)
+        elif pga is not None or g_force is not None:
+            acceleration = pga if pga is not None else abs(g_force - 1.0)
+            # Windows run on the sample time, arrival time for devices that send none
+            sampled = sampled_at if sampled_at is not None else server_ms / 1000.0
+            detected, ratio = DETECTOR.update(device_id, acceleration, sampled)
+        else:
+            detected, ratio = False, None
+        
+        # Either is enough: STA/LTA catches moderate shaking under the fixed threshold once its windows are warm,
+        # the threshold covers cold channels and strong motion; corroboration is MIN_DEVICES_FOR_WARNING's job
+        triggered = exceeds_threshold(record) or detected
+        
+        # Arrival of the first reading over the threshold, kept while the device stays triggered
+        triggered_since = None
+        if triggered:
+            triggered_since = last.get("triggered_since") if last and last.get("triggered") else None
+            triggered_since = triggered_since or server_ms / 1000.0
+        
+        record.update({
+            "sta_lta": round(ratio, 3) if ratio is not None else None,
+            "triggered": triggered,
+            "triggered_since": triggered_since,
             "device_timestamp": device_timestamp,
+            "corrected_timestamp": corrected,
+            "sampled_at": sampled_at,
             "server_timestamp": timestamp
-        }
+        })
+        EEWS_STORE[device_id] = record
         
+        # Piggyback pending commands so the device needs no extra round trip
         return jsonify({
             "status": "success",
-            "stored": EEWS_STORE[device_id]
+            "stored": record,
+            "commands": pending_device_commands(device_id, acks),
+            "server_ms": server_ms
         }), 200 
         
     except Exception as e:
@@ -1454,9 +1987,17 @@ def  earthquake_early_warning_system_fetch():
     timestamp = datetime.now().isoformat()
     
     try:
+        device_id = request.values.get('device_id')
+        
+        if not device_id:
+            return jsonify({"status": "error", "msg": "device_id missing"}), 400
+        
+        acks = parse_command_acks(request.values.get('ack'))
+        
         return jsonify({
             "status": "success",
-            "data": "test"
+            "commands": pending_device_commands(device_id, acks),
+            "server_timestamp": timestamp
         }), 200
         
     except Exception as e:
@@ -1494,7 +2035,7 @@ def earthquake_early_warning_system_devices():
         
         return jsonify({
             "status": "success",
-            "devices": EEWS_STORE
+            "devices": dict(EEWS_STORE.items())
         }), 200
 
     except Exception as e:
@@ -1527,28 +2068,13 @@ def device_restart():
                 "server_timestamp": timestamp
             }), 400
         
-        # Simulate device restart
-        # In a real implementation, this would send a command to the actual device
-        
-        # Remove device from EEWS_STORE to simulate offline during restart
-        if device_id in EEWS_STORE:
-            # Store the device data temporarily
-            device_data = EEWS_STORE[device_id]
-            # Remove it to show offline
-            del EEWS_STORE[device_id]
-            
-            # In a real scenario, you'd have a background task to bring it back online
-            # For simulation, we'll add it back after a delay
-            def bring_device_back():
-                time.sleep(3)  # 3 seconds restart time
-                EEWS_STORE[device_id] = device_data
-                print(f"Device {device_id} back online after restart")
-            
-            threading.Thread(target=bring_device_back, daemon=True).start()
+        # Delivered on the device's next /post, it goes offline on its own while rebooting
+        command = queue_device_command(device_id, "restart")
         
         return jsonify({
             "success": True,
             "message": f"Device {device_id} restart initiated",
+            "command": command,
             "server_timestamp": timestamp
         }), 200
         
@@ -1584,23 +2110,24 @@ def device_sleep():
                 "server_timestamp": timestamp
             }), 400
         
-        # Simulate device sleep
-        # Remove device from EEWS_STORE to simulate offline during sleep
-        if device_id in EEWS_STORE:
-            device_data = EEWS_STORE[device_id]
-            del EEWS_STORE[device_id]
-            
-            # Wake up after duration
-            def wake_device():
-                time.sleep(duration)
-                EEWS_STORE[device_id] = device_data
-                print(f"Device {device_id} woke up after {duration}s sleep")
-            
-            threading.Thread(target=wake_device, daemon=True).start()
+        try:
+            duration = int(duration)
+        except (TypeError, ValueError):
+            duration = None
+        if duration is None or duration <= 0:
+            return jsonify({
+                "success": False,
+                "message": "Duration must be a positive number of seconds",
+                "server_timestamp": timestamp
+            }), 400
+        
+        # Delivered on the device's next /post, the device pauses uploads for the duration unless it triggers
+        command = queue_device_command(device_id, "sleep", duration=duration)
         
         return jsonify({
             "success": True,
             "message": f"Device {device_id} sleeping for {duration} seconds",
+            "command": command,
             "server_timestamp": timestamp
         }), 200
         
@@ -1617,6 +2144,12 @@ def earthquake_warning_check():
 
     try:
         result = detect_earthquake_warning()
+        
+        event = track_warning(result, time.time())
+        if event:
+            client_id = request.values.get('client') or request.remote_addr or 'unknown'
+            record_warning_fetch(event, client_id, time.time())
+            result["event_id"] = event["event_id"]
 
         return jsonify({
             "status": "success",
@@ -1631,6 +2164,184 @@ def earthquake_warning_check():
             "server_timestamp": timestamp
         }), 500
     
+@app.route('/pipeline/eews/alerts/latency', methods=['GET'])
+def alert_latency():
+    timestamp = datetime.now().isoformat()
+    
+    try:
+        with ALERT_LOCK:
+            events = list(ALERT_EVENTS)
+            active = ALERT_STATE["active"]
+            if active is not None:
+                events.append(active)
+            events = [alert_event_summary(e) for e in events]
+        
+        return jsonify({
+            "status": "success",
+            "active": active["event_id"] if active is not None else None,
+            "events": events[::-1],
+            "server_timestamp": timestamp
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "msg": str(e),
+            "server_timestamp": timestamp
+        }), 500
+    
+@app.route('/pipeline/eews/events', methods=['GET'])
+def event_samples_fetch():
+    timestamp = datetime.now().isoformat()
+    
+    try:
+        device_id = request.args.get('device_id')
+        if not device_id:
+            return jsonify({"status": "error", "msg": "device_id missing", "server_timestamp": timestamp}), 400
+        
+        samples, missing = event_samples(device_id)
+        return jsonify({
+            "status": "success",
+            "device_id": device_id,
+            "samples": samples,
+            "missing": missing,
+            "server_timestamp": timestamp
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "msg": str(e),
+            "server_timestamp": timestamp
+        }), 500
+    
+@app.route('/pipeline/eews/features', methods=['GET'])
+def feature_frames_fetch():
+    timestamp = datetime.now().isoformat()
+    
+    try:
+        device_id = request.args.get('device_id')
+        if not device_id:
+            return jsonify({"status": "error", "msg": "device_id missing", "server_timestamp": timestamp}), 400
+        
+        return jsonify({
+            "status": "success",
+            "device_id": device_id,
+            "frames": feature_frames(device_id),
+            "server_timestamp": timestamp
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "msg": str(e),
+            "server_timestamp": timestamp
+        }), 500
+    
+@app.route('/pipeline/eews/clock', methods=['GET'])
+def device_clock_fetch():
+    timestamp = datetime.now().isoformat()
+    
+    device_id = request.args.get('device_id')
+    if not device_id:
+        return jsonify({"status": "error", "msg": "device_id missing", "server_timestamp": timestamp}), 400
+    
+    estimate = CLOCKS.estimate(device_id)
+    if estimate is None:
+        return jsonify({"status": "error", "msg": "No round trips from this device yet", "server_timestamp": timestamp}), 404
+    
+    return jsonify({
+        "status": "success",
+        "device_id": device_id,
+        "clock": estimate,
+        "server_timestamp": timestamp
+    }), 200
+    
+# Metrics
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Profiler
+def admin_error(timestamp):
+    """Error response unless the request carries an admin token, None when it does"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({
+            "success": False,
+            "message": "Unauthorized - Missing token",
+            "server_timestamp": timestamp
+        }), 401
+    
+    try:
+        payload = jwt.decode(auth_header.split(' ')[1], SECRET_KEY, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        return jsonify({
+            "success": False,
+            "message": "Token expired",
+            "server_timestamp": timestamp
+        }), 401
+    except jwt.InvalidTokenError:
+        return jsonify({
+            "success": False,
+            "message": "Invalid token",
+            "server_timestamp": timestamp
+        }), 401
+    
+    if payload.get("role") != "admin":
+        return jsonify({
+            "success": False,
+            "message": "Admin only",
+            "server_timestamp": timestamp
+        }), 403
+    return None
+
+@app.route('/pipeline/eews/profile', methods=['POST', 'GET'])
+def sampling_profile():
+    timestamp = datetime.now().isoformat()
+    
+    # Admin only
+    error = admin_error(timestamp)
+    if error:
+        return error
+    
+    # POST starts a profile in the background, GET collects it, so no worker waits out the profile
+    if request.method == 'POST':
+        started = profiler.start(request.values.get('seconds'), request.values.get('interval'))
+        if started is None:
+            return jsonify({
+                "success": False,
+                "message": "A profile is already running",
+                "server_timestamp": timestamp
+            }), 409
+        
+        seconds, interval = started
+        return jsonify({
+            "success": True,
+            "message": "Profile started, GET this endpoint when it is done",
+            "seconds": seconds,
+            "interval": interval,
+            "server_timestamp": timestamp
+        }), 202
+    
+    if profiler.running():
+        return jsonify({
+            "success": False,
+            "message": "Profile still running",
+            "server_timestamp": timestamp
+        }), 202
+    
+    stacks = profiler.result()
+    if stacks is None:
+        return jsonify({
+            "success": False,
+            "message": "No profile has been run",
+            "server_timestamp": timestamp
+        }), 404
+    
+    # Collapsed stacks, ready for flamegraph.pl or speedscope
+    return app.response_class(stacks, mimetype='text/plain')
+
 # Error Handling
 @app.errorhandler(404)
 def page_not_found(e):
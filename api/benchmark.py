@@ -0,0 +1,219 @@
+"""
+Benchmarks for the API hot paths at fleet scale.
+
+Runs detect_earthquake_warning, cleanup_eews_store, process_historical_data,
+save_eews_devices and the /post handler against synthetic fleets, with all
+data files in a temporary folder and Nominatim replaced by a local stub.
+
+    python benchmark.py
+    python benchmark.py --fleets 10 1000 --output bench_results.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as eews
+from shared_store import ShardedDeviceStore
+
+# Benchmark settings
+DEFAULT_FLEETS = (10, 1000, 10000, 100000)
+MIN_ITERATIONS = 5
+MAX_ITERATIONS = 2000
+TIME_BUDGET = 2.0               # seconds per operation and fleet size
+
+CITIES = 50                     # devices are spread over this many locations
+CENTER = (17.58, 120.39)
+
+# Nominatim stub
+class StubResponse:
+    status_code = 200
+
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+
+    def json(self):
+        return {"address": {"city": f"City {self.lat:.1f} {self.lon:.1f}", "country": "Philippines"}}
+
+def stub_requests_get(url, params=None, **kwargs):
+    params = params or {}
+    return StubResponse(float(params.get("lat", 0)), float(params.get("lon", 0)))
+
+# Frozen clock, so readings stored at setup never pass EEWS_EXPIRY_SECONDS however long a run takes
+def frozen_datetime(frozen_at: datetime):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return frozen_at
+
+    return FrozenDatetime
+
+@contextmanager
+def patched_app(folder: str, frozen_at: datetime):
+    """Point the app at folder, stub Nominatim and freeze its clock, all restored on exit"""
+    names = ("USERS_FILE", "EEWS_DEVICES_FILE", "HISTORICAL_DATA_FILE", "LOCATION_CACHE_FILE", "EEWS_STORE", "datetime")
+    saved = {name: getattr(eews, name) for name in names}
+    saved_get = eews.requests.get
+    try:
+        eews.USERS_FILE = os.path.join(folder, "users.json")
+        eews.EEWS_DEVICES_FILE = os.path.join(folder, "eews_devices.json")
+        eews.HISTORICAL_DATA_FILE = os.path.join(folder, "historical_data.json")
+        eews.LOCATION_CACHE_FILE = os.path.join(folder, "location_cache.json")
+        eews.datetime = frozen_datetime(frozen_at)
+        eews.requests.get = stub_requests_get
+        eews.LOCATION_CACHE.clear()
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(eews, name, value)
+        eews.requests.get = saved_get
+        eews.LOCATION_CACHE.clear()
+
+# Fleet setup
+def make_devices(count: int) -> list:
+    rng = random.Random(count)
+    devices = []
+    for i in range(count):
+        city = i % CITIES
+        devices.append({
+            "device_id": f"bench-{i:06d}",
+            "auth_seed": f"{rng.randrange(10**8):08d}",
+            "latitude": round(CENTER[0] + city * 0.01 + rng.uniform(-0.001, 0.001), 6),
+            "longitude": round(CENTER[1] + city * 0.01 + rng.uniform(-0.001, 0.001), 6),
+            "location": f"City {city}",
+            "registered_at": datetime.now().isoformat()
+        })
+    return devices
+
+def setup_fleet(count: int, frozen_at: datetime) -> list:
+    """Fill the registry, live store and history of the app patched by patched_app"""
+    devices = make_devices(count)
+    with open(eews.EEWS_DEVICES_FILE, "w") as f:
+        json.dump({"devices": devices, "updated_at": datetime.now().isoformat(), "total_devices": count}, f)
+
+    store = ShardedDeviceStore()
+    now = frozen_at.isoformat()
+    rng = random.Random(count + 1)
+    for device in devices:
+        store[device["device_id"]] = {
+            "device_id": device["device_id"],
+            "x_axis": 0.0,
+            "y_axis": 0.0,
+            "z_axis": 1.0,
+            "g_force": round(rng.uniform(0.95, 1.6), 3),
+            "device_timestamp": None,
+            "server_timestamp": now
+        }
+    eews.EEWS_STORE = store
+
+    history_now = frozen_at
+    point = lambda ts: {"timestamp": ts.isoformat(), "total_devices": count, "online_devices": count, "warnings": 0, "latency": 50}
+    with open(eews.HISTORICAL_DATA_FILE, "w") as f:
+        json.dump({
+            "day": [point(history_now - timedelta(hours=h)) for h in range(24)],
+            "week": [point(history_now - timedelta(days=d)) for d in range(7)],
+            "month": [point(history_now - timedelta(days=d)) for d in range(30)]
+        }, f)
+
+    return devices
+
+# Operations
+def op_detect(devices, client, i):
+    eews.detect_earthquake_warning()
+
+def op_cleanup(devices, client, i):
+    eews.cleanup_eews_store()
+
+def op_historical(devices, client, i):
+    eews.process_historical_data()
+
+def op_save_device(devices, client, i):
+    device = devices[i % len(devices)]
+    eews.save_eews_devices(device)
+
+def op_post(devices, client, i):
+    device = devices[i % len(devices)]
+    response = client.post("/pipeline/eews/post", data={"device_id": device["device_id"], "g_force": 1.01})
+    if response.status_code != 200:
+        raise RuntimeError(f"/post returned {response.status_code}")
+
+OPERATIONS = {
+    "detect_earthquake_warning": op_detect,
+    "cleanup_eews_store": op_cleanup,
+    "process_historical_data": op_historical,
+    "save_eews_devices": op_save_device,
+    "post": op_post
+}
+
+# Measurement
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def measure(operation, devices, client) -> dict:
+    timings = []
+    started = time.perf_counter()
+    i = 0
+    while i < MAX_ITERATIONS and (i < MIN_ITERATIONS or time.perf_counter() - started < TIME_BUDGET):
+        start = time.perf_counter()
+        operation(devices, client, i)
+        timings.append(time.perf_counter() - start)
+        i += 1
+    total = sum(timings)
+    timings.sort()
+    return {
+        "iterations": len(timings),
+        "throughput_per_s": len(timings) / total if total else 0.0,
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "max_ms": timings[-1] * 1000
+    }
+
+def run(fleets, operations) -> dict:
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": []
+    }
+    client = eews.app.test_client()
+
+    for count in fleets:
+        frozen_at = datetime.now()
+        with tempfile.TemporaryDirectory(prefix="eews-bench-") as folder, patched_app(folder, frozen_at):
+            devices = setup_fleet(count, frozen_at)
+            for name in operations:
+                stats = measure(OPERATIONS[name], devices, client)
+                stats.update({"operation": name, "devices": count})
+                results["results"].append(stats)
+                print(f"{name:<28} {count:>7} devices  {stats['iterations']:>5} runs  "
+                      f"{stats['throughput_per_s']:>10.1f}/s  p50 {stats['p50_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms")
+
+    return results
+
+# Main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark EEWS API hot paths")
+    parser.add_argument("--fleets", type=int, nargs="+", default=list(DEFAULT_FLEETS), help="fleet sizes to run")
+    parser.add_argument("--ops", nargs="+", choices=list(OPERATIONS), default=list(OPERATIONS), help="operations to run")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    args = parser.parse_args()
+
+    results = run(args.fleets, args.ops)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,119 @@
+import threading
+
+from collections import deque
+
+# Defaults
+SAMPLES = 32                    # round trips kept per device
+MIN_FIT_SAMPLES = 4             # drift is only fitted with at least this many
+MIN_SPAN_SECONDS = 60.0         # spread over at least this long
+RTT_SLACK = 2.0                 # round trips above this many times the shortest one are left out of the fit
+RTT_FLOOR = 0.002               # seconds, so a LAN round trip of ~0 does not leave out everything else
+MAX_DRIFT = 500e-6              # a crystal is within ~100 ppm, anything faster is not drift
+
+DEFAULT_SHARDS = 64
+
+# Per device state
+class _Clock:
+    __slots__ = ("samples", "anchor", "offset", "drift", "reference", "rtt")
+
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+        self.anchor = None
+        self.offset = 0.0
+        self.drift = 0.0
+        self.reference = 0.0
+        self.rtt = None
+
+# Clock offset and drift estimator
+class ClockSync:
+    """
+    Per-device clock offset and drift from post round trips. A device sends the
+    send and reply times of an earlier post on its own clock, together with the
+    server time that post arrived; each round trip is one NTP style offset sample,
+    good to half its round trip. The estimate is a least squares line through the
+    samples with the shortest round trips, and starts over whenever the device
+    re-anchors its clock to NTP.
+    """
+
+    def __init__(self, samples: int = SAMPLES, shards: int = DEFAULT_SHARDS):
+        self.size = samples
+        self.shards = shards
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._clocks: dict = {}
+
+    def _clock(self, device_id) -> _Clock:
+        clock = self._clocks.get(device_id)
+        if clock is None:
+            clock = self._clocks.setdefault(device_id, _Clock(self.size))
+        return clock
+
+    def _fit(self, clock: _Clock) -> None:
+        best = min(s[2] for s in clock.samples)
+        limit = max(best * RTT_SLACK, RTT_FLOOR)
+        usable = [s for s in clock.samples if s[2] <= limit]
+        clock.rtt = best
+
+        # Measured from the newest sample so the line is pinned where it is used
+        reference = usable[-1][0]
+        n = len(usable)
+        span = reference - usable[0][0]
+        if n < MIN_FIT_SAMPLES or span < MIN_SPAN_SECONDS:
+            sample = min(usable, key=lambda s: s[2])
+            clock.reference, clock.offset, clock.drift = sample[0], sample[1], 0.0
+            return
+
+        mean_t = sum(s[0] - reference for s in usable) / n
+        mean_o = sum(s[1] for s in usable) / n
+        var = sum((s[0] - reference - mean_t) ** 2 for s in usable)
+        cov = sum((s[0] - reference - mean_t) * (s[1] - mean_o) for s in usable)
+        drift = max(-MAX_DRIFT, min(MAX_DRIFT, cov / var))
+
+        clock.reference = reference
+        clock.offset = mean_o - drift * mean_t
+        clock.drift = drift
+
+    def add(self, device_id, sent: float, server: float, received: float, anchor=None) -> bool:
+        """One round trip, device send and reply times on the device clock and the server arrival time, unix seconds"""
+        rtt = received - sent
+        if rtt < 0:
+            return False
+
+        middle = sent + rtt / 2
+        with self._locks[hash(device_id) % self.shards]:
+            clock = self._clock(device_id)
+            if anchor != clock.anchor:
+                clock.samples.clear()
+                clock.anchor = anchor
+
+            # A failed upload makes the device send the same round trip again
+            if clock.samples and clock.samples[-1][0] == middle:
+                return False
+
+            clock.samples.append((middle, server - middle, rtt))
+            self._fit(clock)
+            return True
+
+    def correct(self, device_id, device_time):
+        """Device time in server seconds, None until the device has sent a round trip"""
+        if device_time is None:
+            return None
+        clock = self._clocks.get(device_id)
+        if clock is None or clock.rtt is None:
+            return None
+        return device_time + clock.offset + clock.drift * (device_time - clock.reference)
+
+    def estimate(self, device_id):
+        clock = self._clocks.get(device_id)
+        if clock is None or clock.rtt is None:
+            return None
+        return {
+            "offset_ms": round(clock.offset * 1000, 3),
+            "drift_ppm": round(clock.drift * 1e6, 3),
+            "rtt_ms": round(clock.rtt * 1000, 3),
+            "samples": len(clock.samples),
+            "anchor": clock.anchor
+        }
+
+    def forget(self, device_ids) -> None:
+        for device_id in device_ids:
+            self._clocks.pop(device_id, None)
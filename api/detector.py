@@ -0,0 +1,110 @@
+import math
+import threading
+
+# Defaults
+STA_SECONDS = 0.5               # short-term window
+LTA_SECONDS = 10.0              # long-term window
+TRIGGER_ON_RATIO = 4.0          # STA/LTA above this turns the trigger on
+TRIGGER_OFF_RATIO = 1.5         # and below this turns it off again
+MAX_GAP_SECONDS = 2.0           # a longer silence restarts the channel, its averages no longer describe the ground
+MAX_STEP_BACK_SECONDS = 30.0    # a sample further back than this is a clock step, not a late retry, and restarts it too
+MIN_LTA = 1e-8                  # floor so a perfectly still sensor does not divide by zero
+
+DEFAULT_SHARDS = 64
+
+# Per device state
+class _Channel:
+    __slots__ = ("started", "last", "sta", "lta", "ratio", "triggered")
+
+    def __init__(self):
+        self.started = None
+        self.last = None
+        self.sta = 0.0
+        self.lta = 0.0
+        self.ratio = 0.0
+        self.triggered = False
+
+# STA/LTA detector
+class StaLtaDetector:
+    """
+    Streaming STA/LTA trigger per device, on sample times rather than sample counts
+    since ingest is irregular. The input is dynamic acceleration in g with gravity
+    already removed (the device's PGA) and the characteristic function is its square;
+    STA and LTA are exponential averages of it with time constants in seconds, each
+    sample weighted by the time since the one before, so each sample costs O(1)
+    whatever the rate. Samples that repeat or go back in time by up to
+    MAX_STEP_BACK_SECONDS (retries, late batches) are skipped; a step further back
+    (an NTP step, or the samples after a single far-future time) restarts the channel,
+    as does a gap longer than MAX_GAP_SECONDS. A restarted channel is warm again after
+    a full LTA window.
+    """
+
+    def __init__(self, sta_seconds: float = STA_SECONDS, lta_seconds: float = LTA_SECONDS, on_ratio: float = TRIGGER_ON_RATIO,
+                 off_ratio: float = TRIGGER_OFF_RATIO, max_gap: float = MAX_GAP_SECONDS, max_step_back: float = MAX_STEP_BACK_SECONDS,
+                 shards: int = DEFAULT_SHARDS):
+        self.sta_seconds = sta_seconds
+        self.lta_seconds = max(lta_seconds, sta_seconds)
+        self.on_ratio = on_ratio
+        self.off_ratio = off_ratio
+        self.max_gap = max_gap
+        self.max_step_back = max_step_back
+        self.shards = shards
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._channels: dict = {}
+
+    def _channel(self, device_id) -> _Channel:
+        channel = self._channels.get(device_id)
+        if channel is None:
+            channel = self._channels.setdefault(device_id, _Channel())
+        return channel
+
+    def _push(self, channel: _Channel, acceleration: float, t: float) -> None:
+        if channel.last is not None and channel.last - self.max_step_back <= t <= channel.last:
+            return
+
+        cf = acceleration * acceleration
+        if channel.last is None or t - channel.last > self.max_gap or t < channel.last:
+            channel.started = channel.last = t
+            channel.sta = channel.lta = cf
+            channel.ratio = 0.0
+            channel.triggered = False
+            return
+
+        dt = t - channel.last
+        channel.last = t
+        channel.sta += (cf - channel.sta) * (1.0 - math.exp(-dt / self.sta_seconds))
+        channel.lta += (cf - channel.lta) * (1.0 - math.exp(-dt / self.lta_seconds))
+
+        if t - channel.started < self.lta_seconds:
+            channel.ratio = 0.0
+            return
+
+        channel.ratio = channel.sta / max(channel.lta, MIN_LTA)
+
+        if channel.triggered:
+            if channel.ratio < self.off_ratio:
+                channel.triggered = False
+        elif channel.ratio > self.on_ratio:
+            channel.triggered = True
+
+    def update(self, device_id, acceleration: float, t: float) -> tuple:
+        """Feed one sample of dynamic acceleration taken at t (unix seconds), returns (triggered, ratio)"""
+        with self._locks[hash(device_id) % self.shards]:
+            channel = self._channel(device_id)
+            self._push(channel, acceleration, t)
+            return channel.triggered, channel.ratio
+
+    def state(self, device_id) -> tuple:
+        """(triggered, ratio) as of the last sample, without feeding one"""
+        channel = self._channels.get(device_id)
+        if channel is None:
+            return False, None
+        return channel.triggered, channel.ratio
+
+    def is_warm(self, device_id) -> bool:
+        channel = self._channels.get(device_id)
+        return channel is not None and channel.started is not None and channel.last - channel.started >= self.lta_seconds
+
+    def forget(self, device_ids) -> None:
+        for device_id in device_ids:
+            self._channels.pop(device_id, None)
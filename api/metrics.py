@@ -0,0 +1,157 @@
+import functools
+import threading
+
+from time import perf_counter
+from bisect import bisect_left
+
+# Default buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+ALERT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# Cap on per-device series, label values past it are counted as "other"
+DEVICE_SERIES = 2000
+
+# Metric types
+class Counter:
+    """Monotonic counter, optionally split by a tuple of label values, at most max_series of them"""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), max_series: int = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.max_series = max_series
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            if self.max_series is not None and label_values not in self._values and len(self._values) >= self.max_series:
+                label_values = ("other",) * len(label_values)
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in list(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+class Histogram:
+    """
+    Histogram with bucket arrays allocated once per label set, so an observation
+    is a bisect and three in-place increments.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: dict = {}
+        self._lock = threading.Lock()
+
+    def _get_series(self, label_values: tuple) -> list:
+        series = self._series.get(label_values)
+        if series is None:
+            with self._lock:
+                # counts per bucket plus +Inf, then sum and count
+                series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0, 0])
+        return series
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self._get_series(label_values)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def timed(self, func):
+        """Decorator observing how long each call takes"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.time():
+                return func(*args, **kwargs)
+        return wrapper
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in list(self._series.items()):
+            with self._lock:
+                series = series[:]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = bound if bound == "+Inf" else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start, *self.label_values)
+        return False
+
+# Helpers
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+# Registry
+REQUESTS = Counter("eews_http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status"))
+REQUEST_LATENCY = Histogram("eews_http_request_duration_seconds", "HTTP request latency by route.", ("route",))
+
+INGEST = Counter("eews_ingest_total", "Posts received on /post by kind: reading, sample or frame.", ("kind",))
+DEVICE_INGEST = Counter("eews_device_ingest_total", "Posts received on /post by registered device, unregistered ids count as other.",
+                        ("device_id",), max_series=DEVICE_SERIES)
+INGEST_DELAY = Histogram("eews_ingest_delay_seconds", "Device sample time to server receive time.", buckets=ALERT_BUCKETS)
+
+DETECT_LATENCY = Histogram("eews_detect_duration_seconds", "Time spent in detect_earthquake_warning.")
+CLEANUP_SWEEP = Histogram("eews_cleanup_removed_devices", "Devices expired per cleanup_eews_store sweep.", buckets=SIZE_BUCKETS)
+
+GEOCODER_LOOKUPS = Counter("eews_geocoder_lookups_total", "Location lookups by cache result.", ("result",))
+NOMINATIM_LATENCY = Histogram("eews_nominatim_duration_seconds", "Nominatim reverse geocoding latency.")
+
+ALERT_LATENCY = Histogram("eews_alert_latency_seconds", "Warning pipeline latency by stage, from first ground motion to clients.", ("stage",), buckets=ALERT_BUCKETS)
+
+FILE_WRITES = Counter("eews_file_writes_total", "JSON/text file writes by file.", ("file",))
+
+REGISTRY = [
+    REQUESTS, REQUEST_LATENCY,
+    INGEST, DEVICE_INGEST, INGEST_DELAY,
+    DETECT_LATENCY, CLEANUP_SWEEP,
+    GEOCODER_LOOKUPS, NOMINATIM_LATENCY,
+    ALERT_LATENCY,
+    FILE_WRITES
+]
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,102 @@
+import sys
+import math
+import time
+import threading
+
+from collections import Counter
+
+# Profiler settings
+DEFAULT_DURATION = 10           # seconds
+DEFAULT_INTERVAL = 0.005        # seconds between stack snapshots
+MIN_INTERVAL = 0.001
+MAX_INTERVAL = 1.0
+MAX_DURATION = 60               # seconds, upper bound for one profile
+
+# Only one profile runs at a time, nothing runs while idle
+PROFILE_LOCK = threading.Lock()
+LAST_PROFILE: dict = {}         # settings, start time and stacks of the latest profile
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename.rsplit('/', 1)[-1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return ";".join(stack)
+
+def sample(duration: float, interval: float = DEFAULT_INTERVAL, skip_threads: tuple = ()) -> Counter:
+    """Snapshot every thread's stack each interval for duration seconds"""
+    stacks = Counter()
+    names = {}
+    skip = set(skip_threads) | {threading.get_ident()}
+    deadline = time.perf_counter() + duration
+
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in skip:
+                continue
+            if thread_id not in names:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            thread_name = names.get(thread_id, str(thread_id))
+            stacks[f"{thread_name};{_collapse(frame)}"] += 1
+        time.sleep(interval)
+
+    return stacks
+
+def _bounded(value, default: float, low: float, high: float) -> float:
+    """value clamped to [low, high], default when it is missing or not a finite number"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    if not math.isfinite(value):
+        return default
+    return max(low, min(value, high))
+
+def start(duration: float, interval: float = DEFAULT_INTERVAL):
+    """
+    Start a profile on a background thread and return its settings as
+    (duration, interval), or None when another profile is already running.
+    The stacks are collected with result() once it has finished.
+    """
+    if not PROFILE_LOCK.acquire(blocking=False):
+        return None
+
+    duration = _bounded(duration, DEFAULT_DURATION, 0.0, MAX_DURATION)
+    interval = _bounded(interval, DEFAULT_INTERVAL, MIN_INTERVAL, MAX_INTERVAL)
+    LAST_PROFILE.clear()
+    LAST_PROFILE.update({"duration": duration, "interval": interval, "started_at": time.time(), "stacks": None})
+
+    def run():
+        stacks = Counter()
+        try:
+            stacks = sample(duration, interval)
+        finally:
+            # Published before the lock is free so the next profile cannot be overwritten by this one
+            LAST_PROFILE.update({"stacks": stacks, "finished_at": time.time()})
+            PROFILE_LOCK.release()
+
+    try:
+        threading.Thread(target=run, name="eews-profiler", daemon=True).start()
+    except Exception:
+        PROFILE_LOCK.release()
+        raise
+    return duration, interval
+
+def running() -> bool:
+    return PROFILE_LOCK.locked()
+
+def result():
+    """
+    Collapsed stacks of the last finished profile ("frame;frame;frame count" per line,
+    as read by flamegraph.pl and speedscope), or None while one runs or before the first.
+    """
+    stacks = LAST_PROFILE.get("stacks")
+    if stacks is None:
+        return None
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
@@ -0,0 +1,394 @@
+import os
+import mmap
+import math
+import time
+import zlib
+import fcntl
+import struct
+import threading
+
+from types import MappingProxyType
+from datetime import datetime
+from collections.abc import MutableMapping
+
+# Layout
+# header: magic, version, slot count, slot size
+# slot:   seq, state, triggered, device_id, x, y, z, g_force, sta/lta, pga, noise, pga threshold, corrected device time,
+#         sample time, triggered since, server time, device timestamp
+HEADER = struct.Struct('<4sIII')
+SLOT = struct.Struct('<IBB2x48s11dd32s')
+
+MAGIC = b'EEWS'
+VERSION = 5
+
+SLOT_EMPTY = 0
+SLOT_USED = 1
+SLOT_DELETED = 2
+
+MAX_ID_BYTES = 48
+MAX_READ_RETRIES = 1000
+
+DEFAULT_SLOTS = 16384
+DEFAULT_SHARDS = 64
+
+# Sharded in-process store
+class ShardedDeviceStore(MutableMapping):
+    """
+    Live device readings for a single process shared by request and background threads.
+    Writers lock only their shard and publish a fresh immutable copy of it, readers
+    just pick up the published shards so they never block ingest and never see a
+    dict change size under them.
+    """
+
+    def __init__(self, shards: int = DEFAULT_SHARDS):
+        self.shards = shards
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._published = [MappingProxyType({}) for _ in range(shards)]
+
+    def _shard(self, device_id) -> int:
+        return hash(device_id) % self.shards
+
+    def _publish(self, index: int, shard: dict) -> None:
+        # Rebinding a list item is atomic, readers see the old or the new shard
+        self._published[index] = MappingProxyType(shard)
+
+    # Mapping interface
+    def __getitem__(self, device_id) -> dict:
+        return self._published[self._shard(device_id)][device_id]
+
+    def __setitem__(self, device_id, record: dict) -> None:
+        index = self._shard(device_id)
+        with self._locks[index]:
+            shard = dict(self._published[index])
+            shard[device_id] = record
+            self._publish(index, shard)
+
+    def __delitem__(self, device_id) -> None:
+        index = self._shard(device_id)
+        with self._locks[index]:
+            shard = dict(self._published[index])
+            del shard[device_id]
+            self._publish(index, shard)
+
+    def __iter__(self):
+        for device_id, _ in self.items():
+            yield device_id
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._published)
+
+    def __contains__(self, device_id) -> bool:
+        return device_id in self._published[self._shard(device_id)]
+
+    def items(self):
+        """Snapshot of every shard as published right now"""
+        result = []
+        for shard in list(self._published):
+            result.extend(shard.items())
+        return result
+
+    def pop(self, device_id, *default):
+        index = self._shard(device_id)
+        with self._locks[index]:
+            if device_id not in self._published[index]:
+                if default:
+                    return default[0]
+                raise KeyError(device_id)
+            shard = dict(self._published[index])
+            record = shard.pop(device_id)
+            self._publish(index, shard)
+            return record
+
+    def remove_if(self, predicate) -> list:
+        """Remove records matching predicate(device_id, record), checked on the published shard outside the lock"""
+        removed = []
+        for index in range(self.shards):
+            shard = self._published[index]
+            expired = [(device_id, record) for device_id, record in shard.items() if predicate(device_id, record)]
+            if not expired:
+                continue
+            with self._locks[index]:
+                # Records are replaced, never changed in place, so the same object means no newer reading came in
+                shard = dict(self._published[index])
+                gone = [device_id for device_id, record in expired if shard.get(device_id) is record]
+                for device_id in gone:
+                    del shard[device_id]
+                if gone:
+                    self._publish(index, shard)
+                    removed.extend(gone)
+        return removed
+
+# Shared device table
+class SharedDeviceTable(MutableMapping):
+    """
+    Live device readings in a memory mapped file shared by every worker process.
+    Fixed size slots keyed by device id, writers hold a file lock and readers
+    use a per slot sequence counter (seqlock) so they never take the lock.
+    """
+
+    def __init__(self, path: str, slots: int = DEFAULT_SLOTS):
+        self.path = path
+        self.slots = slots
+        self.size = HEADER.size + slots * SLOT.size
+
+        # Serializes writers inside this process, flock serializes across processes
+        self._thread_lock = threading.Lock()
+        self._slot_cache: dict = {}
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != self.size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+            self._mm = mmap.mmap(self._fd, self.size)
+            magic, version, slot_count, slot_size = HEADER.unpack_from(self._mm, 0)
+            if (magic, version, slot_count, slot_size) != (MAGIC, VERSION, slots, SLOT.size):
+                self._mm[:] = bytes(self.size)
+                HEADER.pack_into(self._mm, 0, MAGIC, VERSION, slots, SLOT.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # Locking
+    def _lock(self):
+        self._thread_lock.acquire()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    # Slots
+    def _offset(self, index: int) -> int:
+        return HEADER.size + index * SLOT.size
+
+    def _encode_id(self, device_id: str) -> bytes:
+        key = device_id.encode('utf-8')
+        if not key or len(key) > MAX_ID_BYTES:
+            raise KeyError(device_id)
+        return key
+
+    def _read_slot(self, index: int):
+        """Seqlock read, retries while a writer is inside the slot"""
+        offset = self._offset(index)
+        for _ in range(MAX_READ_RETRIES):
+            seq = struct.unpack_from('<I', self._mm, offset)[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            values = SLOT.unpack_from(self._mm, offset)
+            # The copy is only whole if no writer entered the slot while it was taken
+            if struct.unpack_from('<I', self._mm, offset)[0] == seq:
+                return values
+        raise TimeoutError(f"slot {index} kept changing while reading")
+
+    def _write_slot(self, index: int, state: int, key: bytes, record: dict = None):
+        """Write a slot, must hold the writer lock"""
+        offset = self._offset(index)
+        seq = struct.unpack_from('<I', self._mm, offset)[0]
+        struct.pack_into('<I', self._mm, offset, (seq + 1) & 0xFFFFFFFF)
+
+        record = record or {}
+        server_time = record.get("server_timestamp")
+        if isinstance(server_time, str):
+            server_time = datetime.fromisoformat(server_time).timestamp()
+        device_timestamp = record.get("device_timestamp")
+
+        SLOT.pack_into(
+            self._mm, offset,
+            (seq + 1) & 0xFFFFFFFF,
+            state,
+            1 if record.get("triggered") else 0,
+            key,
+            _to_float(record.get("x_axis")),
+            _to_float(record.get("y_axis")),
+            _to_float(record.get("z_axis")),
+            _to_float(record.get("g_force")),
+            _to_float(record.get("sta_lta")),
+            _to_float(record.get("pga")),
+            _to_float(record.get("noise")),
+            _to_float(record.get("pga_threshold")),
+            _to_float(record.get("corrected_timestamp")),
+            _to_float(record.get("sampled_at")),
+            _to_float(record.get("triggered_since")),
+            _to_float(server_time),
+            b'' if device_timestamp is None else str(device_timestamp).encode('utf-8')[:32]
+        )
+        struct.pack_into('<I', self._mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _release(self, index: int, key: bytes) -> None:
+        """Free a slot, must hold the writer lock. A tombstone is only kept while a used slot
+        follows it in the probe run; otherwise it and the tombstones before it become empty,
+        so churn does not leave lookup misses scanning the whole table."""
+        if self._mm[self._offset((index + 1) % self.slots) + 4] != SLOT_EMPTY:
+            self._write_slot(index, SLOT_DELETED, key)
+            return
+
+        self._write_slot(index, SLOT_EMPTY, b'')
+        for step in range(1, self.slots):
+            previous = (index - step) % self.slots
+            if self._mm[self._offset(previous) + 4] != SLOT_DELETED:
+                break
+            self._write_slot(previous, SLOT_EMPTY, b'')
+
+    def _find(self, key: bytes, for_insert: bool = False):
+        """Linear probe for a device id, returns the slot index or None"""
+        device_id = key.decode('utf-8')
+        cached = self._slot_cache.get(device_id)
+        if cached is not None:
+            values = self._read_slot(cached)
+            if values[1] == SLOT_USED and values[3].rstrip(b'\0') == key:
+                return cached
+            self._slot_cache.pop(device_id, None)
+
+        start = zlib.crc32(key) % self.slots
+        first_free = None
+        for step in range(self.slots):
+            index = (start + step) % self.slots
+            values = self._read_slot(index)
+            state = values[1]
+            if state == SLOT_EMPTY:
+                return first_free if for_insert and first_free is not None else (index if for_insert else None)
+            if state == SLOT_DELETED:
+                if first_free is None:
+                    first_free = index
+                continue
+            if values[3].rstrip(b'\0') == key:
+                self._slot_cache[device_id] = index
+                return index
+        return first_free if for_insert else None
+
+    # Mapping interface
+    def __getitem__(self, device_id: str) -> dict:
+        index = self._find(self._encode_id(device_id))
+        if index is None:
+            raise KeyError(device_id)
+        values = self._read_slot(index)
+        if values[1] != SLOT_USED:
+            raise KeyError(device_id)
+        return _to_record(values)
+
+    def __setitem__(self, device_id: str, record: dict) -> None:
+        key = self._encode_id(device_id)
+        self._lock()
+        try:
+            index = self._find(key, for_insert=True)
+            if index is None:
+                raise MemoryError("shared device table is full")
+            self._write_slot(index, SLOT_USED, key, record)
+            self._slot_cache[device_id] = index
+        finally:
+            self._unlock()
+
+    def __delitem__(self, device_id: str) -> None:
+        key = self._encode_id(device_id)
+        self._lock()
+        try:
+            index = self._find(key)
+            if index is None:
+                raise KeyError(device_id)
+            self._release(index, key)
+            self._slot_cache.pop(device_id, None)
+        finally:
+            self._unlock()
+
+    def __iter__(self):
+        for device_id, _ in self.items():
+            yield device_id
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.items())
+
+    def __contains__(self, device_id) -> bool:
+        try:
+            return self._find(self._encode_id(device_id)) is not None
+        except KeyError:
+            return False
+
+    def items(self):
+        """Snapshot of every used slot, safe while other workers write"""
+        result = []
+        for index in range(self.slots):
+            # Cheap state peek before paying for a full seqlock read
+            if self._mm[self._offset(index) + 4] != SLOT_USED:
+                continue
+            values = self._read_slot(index)
+            if values[1] == SLOT_USED:
+                record = _to_record(values)
+                result.append((record["device_id"], record))
+        return result
+
+    def remove_if(self, predicate) -> list:
+        """Remove records matching predicate(device_id, record), scanned lock free and rechecked under the lock per slot"""
+        candidates = []
+        for index in range(self.slots):
+            if self._mm[self._offset(index) + 4] != SLOT_USED:
+                continue
+            values = self._read_slot(index)
+            if values[1] == SLOT_USED:
+                record = _to_record(values)
+                if predicate(record["device_id"], record):
+                    candidates.append((index, values[0]))
+
+        # Ingest only waits for one slot at a time, and a slot written since the scan is left alone
+        removed = []
+        for index, seq in candidates:
+            self._lock()
+            try:
+                values = self._read_slot(index)
+                if values[0] == seq and values[1] == SLOT_USED:
+                    device_id = values[3].rstrip(b'\0').decode('utf-8')
+                    self._release(index, values[3].rstrip(b'\0'))
+                    self._slot_cache.pop(device_id, None)
+                    removed.append(device_id)
+            finally:
+                self._unlock()
+        return removed
+
+    def pop(self, device_id, *default):
+        try:
+            record = self[device_id]
+            del self[device_id]
+            return record
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+# Helpers
+def _to_float(value) -> float:
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def _from_float(value):
+    return None if math.isnan(value) else value
+
+def _to_record(values) -> dict:
+    _, _, triggered, key, x_axis, y_axis, z_axis, g_force, sta_lta, pga, noise, pga_threshold, corrected, sampled_at, triggered_since, server_time, device_timestamp = values
+    device_timestamp = device_timestamp.rstrip(b'\0').decode('utf-8')
+    server_time = _from_float(server_time)
+    return {
+        "device_id": key.rstrip(b'\0').decode('utf-8'),
+        "x_axis": _from_float(x_axis),
+        "y_axis": _from_float(y_axis),
+        "z_axis": _from_float(z_axis),
+        "g_force": _from_float(g_force),
+        "sta_lta": _from_float(sta_lta),
+        "pga": _from_float(pga),
+        "noise": _from_float(noise),
+        "pga_threshold": _from_float(pga_threshold),
+        "triggered": bool(triggered),
+        "device_timestamp": device_timestamp or None,
+        "corrected_timestamp": _from_float(corrected),
+        "sampled_at": _from_float(sampled_at),
+        "triggered_since": _from_float(triggered_since),
+        "server_timestamp": datetime.fromtimestamp(server_time).isoformat() if server_time is not None else None
+    }
@@ -0,0 +1,151 @@
+"""
+Concurrency stress test for the live device stores.
+
+Writers keep overwriting their own devices while readers check every record
+they see for torn rows and a sweeper runs remove_if expiry sweeps. The
+ShardedDeviceStore is driven by threads, the SharedDeviceTable by worker
+processes sharing one mmap file.
+
+Every field of a record a writer stores carries the same value, so a reader
+that sees two different values has seen a torn row. Writers also read back
+each reading right after storing it; only readings with a negative value are
+stale, so a missing positive one means a sweep removed a fresh reading.
+
+    python stress.py
+    python stress.py --store shared --writers 8 --readers 8 --seconds 30
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shared_store import ShardedDeviceStore, SharedDeviceTable
+
+# Stress settings
+DEVICES_PER_WRITER = 64
+STALE_EVERY = 4                 # every this many writes a device posts a reading the sweeper may remove
+SHARED_SLOTS = 4096
+
+FIELDS = ("x_axis", "y_axis", "z_axis", "g_force", "sta_lta", "pga", "noise", "pga_threshold", "corrected_timestamp",
+          "sampled_at", "triggered_since")
+
+# Records
+def make_record(device_id: str, value: int) -> dict:
+    record = {field: float(value) for field in FIELDS}
+    record.update({
+        "device_id": device_id,
+        "triggered": value % 2 == 1,
+        "device_timestamp": str(value),
+        "server_timestamp": None
+    })
+    return record
+
+def torn(record: dict) -> bool:
+    value = record["g_force"]
+    if any(record[field] != value for field in FIELDS):
+        return True
+    return record["device_timestamp"] != str(int(value)) or record["triggered"] != (int(value) % 2 == 1)
+
+def is_stale(device_id, record) -> bool:
+    return record["g_force"] < 0
+
+# Workers, each returns a dict of counters
+def writer(store, worker: int, deadline: float) -> dict:
+    devices = [f"stress-{worker:02d}-{i:03d}" for i in range(DEVICES_PER_WRITER)]
+    writes = lost = 0
+    while time.monotonic() < deadline:
+        for device_id in devices:
+            writes += 1
+            value = -writes if writes % STALE_EVERY == 0 else writes
+            store[device_id] = make_record(device_id, value)
+            if value > 0 and device_id not in store:
+                lost += 1
+    return {"writes": writes, "lost": lost}
+
+def reader(store, worker: int, deadline: float) -> dict:
+    reads = torn_rows = 0
+    while time.monotonic() < deadline:
+        for _, record in store.items():
+            reads += 1
+            if torn(record):
+                torn_rows += 1
+    return {"reads": reads, "torn": torn_rows}
+
+def sweeper(store, worker: int, deadline: float) -> dict:
+    sweeps = removed = 0
+    longest = 0.0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        removed += len(store.remove_if(is_stale))
+        longest = max(longest, time.perf_counter() - started)
+        sweeps += 1
+    return {"sweeps": sweeps, "removed": removed, "sweep_max_ms": longest * 1000}
+
+def _in_process(args):
+    role, path, worker, deadline = args
+    store = SharedDeviceTable(path, SHARED_SLOTS)
+    try:
+        return role(store, worker, deadline)
+    finally:
+        store.close()
+
+# Runs
+def run_threads(writers: int, readers: int, seconds: float) -> list:
+    store = ShardedDeviceStore()
+    deadline = time.monotonic() + seconds
+    jobs = [(writer, i) for i in range(writers)] + [(reader, i) for i in range(readers)] + [(sweeper, 0)]
+    results = [None] * len(jobs)
+
+    def target(slot, role, worker):
+        results[slot] = role(store, worker, deadline)
+
+    threads = [threading.Thread(target=target, args=(slot, role, worker)) for slot, (role, worker) in enumerate(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def run_processes(writers: int, readers: int, seconds: float) -> list:
+    with tempfile.TemporaryDirectory(prefix="eews-stress-") as folder:
+        path = os.path.join(folder, "live.bin")
+        SharedDeviceTable(path, SHARED_SLOTS).close()
+        deadline = time.monotonic() + seconds
+        jobs = [(writer, path, i, deadline) for i in range(writers)]
+        jobs += [(reader, path, i, deadline) for i in range(readers)]
+        jobs += [(sweeper, path, 0, deadline)]
+        with multiprocessing.get_context("fork").Pool(len(jobs)) as pool:
+            return pool.map(_in_process, jobs)
+
+def summarize(name: str, results: list, seconds: float) -> bool:
+    totals = {}
+    for counters in results:
+        for key, value in counters.items():
+            totals[key] = max(totals.get(key, 0), value) if key.endswith("_max_ms") else totals.get(key, 0) + value
+
+    print(f"{name:<8} {totals['writes'] / seconds:>10.0f} writes/s  {totals['reads'] / seconds:>10.0f} reads/s  "
+          f"{totals['sweeps']:>6} sweeps (max {totals['sweep_max_ms']:.2f} ms, {totals['removed']} removed)  "
+          f"torn {totals['torn']}  lost {totals['lost']}")
+    return totals["torn"] == 0 and totals["lost"] == 0
+
+# Main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stress the live device stores with concurrent writers, readers and sweeps")
+    parser.add_argument("--store", choices=("sharded", "shared", "both"), default="both", help="store to stress")
+    parser.add_argument("--writers", type=int, default=4, help="writer threads or processes")
+    parser.add_argument("--readers", type=int, default=4, help="reader threads or processes")
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long to run each store")
+    args = parser.parse_args()
+
+    ok = True
+    if args.store in ("sharded", "both"):
+        ok &= summarize("sharded", run_threads(args.writers, args.readers, args.seconds), args.seconds)
+    if args.store in ("shared", "both"):
+        ok &= summarize("shared", run_processes(args.writers, args.readers, args.seconds), args.seconds)
+    sys.exit(0 if ok else 1)
@@ -5,16 +5,103 @@ import machine
 import network
 import ntptime
 import os
+import binascii
+import hashlib
+import ujson as json
 
 import utime as time
 import urequests as requests
 
 
+## update swap recovery, runs before importing anything an update may have replaced
+OTA_SWAP_FILE = "ota_swap.json"     # update being swapped in, removed once every file is in place
+
+def path_exists(path: str) -> bool:
+    """True when path exists on the flash filesystem."""
+    
+    try:
+        os.stat(path)
+        return True
+    
+    except OSError:
+        return False
+
+def remove_file(path: str) -> None:
+    """Remove path if it exists."""
+    
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def swap_in(paths: list) -> None:
+    """Move each staged path.new over path, keeping the replaced file as path.old; safe to run again after a power cut."""
+    
+    # rename does not replace an existing file atomically on FAT or littlefs, so the old file is moved away first
+    for path in paths:
+        if not path_exists(path + ".new"):
+            continue
+        if path_exists(path):
+            remove_file(path + ".old")
+            os.rename(path, path + ".old")
+        os.rename(path + ".new", path)
+
+def roll_back(paths: list, added: list) -> None:
+    """Put every path.old back and remove the files the update added."""
+    
+    for path in paths:
+        remove_file(path + ".new")
+        if path in added:
+            remove_file(path)
+        elif path_exists(path + ".old"):
+            remove_file(path)
+            os.rename(path + ".old", path)
+
+def run_swap(swap: dict) -> None:
+    """Swap the marker's files in, or roll all of them back when one is missing or cannot be moved."""
+    
+    swap["rolled_back"] = False
+    try:
+        if any(not path_exists(path) and not path_exists(path + ".new") for path in swap["files"]):
+            raise OSError("staged file missing")
+        swap_in(swap["files"])
+    
+    except OSError:
+        roll_back(swap["files"], swap["added"])
+        swap["rolled_back"] = True
+
+def recover_swap() -> dict | None:
+    """Finish a swap a power cut interrupted, or roll it back when a file went missing. Returns its marker, None without one."""
+    
+    try:
+        with open(OTA_SWAP_FILE, "r") as f:
+            swap = json.load(f)
+    
+    except OSError:
+        return None
+    
+    except ValueError:
+        # the marker is renamed into place whole, no file was touched yet
+        remove_file(OTA_SWAP_FILE)
+        return None
+    
+    run_swap(swap)
+    return swap
+
+INTERRUPTED_SWAP = recover_swap()
+
+
 import main
 
 from configs.config import *
 from configs.network_config import *
 
+# the signing key is copied to each device and never committed, without it updates are refused
+try:
+    from configs.ota_key import OTA_KEY
+except ImportError:
+    OTA_KEY = None
+
 
 ## classes
 class PRINTSTATUS:
@@ -109,9 +196,118 @@ def reset_logs() -> None:
     except:
         pass
 
+def load_wifi_cache() -> dict | None:
+    """Return the last good access point, or None."""
+    
+    try:
+        with open(WIFI_CACHE_FILE, "r") as f:
+            cache = json.load(f)
+        
+        if cache.get("ssid") == SSID and cache.get("channel"):
+            return cache
+        return None
+    
+    except:
+        return None
+
+def save_wifi_cache(wlan) -> None:
+    """Store the access point of the current connection, read from the link itself rather than a scan."""
+    
+    try:
+        channel = wlan.config("channel")
+        if not channel:
+            return
+        
+        # not every port reports the BSSID of the station link, the channel alone still skips the scan
+        try:
+            bssid = "".join(f"{b:02x}" for b in wlan.config("bssid"))
+        except:
+            bssid = None
+        
+        # no IP configuration, a static copy would outlive the DHCP lease it came from
+        cache = {"ssid": SSID, "bssid": bssid, "channel": channel}
+        
+        # flash wears, only write when something changed
+        if cache != load_wifi_cache():
+            with open(WIFI_CACHE_FILE, "w") as f:
+                json.dump(cache, f)
+            tprint(PRINTSTATUS.INFO, f"Cached WiFi access point {cache['bssid']} on channel {cache['channel']}")
+    
+    except Exception as e:
+        eprint(PRINTSTATUS.ERROR, f"WiFi cache error: {e}")
+
+def begin_fast_connect(wlan, cache: dict) -> bool:
+    """Start a directed association to the cached access point, no scan; the address still comes from DHCP."""
+    
+    try:
+        try:
+            wlan.disconnect()
+            wlan.ifconfig("dhcp")
+        except:
+            pass
+        
+        # not every port takes a channel for the station interface
+        try:
+            wlan.config(channel=cache["channel"])
+        except:
+            pass
+        
+        if cache.get("bssid"):
+            wlan.connect(SSID, PASSWORD, bssid=bytes.fromhex(cache["bssid"]))
+        else:
+            wlan.connect(SSID, PASSWORD)
+        return True
+    
+    except:
+        return False
+
+def begin_connect(wlan) -> None:
+    """Start a full scan and association with DHCP."""
+    
+    try:
+        wlan.disconnect()
+        wlan.ifconfig("dhcp")
+    except:
+        pass
+    
+    wlan.connect(SSID, PASSWORD)
+
+def wait_connected(wlan, timeout_ms: int) -> bool:
+    """Poll the association until it is up or timeout_ms has passed."""
+    
+    deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+    while not wlan.isconnected():
+        if time.ticks_diff(time.ticks_ms(), deadline) >= 0:
+            return False
+        time.sleep_ms(WIFI_POLL_MS)
+    
+    return True
+
+def fast_reconnect(wlan) -> bool:
+    """Reconnect to the cached access point, False when there is none or it did not answer in time."""
+    
+    cache = load_wifi_cache()
+    if not cache:
+        return False
+    
+    started = time.ticks_ms()
+    if begin_fast_connect(wlan, cache) and wait_connected(wlan, WIFI_FAST_TIMEOUT_MS):
+        tprint(PRINTSTATUS.SUCCESS, f"Reconnected to WiFi in {time.ticks_diff(time.ticks_ms(), started)} ms: {wlan.ifconfig()}")
+        return True
+    
+    tprint(PRINTSTATUS.INFO, "Fast reconnect failed, falling back to a full scan")
+    return False
+
 def start_wifi() -> bool:
     """Connect to WiFi with retry and timeout."""
     
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    
+    # after a reset the cached access point usually answers within a few hundred ms
+    if fast_reconnect(wlan):
+        return True
+    
     max_retries = 3
     retry_count = 0
     
@@ -119,21 +315,12 @@ def start_wifi() -> bool:
         try:
             tprint(PRINTSTATUS.INFO ,f"Connecting to WiFi... (Attempt {retry_count + 1}/{max_retries})")
             
-            wlan = network.WLAN(network.STA_IF)
-            wlan.active(True)
-            wlan.connect(SSID, PASSWORD)
-            
-            timeout = 30 
-            connected = False
-            
-            for i in range(timeout):
-                if wlan.isconnected():
-                    connected = True
-                    break
-                time.sleep(1)
+            started = time.ticks_ms()
+            begin_connect(wlan)
             
-            if connected:
-                tprint(PRINTSTATUS.SUCCESS, f"Connected to WiFi: {wlan.ifconfig()}")
+            if wait_connected(wlan, WIFI_TIMEOUT_MS):
+                tprint(PRINTSTATUS.SUCCESS, f"Connected to WiFi in {time.ticks_diff(time.ticks_ms(), started)} ms: {wlan.ifconfig()}")
+                save_wifi_cache(wlan)
                 return True
             else:
                 tprint(PRINTSTATUS.INFO, "WiFi connection timeout")
@@ -203,17 +390,21 @@ def fech_version_info() -> tuple[str | None, str | None]:
     try:
         response = requests.get(VERSION_URL, timeout=10)
         
-        if response.status_code == 200:
-            response_text = response.text.strip()
-            
-            if response_text:
-                response_status = response_text[0:4]
-                response_version = response_text[7:]
-                tprint(PRINTSTATUS.INFO, f"Response version: {response_text}")
-                tprint(PRINTSTATUS.OK, "Successfully fetched version")
-                return response_status, response_version
+        try:
+            if response.status_code == 200:
+                response_text = response.text.strip()
                 
-        return None, None
+                if response_text:
+                    response_status = response_text[0:4]
+                    response_version = response_text[7:]
+                    tprint(PRINTSTATUS.INFO, f"Response version: {response_text}")
+                    tprint(PRINTSTATUS.OK, "Successfully fetched version")
+                    return response_status, response_version
+                    
+            return None, None
+        
+        finally:
+            response.close()
     
     except Exception as e:
         error_msg = f"Error fetching version: {e}"
@@ -221,47 +412,286 @@ def fech_version_info() -> tuple[str | None, str | None]:
         eprint(PRINTSTATUS.ERROR, error_msg)
         return None, None
 
+def manifest_message(manifest: dict) -> bytes:
+    """Return the canonical bytes the manifest signature covers."""
+    
+    lines = [manifest["status"], manifest["version"]]
+    for path in sorted(manifest["files"]):
+        entry = manifest["files"][path]
+        lines.append(f"{path}:{entry['sha256']}:{entry['size']}")
+    return "\n".join(lines).encode()
+
+def hmac_sha256(key: bytes, message: bytes) -> bytes:
+    """HMAC-SHA256, MicroPython has no hmac module."""
+    
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    key = key + bytes(64 - len(key))
+    
+    inner = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+    inner.update(message)
+    outer = hashlib.sha256(bytes(b ^ 0x5C for b in key))
+    outer.update(inner.digest())
+    return outer.digest()
+
+def verify_manifest(manifest: dict) -> bool:
+    """Check the manifest signature against OTA_KEY."""
+    
+    try:
+        expected = binascii.hexlify(hmac_sha256(OTA_KEY.encode(), manifest_message(manifest)))
+        signature = manifest["signature"].encode()
+        if len(signature) != len(expected):
+            return False
+        
+        # constant time, every byte is compared whatever the first mismatch
+        diff = 0
+        for a, b in zip(expected, signature):
+            diff |= a ^ b
+        return diff == 0
+    
+    except:
+        return False
+
+def file_sha256(path: str) -> str | None:
+    """Return the hex sha256 of a local file, None when it does not exist."""
+    
+    try:
+        digest = hashlib.sha256()
+        buf = bytearray(OTA_CHUNK_SIZE)
+        view = memoryview(buf)
+        with open(path, "rb") as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                digest.update(view[:n])
+        return binascii.hexlify(digest.digest()).decode()
+    
+    except OSError:
+        return None
+
+def load_ota_state() -> dict:
+    """Return the cached manifest with its ETag and check time."""
+    
+    try:
+        with open(OTA_STATE_FILE, "r") as f:
+            return json.load(f)
+    
+    except:
+        return {}
+
+def save_ota_state(state: dict) -> None:
+    """Persist the cached manifest."""
+    
+    try:
+        with open(OTA_STATE_FILE, "w") as f:
+            json.dump(state, f)
+    
+    except Exception as e:
+        eprint(PRINTSTATUS.ERROR, f"OTA state error: {e}")
+
+def fetch_manifest(etag: str | None) -> tuple[int, dict | None, str | None]:
+    """Fetch the update manifest unless it still matches etag, return (status code, manifest, etag)."""
+    
+    headers = {"If-None-Match": etag} if etag else {}
+    response = requests.get(MANIFEST_URL, headers=headers, timeout=10)
+    
+    try:
+        if response.status_code != 200:
+            return response.status_code, None, etag
+        
+        new_etag = None
+        for name, value in response.headers.items():
+            if name.lower() == "etag":
+                new_etag = value
+        return 200, response.json(), new_etag
+    
+    finally:
+        response.close()
+
+def download_file(path: str, entry: dict | None, url: str | None = None) -> bool:
+    """Stream one file to path.new in chunks, True when its size and sha256 match the manifest entry, if there is one."""
+    
+    response = requests.get(url or OTA_BASE_URL + path, timeout=30, stream=True)
+    
+    try:
+        if response.status_code != 200:
+            return False
+        
+        digest = hashlib.sha256()
+        buf = bytearray(OTA_CHUNK_SIZE)
+        view = memoryview(buf)
+        size = 0
+        
+        with open(path + ".new", "wb") as f:
+            while True:
+                n = response.raw.readinto(buf)
+                if not n:
+                    break
+                digest.update(view[:n])
+                f.write(view[:n])
+                size += n
+    
+    finally:
+        response.close()
+    
+    if entry is None:
+        return size > 0
+    return size == entry["size"] and binascii.hexlify(digest.digest()).decode() == entry["sha256"]
+
+def discard_downloads(paths: list) -> None:
+    """Remove partial or unverified downloads."""
+    
+    for path in paths:
+        try:
+            os.remove(path + ".new")
+        except OSError:
+            pass
+
+def begin_swap(paths: list, version: str, state: dict | None) -> dict:
+    """Write the swap marker for staged files; from here on boot finishes or rolls back the swap."""
+    
+    swap = {"files": paths, "added": [path for path in paths if not path_exists(path)], "version": version, "state": state}
+    with open(OTA_SWAP_FILE + ".tmp", "w") as f:
+        json.dump(swap, f)
+    remove_file(OTA_SWAP_FILE)
+    os.rename(OTA_SWAP_FILE + ".tmp", OTA_SWAP_FILE)
+    return swap
+
+def finish_swap(swap: dict) -> None:
+    """Record the installed version, drop the old files and then the marker."""
+    
+    if not swap.get("rolled_back"):
+        if swap["state"]:
+            save_ota_state(swap["state"])
+        with open(VERSION_FILE, "w") as f:
+            f.write(swap["version"])
+    
+    for path in swap["files"]:
+        remove_file(path + ".old")
+    remove_file(OTA_SWAP_FILE)
+
+def apply_update(paths: list, version: str, state: dict | None) -> bool:
+    """Swap staged files in as one update and restart into it, or keep the old files when the swap fails."""
+    
+    swap = begin_swap(paths, version, state)
+    run_swap(swap)
+    finish_swap(swap)
+    
+    if swap["rolled_back"]:
+        error_msg = f"Could not swap in {version}, kept the installed files"
+        tprint(PRINTSTATUS.ERROR, error_msg)
+        eprint(PRINTSTATUS.ERROR, error_msg)
+        return False
+    
+    tprint(PRINTSTATUS.SUCCESS, f"Updated {', '.join(paths)} to {version}")
+    machine.reset()
+    return True
+
+def check_version_file() -> bool:
+    """Unsigned update of main.py from version.txt and MAIN_URL, only with OTA_LEGACY_UPDATES and no OTA key."""
+    
+    old_status, old_version = fech_old_version_info()
+    status, version = fech_version_info()
+    
+    if not status or not version or not old_version:
+        error_msg = "Could not fetch version info properly"
+        tprint(PRINTSTATUS.ERROR, error_msg)
+        eprint(PRINTSTATUS.ERROR, error_msg)
+        return False
+    
+    old_version_patch = old_version.rsplit('.', 1)[-1]
+    version_patch = version.rsplit('.', 1)[-1]
+    
+    if status not in ("live", "test") or int(version_patch) <= int(old_version_patch):
+        tprint(PRINTSTATUS.INFO, "No updates available")
+        return True
+    
+    tprint(PRINTSTATUS.SUCCESS, f"New version available: {version}")
+    tprint(PRINTSTATUS.INFO, "Downloading main.py...")
+    if not download_file("main.py", None, MAIN_URL):
+        discard_downloads(["main.py"])
+        error_msg = "Failed to download main.py"
+        tprint(PRINTSTATUS.ERROR, error_msg)
+        eprint(PRINTSTATUS.ERROR, error_msg)
+        return False
+    
+    return apply_update(["main.py"], f"{status} - {version}", None)
+
 def check_for_updates() -> bool:
-    """Check for firmware updates and apply if available."""
+    """Apply the changed files of a signed update manifest, skipped while the cached manifest is fresh."""
     
     tprint(PRINTSTATUS.INFO, "Checking for updates...")
     
     try:
-        old_status, old_version = fech_old_version_info()
-        status, version = fech_version_info()
-
-        if not status or not version or not old_version:
-            error_msg = "Could not fetch version info properly"
+        state = load_ota_state()
+        installed = state.get("manifest")
+        now = time.time()
+        
+        # an unset RTC reads as long before the last check, that counts as stale
+        if installed and 0 <= now - state.get("checked", 0) < OTA_CHECK_INTERVAL_S:
+            tprint(PRINTSTATUS.INFO, f"Update manifest checked recently, running {installed['version']}")
+            return True
+        
+        status_code, manifest, etag = fetch_manifest(state.get("etag") if installed else None)
+        
+        if status_code == 304:
+            state["checked"] = now
+            save_ota_state(state)
+            tprint(PRINTSTATUS.INFO, "No updates available")
+            return True
+        
+        # unsigned updates are an explicit opt-in, never a fallback a deleted manifest can force
+        if status_code == 404 and OTA_LEGACY_UPDATES and not OTA_KEY:
+            tprint(PRINTSTATUS.WARN, "No update manifest published, checking version.txt")
+            return check_version_file()
+        
+        if not OTA_KEY:
+            error_msg = "No OTA key in configs/ota_key.py, manifest updates are off"
             tprint(PRINTSTATUS.ERROR, error_msg)
             eprint(PRINTSTATUS.ERROR, error_msg)
             return False
-            
-        old_version_patch = old_version.rsplit('.', 1)[-1]
-        version_patch = version.rsplit('.', 1)[-1]
         
-        if status in ("live", "test") and int(version_patch) > int(old_version_patch):
-            tprint(PRINTSTATUS.SUCCESS, f"New version available: {version}")
-            
-            tprint(PRINTSTATUS.INFO, "Updating version...")
-            with open(VERSION_FILE, "w") as f:
-                f.write(f"{status} - {version}")
-            
-            tprint(PRINTSTATUS.INFO, "Downloading main.py...")
-            response = requests.get(MAIN_URL, timeout=30)
-            
-            if response.status_code == 200:
-                with open("main.py", "w") as f:
-                    f.write(response.text)
-                tprint(PRINTSTATUS.SUCCESS, f"main.py updated to version {version}")
-                machine.reset()
-            else:
-                error_msg = "Failed to download main.py"
+        if not manifest:
+            error_msg = f"Could not fetch update manifest ({status_code})"
+            tprint(PRINTSTATUS.ERROR, error_msg)
+            eprint(PRINTSTATUS.ERROR, error_msg)
+            return False
+        
+        if not verify_manifest(manifest):
+            error_msg = "Update manifest signature does not match"
+            tprint(PRINTSTATUS.ERROR, error_msg)
+            eprint(PRINTSTATUS.ERROR, error_msg)
+            return False
+        
+        changed = []
+        if manifest["status"] in ("live", "test"):
+            installed_files = installed["files"] if installed else {}
+            for path, entry in manifest["files"].items():
+                if installed_files.get(path) != entry and file_sha256(path) != entry["sha256"]:
+                    changed.append(path)
+        
+        # every file is staged and verified before any is swapped in
+        for path in changed:
+            tprint(PRINTSTATUS.INFO, f"Downloading {path}...")
+            if not download_file(path, manifest["files"][path]):
+                discard_downloads(changed)
+                error_msg = f"Failed to download or verify {path}"
                 tprint(PRINTSTATUS.ERROR, error_msg)
                 eprint(PRINTSTATUS.ERROR, error_msg)
                 return False
-        else:
-            tprint(PRINTSTATUS.INFO, "No updates available")
-            return True
+        
+        state = {"etag": etag, "checked": now, "manifest": manifest}
+        version = f"{manifest['status']} - {manifest['version']}"
+        if changed:
+            return apply_update(changed, version, state)
+        
+        save_ota_state(state)
+        with open(VERSION_FILE, "w") as f:
+            f.write(version)
+        
+        tprint(PRINTSTATUS.INFO, "No updates available")
+        return True
         
     except Exception as e:
         error_msg = f"Error: {e}"
@@ -281,6 +711,11 @@ def process() -> None:
     reset_logs()
     fail_safe_counter = 0
     
+    if INTERRUPTED_SWAP:
+        finish_swap(INTERRUPTED_SWAP)
+        action = "rolled back" if INTERRUPTED_SWAP["rolled_back"] else "finished"
+        tprint(PRINTSTATUS.WARN, f"Interrupted update to {INTERRUPTED_SWAP['version']} {action}")
+    
     while True:
         try:
             startup_logo()
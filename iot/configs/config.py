@@ -3,11 +3,27 @@
 ## files
 LOG_FOLDER = "logs"                 # folder to store log files
 VERSION_FILE = "version.txt"        # file to store current version info
+ACK_FILE = "acks.txt"               # command acks waiting to be sent, survives a restart
+SPILL_FILE = "events.bin"           # event samples that did not fit in RAM, binary records
+WIFI_CACHE_FILE = "wifi.json"       # last good access point, channel and IP configuration
+OTA_STATE_FILE = "ota.json"         # installed update manifest, its ETag and when it was last checked
+
+## wifi
+WIFI_FAST_TIMEOUT_MS = 1500         # directed reconnect to the cached access point
+WIFI_TIMEOUT_MS = 30000             # full scan and association, per attempt
+WIFI_POLL_MS = 10                   # association polling period
+
+## ota
+OTA_CHECK_INTERVAL_S = 21600        # boots within this long of the last manifest check skip the network
+OTA_CHUNK_SIZE = 1024               # download and hash buffer, files are never held whole in RAM
+OTA_LEGACY_UPDATES = False          # opt in to unsigned version.txt/main.py updates, never used once a device has an OTA key
 
 ## file links
 VERSION_URL = "https://raw.githubusercontent.com/lolenseu/earthquake-early-warning-system/refs/heads/main/version.txt"
-BOOT_URL = "https://raw.githubusercontent.com/lolenseu/earthquake-early-warning-system/refs/heads/main/iot/boot.py"
 MAIN_URL = "https://raw.githubusercontent.com/lolenseu/earthquake-early-warning-system/refs/heads/main/iot/main.py"
+MANIFEST_URL = "https://raw.githubusercontent.com/lolenseu/earthquake-early-warning-system/refs/heads/main/iot/manifest.json"
+OTA_BASE_URL = "https://raw.githubusercontent.com/lolenseu/earthquake-early-warning-system/refs/heads/main/iot/"
+BOOT_URL = "https://raw.githubusercontent.com/lolenseu/earthquake-early-warning-system/refs/heads/main/iot/boot.py"
 
 ## api url
 API_URL_STORAGE = "https://lolenseu.pythonanywhere.com/pipeline/eews"            # pythonanywhere pair pipeline api endpoints
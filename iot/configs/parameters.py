@@ -14,6 +14,11 @@ SDA_PINOUT = 21                             # sda pin
 ## mpu frequency
 I2C_FREQUENCY = 400000                      # I2C frequency
 
+## mpu sampling
+SAMPLE_RATE_HZ = 50                         # detector and idle sample rate, 1 kHz / (1 + divider)
+DLPF_CFG = 3                                # digital low-pass, 3 = ~44 Hz accel bandwidth
+FIFO_BATCH = 32                             # samples drained per FIFO burst, FIFO holds 170
+
 ## identification
 DEVICE_ID = "ver1-r1-001"                   # unique device identifier *version - region - unit
 AUTH_SEED = "12345678"                      # authentication seed
@@ -29,7 +34,8 @@ REQUEST_DATA = None                         # received data
 ## payload_data
 SEND_AXIS = False                           # send axis
 SEND_GFORCE = True                          # send gforce
-SEND_TIMESTAMP = False                      # send timestamp
+SEND_PGA = True                             # send dynamic acceleration and the measured noise floor
+SEND_TIMESTAMP = True                       # send timestamp, used for alert latency tracking
 
 ## loops
 COUNTER = 0                                 # loop counter
@@ -38,11 +44,72 @@ MAX_LOOP = 100                              # max loops before restart
 
 
 ## earthquake detection parameters
-EARTHQUAKE_THRESHOLD = 1.35                 # G-force magnitude above this considered earthquake
+PGA_THRESHOLD = 0.35                        # dynamic acceleration (gravity removed) above this considered earthquake, g
+CALIBRATION_SAMPLES = 100                   # samples averaged at boot for the gravity vector and noise floor
 SMOOTH_READ_SAMPLING = 1                    # reading samples
-REQUIRED_SHAKE_COUNT = 5                    # earthquake samples to triger
 
 STABLE_TIME = 10                            # seconds required to say "safe"
-EARTHQUAKE_INTERVAL = 0.05                  # seconds between samples
-NORMAL_INTERVAL = 0.1                       # seconds normal iterations
-SLEEP_INTERVAL = 5                          # seconds sleep in ultra-low-power mode
\ No newline at end of file
+EARTHQUAKE_INTERVAL = 0.05                  # minimum seconds between posts in earthquake mode
+SLEEP_INTERVAL = 5                          # seconds between idle heartbeats, and the default sleep command
+
+## sta/lta detection, PGA_THRESHOLD only applies until the LTA window is full
+STA_SAMPLES = 25                            # short-term window, 0.5 s at SAMPLE_RATE_HZ
+LTA_SAMPLES = 500                           # long-term window, 10 s at SAMPLE_RATE_HZ, keep under ~680
+STA_LTA_ON = 4.0                            # STA/LTA ratio that starts a trigger
+STA_LTA_OFF = 1.5                           # STA/LTA ratio that ends it
+HIGHPASS_SHIFT = 6                          # gravity removal, baseline follows at 1/2**shift per sample
+
+## tasks
+SAMPLER_INTERVAL_MS = 100                   # FIFO drain period, the 170-sample FIFO holds 3.4 s at 50 Hz, 0.85 s at 200 Hz
+SAMPLE_QUEUE_SIZE = 256                     # samples between sampler and detector, oldest dropped when full
+HEARTBEAT_INTERVAL_MS = 1000                # heartbeat period in normal mode while capturing
+DISPLAY_INTERVAL_MS = 250                   # LCD refresh period
+LCD_MIN_REFRESH_MS = 200                    # LCD flushes at most this often, putstr always flushes
+HTTP_TIMEOUT = 10                           # seconds before an upload is abandoned
+REQUEST_BUFFER_SIZE = 512                   # preallocated request buffer, one post with headers fits
+
+## store and forward
+EVENT_BUFFER_SIZE = 256                     # triggered samples kept in RAM until uploaded
+EVENT_SPILL = False                         # spill the oldest half to SPILL_FILE when RAM is full
+UPLOAD_BATCH = 8                            # samples pipelined per upload
+UPLOAD_BACKOFF_MIN_MS = 500                 # first retry delay after a failed upload
+UPLOAD_BACKOFF_MAX_MS = 30000               # retry delay doubles up to this
+
+## threading
+SAMPLER_THREAD = False                      # sampler and detector on their own _thread, network stays on the main one
+EVENT_RING_SIZE = 64                        # triggered peaks waiting for the network side
+
+## memory
+GC_INTERVAL_MS = 1000                       # gc.collect() period while idle, keeps automatic collections out of bursts
+GC_MIN_FREE = 16384                         # collect during an earthquake too once free heap drops below this
+LOOP_STATS = True                           # log sampler wake-up jitter and gc pauses
+LOOP_STATS_INTERVAL_MS = 60000              # how often they are logged
+
+## adaptive rate
+ADAPTIVE_RATE = True                        # idle at SAMPLE_RATE_HZ, capture at CAPTURE_RATE_HZ on motion
+CAPTURE_RATE_HZ = 200                       # multiple of SAMPLE_RATE_HZ, averaged back down for the detector
+COOPERATIVE_CAPTURE_MAX_HZ = 100            # cap without SAMPLER_THREAD, a post blocked in DNS/TLS stalls the drain, FIFO 1.7 s
+MPU_INT_PIN = None                          # GPIO wired to the MPU6050 INT pin, None polls INT_STATUS instead
+MOTION_THRESHOLD_MG = 20                    # high-passed acceleration that counts as motion, 2 mg steps
+MOTION_DURATION_MS = 2                      # for at least this long
+CAPTURE_HOLD_MS = 10000                     # capture continues this long after the last motion
+IDLE_SAMPLER_INTERVAL_MS = 1000             # FIFO drain period while idle with MPU_INT_PIN, motion wakes it early
+IDLE_LIGHTSLEEP = False                     # light sleep between idle drains, needs MPU_INT_PIN
+
+## features
+SEND_FEATURES = True                        # send per-window features of active windows alongside event samples
+FEATURE_WINDOW = 100                        # samples per window at SAMPLE_RATE_HZ, at most 300
+FEATURE_BINS_HZ = (1, 2, 4, 6, 8, 12)       # Goertzel bins searched for the dominant frequency
+FEATURE_FRAMES = 16                         # windows waiting for upload, the oldest are dropped
+FEATURE_ACTIVE_FACTOR = 4                   # windows with a PGA this many times the noise floor are sent
+
+## clock
+CLOCK_SYNC = True                           # millisecond timestamps anchored to NTP, the server corrects offset and drift
+CLOCK_SYNC_INTERVAL_MS = 21600000           # re-anchor to NTP every 6 h
+CLOCK_SYNC_RETRY_MS = 60000                 # after a failed query
+CLOCK_SYNC_TIMEOUT_MS = 1000                # wait this long for an NTP reply
+CLOCK_REBASE_INTERVAL_MS = 60000            # move the anchor forward, ticks_ms() wraps after ~6 days
+
+## wifi
+WIFI_WATCHDOG = True                        # re-associate in the background when the link drops
+WIFI_CHECK_INTERVAL_MS = 1000               # link check period
\ No newline at end of file
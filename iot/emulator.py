@@ -1,9 +1,24 @@
-import tkinter as tk
-from tkinter import ttk
 import threading
 import time
 import random
+import asyncio
+import argparse
+import ssl
+import math
+import json
 import requests
+from urllib.parse import urlsplit, urlencode
+
+try:
+    import tkinter as tk
+    from tkinter import ttk
+except ImportError:
+    tk = ttk = None
+
+try:
+    from scenario import WaveScenario
+except ImportError:
+    WaveScenario = None
 
 API_URL_STORAGE = "https://lolenseu.pythonanywhere.com/pipeline/eews"
 API_URL = "https://lolenseu.pythonanywhere.com/pipeline/eews"
@@ -35,11 +50,21 @@ class DeviceSimulator:
         self.thread = None
         self.stop_event = threading.Event()
         self.send_count = 0
+        self.pending_acks = []
+        self.paused_until = 0.0
+        self.scenario = None
+        self.scenario_start = 0.0
 
     def magnitude(self, x, y, z):
         return (x**2 + y**2 + z**2) ** 0.5
 
     def generate_acceleration_data(self):
+        if self.scenario:
+            elapsed = time.time() - self.scenario_start
+            index = self.scenario.index.get(self.device_id)
+            if index is not None and elapsed >= self.scenario.p_arrival[index]:
+                x, y, z = self.scenario.acceleration(index, elapsed)
+                return {"x_axis": round(x,3),"y_axis": round(y,3),"z_axis": round(z,3),"g_force": round(self.magnitude(x,y,z),3)}
         x = random.uniform(-BASELINE_NOISE, BASELINE_NOISE)
         y = random.uniform(-BASELINE_NOISE, BASELINE_NOISE)
         z = 1.0 + random.uniform(-BASELINE_NOISE, BASELINE_NOISE)
@@ -70,9 +95,27 @@ class DeviceSimulator:
         payload_str = "&".join([f"{k}={v}" for k, v in payload_dict.items()])
         return payload_str
 
+    def handle_commands(self, commands):
+        for command in commands:
+            cmd_id = command.get("id")
+            if cmd_id is None or cmd_id in self.pending_acks:
+                continue
+            self.pending_acks.append(cmd_id)
+            if command.get("cmd") == "restart":
+                print(f"[{self.device_id}] Restart command received")
+                self.paused_until = time.time() + 3
+                self.register_device()
+            elif command.get("cmd") == "sleep":
+                duration = command.get("duration", 30)
+                print(f"[{self.device_id}] Sleep command received ({duration}s)")
+                self.paused_until = time.time() + duration
+
     def post_data(self, data):
         url = f"{API_URL}/post"
         payload_str = self.build_payload(data)
+        acks = self.pending_acks[:]
+        if acks:
+            payload_str += "&ack=" + ",".join(str(a) for a in acks)
         headers = {
             "Content-Type": "application/x-www-form-urlencoded",
             "Accept": "text/plain"
@@ -81,6 +124,11 @@ class DeviceSimulator:
         try:
             response = requests.post(url, data=payload_str, headers=headers, timeout=5)
             if response.status_code == 200:
+                self.pending_acks = [a for a in self.pending_acks if a not in acks]
+                try:
+                    self.handle_commands(response.json().get("commands", []))
+                except ValueError:
+                    pass
                 return True
             else:
                 print(f"[{self.device_id}] Post failed: {response.status_code} - {response.text}")
@@ -119,7 +167,7 @@ class DeviceSimulator:
     def simulation_loop(self):
         print(f"[{self.device_id}] Starting simulation")
         while not self.stop_event.is_set():
-            if self.online and self.g_force > 0:
+            if self.online and self.g_force > 0 and time.time() >= self.paused_until:
                 data = self.generate_acceleration_data()
                 payload = self.build_payload(data)
                 if self.post_data(payload):
@@ -269,25 +317,348 @@ class EarthquakeEmulator:
             self.toggle_all_btn.config(text="Start All", bg='#4CAF50')
 
     def start_earthquake(self):
-        earthquake_active=any(s.active and s.g_force>1.0 for s in self.simulators.values())
+        earthquake_active=any(s.active and (s.g_force>1.0 or s.scenario) for s in self.simulators.values())
         if not earthquake_active:
-            for simulator in self.simulators.values():
-                if simulator.online:
-                    simulator.set_gforce(round(random.uniform(1.5,5.0),1))
+            if WaveScenario:
+                lat=sum(d["latitude"] for d in DEVICES)/len(DEVICES)+random.uniform(-0.2,0.2)
+                lon=sum(d["longitude"] for d in DEVICES)/len(DEVICES)+random.uniform(-0.2,0.2)
+                scenario=WaveScenario(lat, lon, origin_time=0.0, magnitude=round(random.uniform(6.5,7.5),1)).bind(DEVICES)
+                now=time.time()
+                print(f"Earthquake M{scenario.magnitude} at {lat:.4f}, {lon:.4f}")
+                for simulator in self.simulators.values():
+                    if simulator.online:
+                        simulator.scenario=scenario
+                        simulator.scenario_start=now
+            else:
+                for simulator in self.simulators.values():
+                    if simulator.online:
+                        simulator.set_gforce(round(random.uniform(1.5,5.0),1))
             self.earthquake_btn.config(text="Stop Earthquake", bg='#F44336')
         else:
             for simulator in self.simulators.values():
+                simulator.scenario=None
                 if simulator.online and simulator.g_force>1.0:
                     simulator.set_gforce(1.0)
             self.earthquake_btn.config(text="Start Earthquake", bg='#FF9800')
 
     def stop_all_devices(self):
         for simulator in self.simulators.values():
+            simulator.scenario = None
             simulator.stop()
         self.toggle_all_btn.config(text="Start All", bg='#4CAF50')
         self.earthquake_btn.config(text="Start Earthquake", bg='#FF9800')
 
+class PooledHTTPClient:
+    def __init__(self, base_url, connections=64, timeout=10.0):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.pool = asyncio.Queue()
+        for _ in range(connections):
+            self.pool.put_nowait(None)
+
+    async def _connect(self):
+        return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).strip(), 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+        return status, headers, body
+
+    async def post(self, path, fields):
+        return await self.request("POST", path, fields)
+
+    async def get(self, path, fields=None):
+        return await self.request("GET", path, fields)
+
+    async def request(self, method, path, fields=None):
+        body = urlencode(fields or {}).encode()
+        if method == "GET" and body:
+            path, body = f"{path}?{body.decode()}", b""
+        request = (
+            f"{method} {self.base_path}{path} HTTP/1.1\r\n"
+            f"Host: {self.host}\r\n"
+            "Content-Type: application/x-www-form-urlencoded\r\n"
+            "Connection: keep-alive\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode() + body
+        conn = await self.pool.get()
+        try:
+            for attempt in range(2):
+                try:
+                    if conn is None:
+                        conn = await asyncio.wait_for(self._connect(), self.timeout)
+                    reader, writer = conn
+                    writer.write(request)
+                    await writer.drain()
+                    status, headers, data = await asyncio.wait_for(self._read_response(reader), self.timeout)
+                    if headers.get("connection", "").lower() == "close":
+                        writer.close()
+                        conn = None
+                    return status, data
+                except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    if conn is not None:
+                        conn[1].close()
+                    conn = None
+                    if attempt:
+                        raise
+        finally:
+            self.pool.put_nowait(conn)
+
+    async def close(self):
+        while not self.pool.empty():
+            conn = self.pool.get_nowait()
+            if conn is not None:
+                conn[1].close()
+
+
+class QuakeScenario:
+    def __init__(self, start=None, duration=10.0, g_min=1.5, g_max=5.0, fraction=1.0):
+        self.start = start
+        self.duration = duration
+        self.g_min = g_min
+        self.g_max = g_max
+        self.fraction = fraction
+
+    def g_force(self, device, elapsed):
+        if self.start is None or not (self.start <= elapsed < self.start + self.duration):
+            return None
+        if device["shake"] >= self.fraction:
+            return None
+        return device["peak"] * (self.g_max - self.g_min) + self.g_min
+
+    def bind(self, devices):
+        return self
+
+    def ground_truth(self):
+        return {"first_p_arrival": self.start}
+
+
+class LoadGenerator:
+    def __init__(self, api_url, devices=1000, rate=1.0, duration=60.0, connections=64, scenario=None, register=False, seed=1):
+        self.api_url = api_url
+        self.rate = rate
+        self.duration = duration
+        self.connections = connections
+        self.scenario = scenario or QuakeScenario()
+        self.register = register
+        self.rng = random.Random(seed)
+        self.devices = self.make_fleet(devices)
+        self.scenario.bind(self.devices)
+        self.latencies = []
+        self.sent = 0
+        self.errors = 0
+        self.late = 0
+        self.warning_at = None
+
+    def make_fleet(self, count):
+        lat0 = sum(d["latitude"] for d in DEVICES) / len(DEVICES)
+        lon0 = sum(d["longitude"] for d in DEVICES) / len(DEVICES)
+        fleet = []
+        for i in range(count):
+            radius = 0.5 * math.sqrt(self.rng.random())
+            angle = self.rng.uniform(0, 2 * math.pi)
+            fleet.append({
+                "id": f"load-r0-{i:06d}",
+                "auth_seed": f"{self.rng.randrange(10**8):08d}",
+                "latitude": round(lat0 + radius * math.sin(angle), 6),
+                "longitude": round(lon0 + radius * math.cos(angle), 6),
+                "shake": self.rng.random(),
+                "peak": self.rng.random()
+            })
+        return fleet
+
+    def reading(self, device, elapsed):
+        g_force = self.scenario.g_force(device, elapsed)
+        if g_force is None:
+            g_force = 1.0 + self.rng.uniform(-BASELINE_NOISE, BASELINE_NOISE)
+        return {
+            "device_id": device["id"],
+            "x_axis": 0.0,
+            "y_axis": 0.0,
+            "z_axis": round(g_force, 3),
+            "g_force": round(g_force, 3),
+            "device_timestamp": round(time.time(), 3)
+        }
+
+    async def send(self, client, path, fields):
+        start = time.perf_counter()
+        try:
+            status, _ = await client.post(path, fields)
+            if status == 200:
+                self.latencies.append(time.perf_counter() - start)
+            else:
+                self.errors += 1
+        except Exception:
+            self.errors += 1
+        self.sent += 1
+
+    async def device_loop(self, client, device, t0):
+        interval = 1.0 / self.rate
+        next_at = t0 + self.rng.uniform(0, interval)
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -interval:
+                self.late += 1
+            elapsed = loop.time() - t0
+            if elapsed >= self.duration:
+                return
+            await self.send(client, "/post", self.reading(device, elapsed))
+            next_at += interval
+
+    async def run(self):
+        client = PooledHTTPClient(self.api_url, self.connections)
+        try:
+            if self.register:
+                await asyncio.gather(*(self.send(client, "/post_device_id", {
+                    "device_id": d["id"], "auth_seed": d["auth_seed"], "latitude": d["latitude"], "longitude": d["longitude"]
+                }) for d in self.devices))
+                self.latencies.clear()
+                self.sent = self.errors = 0
+            t0 = asyncio.get_running_loop().time()
+            started = time.perf_counter()
+            watcher = asyncio.create_task(self.watch_warning(t0))
+            await asyncio.gather(*(self.device_loop(client, d, t0) for d in self.devices))
+            elapsed = time.perf_counter() - started
+            watcher.cancel()
+        finally:
+            await client.close()
+        return self.report(elapsed)
+
+    async def watch_warning(self, t0, interval=0.1):
+        client = PooledHTTPClient(self.api_url, 1)
+        loop = asyncio.get_running_loop()
+        try:
+            while self.warning_at is None:
+                try:
+                    status, body = await client.get("/warning")
+                    if status == 200 and json.loads(body).get("warning"):
+                        self.warning_at = loop.time() - t0
+                        return
+                except Exception:
+                    pass
+                await asyncio.sleep(interval)
+        finally:
+            await client.close()
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+        truth = self.scenario.ground_truth()
+        first_arrival = truth.get("first_p_arrival")
+        return {
+            "first_p_arrival_s": first_arrival,
+            "warning_at_s": self.warning_at,
+            "detection_latency_s": self.warning_at - first_arrival if self.warning_at is not None and first_arrival is not None else None,
+            "devices": len(self.devices),
+            "target_rps": len(self.devices) * self.rate,
+            "achieved_rps": self.sent / elapsed if elapsed else 0.0,
+            "sent": self.sent,
+            "ok": len(latencies),
+            "errors": self.errors,
+            "late": self.late,
+            "p50_ms": pct(0.50),
+            "p90_ms": pct(0.90),
+            "p99_ms": pct(0.99),
+            "max_ms": latencies[-1] * 1000 if latencies else 0.0
+        }
+
+
+def run_headless(args):
+    if args.epicenter:
+        if WaveScenario is None:
+            raise SystemExit("--epicenter needs numpy for the wave scenario engine")
+        scenario = WaveScenario(args.epicenter[0], args.epicenter[1], args.origin, args.magnitude, args.depth, args.vp, args.vs)
+    else:
+        scenario = QuakeScenario(args.quake_at, args.quake_duration, args.quake_min, args.quake_max, args.quake_fraction)
+    generator = LoadGenerator(args.url, args.devices, args.rate, args.duration, args.connections, scenario, args.register)
+    if args.truth:
+        with open(args.truth, "w") as f:
+            json.dump(scenario.ground_truth(), f, indent=2)
+    print(f"Simulating {args.devices} devices at {args.rate} Hz for {args.duration}s against {args.url}")
+    result = asyncio.run(generator.run())
+    print(f"Target {result['target_rps']:.0f} req/s, achieved {result['achieved_rps']:.0f} req/s")
+    print(f"Sent {result['sent']}, ok {result['ok']}, errors {result['errors']}, late {result['late']}")
+    print(f"Latency p50 {result['p50_ms']:.1f} ms, p90 {result['p90_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, max {result['max_ms']:.1f} ms")
+    if result["first_p_arrival_s"] is not None:
+        if result["detection_latency_s"] is None:
+            print(f"First P arrival at {result['first_p_arrival_s']:.2f}s, no warning raised")
+        else:
+            print(f"First P arrival at {result['first_p_arrival_s']:.2f}s, warning at {result['warning_at_s']:.2f}s, detection latency {result['detection_latency_s']:.2f}s")
+    return result
+
+
+def positive_float(value):
+    number = float(value)
+    if not (number > 0 and math.isfinite(number)):
+        raise argparse.ArgumentTypeError(f"must be a positive number, got {value}")
+    return number
+
+
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Earthquake emulator, GUI by default or a headless load generator")
+    parser.add_argument("--headless", action="store_true", help="run the asyncio load generator instead of the GUI")
+    parser.add_argument("--url", default=API_URL, help="API base url, e.g. http://127.0.0.1:5000/pipeline/eews")
+    parser.add_argument("--devices", type=positive_int, default=1000, help="number of virtual devices")
+    parser.add_argument("--rate", type=positive_float, default=1.0, help="posts per second per device")
+    parser.add_argument("--duration", type=positive_float, default=60.0, help="seconds to run")
+    parser.add_argument("--connections", type=positive_int, default=64, help="keep-alive connections in the pool")
+    parser.add_argument("--register", action="store_true", help="register every device before sending")
+    parser.add_argument("--quake-at", type=float, default=None, help="seconds into the run the earthquake starts")
+    parser.add_argument("--quake-duration", type=float, default=10.0, help="earthquake duration in seconds")
+    parser.add_argument("--quake-min", type=float, default=1.5, help="minimum g-force while shaking")
+    parser.add_argument("--quake-max", type=float, default=5.0, help="maximum g-force while shaking")
+    parser.add_argument("--quake-fraction", type=float, default=1.0, help="fraction of devices that feel the earthquake")
+    parser.add_argument("--epicenter", type=float, nargs=2, metavar=("LAT", "LON"), help="use the wave propagation scenario with this epicenter")
+    parser.add_argument("--origin", type=float, default=10.0, help="seconds into the run the rupture starts")
+    parser.add_argument("--magnitude", type=float, default=7.0, help="earthquake magnitude")
+    parser.add_argument("--depth", type=float, default=10.0, help="hypocenter depth in km")
+    parser.add_argument("--vp", type=float, default=6.0, help="P-wave velocity in km/s")
+    parser.add_argument("--vs", type=float, default=3.5, help="S-wave velocity in km/s")
+    parser.add_argument("--truth", help="write the scenario ground truth (arrivals, PGA) to this JSON file")
+    return parser.parse_args()
+
+
 if __name__=='__main__':
-    root=tk.Tk()
-    app=EarthquakeEmulator(root)
-    root.mainloop()
+    args=parse_args()
+    if args.headless:
+        run_headless(args)
+    else:
+        root=tk.Tk()
+        app=EarthquakeEmulator(root)
+        root.mainloop()
@@ -0,0 +1,277 @@
+## harness.py - runs the firmware under CPython against a simulated MPU6050 (host side)
+##
+##   python harness.py --rate 200 --seconds 10 --threaded
+##   python harness.py --rate 200 --seconds 10 --network-delay 1.5 --blocking-network
+##   python harness.py --uploader 200 --drop-every 50
+##   python harness.py --rate 50 --seconds 20 --quake-at 12 --int-pin
+##   python harness.py --rate 200 --seconds 3600 --virtual --i2c-khz 100
+##
+## the simulated hardware and MicroPython modules come from shim.py
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+
+from shim import (install, HostClock, VirtualClock, QuakeWave, SimulatedI2C, SimulatedMPU6050, SimulatedPin,
+                  SimulatedWlan, SimulatedNtp, SimulatedUploader)
+
+
+## stand-in api
+class StandInServer:
+    # HTTP/1.1 keep-alive stand-in for /pipeline/eews/post, optionally drops the socket every N requests
+    def __init__(self, delay=0.0, drop_every=0):
+        self.delay = delay
+        self.drop_every = drop_every
+        self.connections = 0
+        self.bodies = []
+        self.server = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        served = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b""):
+                        break
+                    name, value = header.decode().split(":", 1)
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                body = await reader.readexactly(length)
+                self.bodies.append(body.decode())
+                served += 1
+
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+
+                closing = self.drop_every and served >= self.drop_every
+                content = b'{"success": true, "commands": []}'
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(content)}\r\nConnection: {'close' if closing else 'keep-alive'}\r\n\r\n".encode()
+                    + content
+                )
+                await writer.drain()
+                if closing:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+
+def check_uploader(args):
+    install()
+    sys.path.insert(0, __file__.rsplit("/", 1)[0] if "/" in __file__ else ".")
+
+    import main
+
+    async def session():
+        server = StandInServer(args.standin_delay, args.drop_every)
+        port = await server.start()
+        uploader = main.Uploader(f"http://127.0.0.1:{port}/pipeline/eews/post")
+
+        timings = []
+        sent = []
+        for i in range(args.uploader):
+            body = f"device_id=harness&g_force=1.0&seq={i}"
+            sent.append(body)
+            started = time.perf_counter()
+            status, _ = await uploader.request(body)
+            timings.append(time.perf_counter() - started)
+            if status != 200:
+                raise RuntimeError(f"post {i} returned {status}")
+
+        batch = [f"device_id=harness&g_force=1.0&seq={args.uploader + i}" for i in range(args.pipeline)]
+        sent.extend(batch)
+        started = time.perf_counter()
+        results = await uploader.pipeline(batch)
+        pipelined = time.perf_counter() - started
+
+        await uploader.close()
+        server.server.close()
+        return server, uploader, sent, timings, results, pipelined
+
+    server, uploader, sent, timings, results, pipelined = asyncio.run(session())
+    timings.sort()
+    in_order = server.bodies == sent
+    print(f"{len(timings)} posts over {uploader.connects} connection(s), server saw {server.connections}, "
+          f"in order {in_order}")
+    print(f"Latency p50 {timings[len(timings) // 2] * 1000:.2f} ms, max {timings[-1] * 1000:.2f} ms")
+    print(f"Pipelined {len(results)} posts in {pipelined * 1000:.2f} ms")
+    return 0 if in_order and all(status == 200 for status, _ in results) else 1
+
+
+## run
+def run(args):
+    if args.uploader:
+        return check_uploader(args)
+    if args.virtual and args.threaded:
+        print("The sampler thread runs on real time, --virtual is cooperative only", file=sys.stderr)
+        return 2
+
+    clock = VirtualClock() if args.virtual else HostClock()
+    sensor = SimulatedMPU6050(QuakeWave(args.quake_at), clock)
+    bus = SimulatedI2C([sensor], args.i2c_khz * 1000, args.i2c_overhead_us, clock)
+    wlan = SimulatedWlan(clock)
+    install(clock, bus, wlan)
+    sys.path.insert(0, __file__.rsplit("/", 1)[0] if "/" in __file__ else ".")
+
+    import main
+    from configs import parameters as param
+
+    param.SAMPLE_RATE_HZ = args.rate
+    param.SAMPLER_THREAD = args.threaded
+    param.LOOP_STATS = False
+    param.ADAPTIVE_RATE = not args.fixed_rate
+    mpu = main.MPU6050(bus)
+    detector = main.init_detector()
+
+    # count every sample taken out of the FIFO, before any decimation
+    seen = [0]
+    fifo_sample = mpu.fifo_sample
+
+    def counted(index):
+        seen[0] += 1
+        return fifo_sample(index)
+
+    mpu.fifo_sample = counted
+
+    # cache the access point in a scratch file, then boot takes the fast path
+    import boot
+    import tempfile
+    boot.WIFI_CACHE_FILE = tempfile.mktemp(suffix=".json")
+    boot.save_wifi_cache(wlan)
+    boot.start_wifi()
+
+    ntp = SimulatedNtp(args.ntp_offset, clock)
+    main.Clock.NTP_PORT = ntp.port
+    uploader = SimulatedUploader(args.network_delay, args.outage, args.blocking_network, clock)
+    uploader.start = sensor.start           # post times and the outage count from power on, not from boot
+    posts = uploader.posts
+
+    if args.url:
+        main.UPLOADER = main.Uploader(f"{args.url}/post")
+        main.param.DEVICE_ID = "harness-001"
+    else:
+        main.UPLOADER = uploader
+
+    async def session():
+        state = main.DeviceState(detector)
+        ring = None
+        pin = SimulatedPin(sensor) if args.int_pin else None
+        rate = main.RateControl(mpu, state, pin) if param.ADAPTIVE_RATE else None
+        main.calibrate(mpu, detector, param.CALIBRATION_SAMPLES)
+
+        if args.threaded:
+            ring = main.LockedRing(param.EVENT_RING_SIZE, 6)
+            threading.Thread(target=main.sampler_thread, args=(mpu, detector, ring, state.stats, rate, state.features), daemon=True).start()
+            tasks = [asyncio.create_task(main.ring_task(ring, state, None))]
+        else:
+            queue = main.SampleQueue(param.SAMPLE_QUEUE_SIZE)
+            tasks = [
+                asyncio.create_task(main.sampler_task(mpu, queue, state.stats, rate)),
+                asyncio.create_task(main.detector_task(queue, detector, state, None))
+            ]
+        tasks.append(asyncio.create_task(main.uploader_task(state, None, None)))
+        tasks.append(asyncio.create_task(main.gc_task(state)))
+        tasks.append(asyncio.create_task(main.clock_task()))
+        tasks.append(asyncio.create_task(main.wifi_task()))
+        if args.wifi_drop_at is not None:
+            wlan.drop(sensor.start + args.wifi_drop_at)
+        if pin:
+            tasks.append(asyncio.create_task(pin.watch()))
+
+        await asyncio.sleep(args.seconds)
+
+        if ring:
+            ring.running = False
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return state, rate
+
+    loop = clock.new_event_loop()
+    state, rate = loop.run_until_complete(session())
+    os.remove(boot.WIFI_CACHE_FILE)
+    time.sleep(0.2)
+
+    with sensor.lock:
+        sensor.fill()
+        pending = len(sensor.fifo) // 6
+        produced = sensor.produced
+        dropped = sensor.dropped
+
+    gaps = produced - seen[0] - pending
+    mode = "threaded" if args.threaded else "cooperative"
+    print(f"{mode} sampler at {args.rate} Hz for {args.seconds:.0f}s, network delay {args.network_delay}s"
+          f"{' (blocking)' if args.blocking_network else ''}")
+    print(f"Samples produced {produced}, processed {seen[0]}, still in FIFO {pending}, dropped {dropped}, gaps {gaps}")
+    stats = state.stats
+    print(f"I2C {bus.transactions} transactions, {bus.bytes} bytes, busy {100 * bus.busy / args.seconds:.1f}% "
+          f"at {args.i2c_khz:.0f} kHz")
+    print(f"Sampler wake-up jitter mean {stats.late_sum // max(stats.wakes, 1)} us, max {stats.late_max} us, "
+          f"{stats.collects} gc max {stats.gc_max} us")
+    if rate:
+        print(f"Rate switches {stats.switches}, max {stats.switch_max} us, capturing at end {rate.capturing}, "
+              f"sensor rate at end {mpu.sample_rate:.0f} Hz")
+    if posts:
+        heartbeats = [t for t, body in posts if "seq=" not in body and "window=" not in body]
+        events = [t for t, body in posts if "seq=" in body]
+        print(f"Heartbeats {len(heartbeats)}" + (f", first event sample posted at {events[0]}s" if events else ""))
+    print(f"Posts {len(posts)}, mode at end {'earthquake' if state.mode == main.MODE_EARTHQUAKE else 'normal'}")
+    print(f"Event samples logged {state.events.seq}, still pending {state.events.pending()}, lost {state.events.lost}")
+    sequence = [int(body.split("seq=")[1].split("&")[0]) for _, body in posts if "seq=" in body]
+    if sequence:
+        print(f"Event samples posted {len(sequence)}, seq {min(sequence)}..{max(sequence)}, "
+              f"in order {sequence == sorted(sequence)}, unique {len(set(sequence))}")
+    syncs = [body.split("sync=")[1].split("&")[0] for _, body in posts if "sync=" in body]
+    print(f"Clock anchored {main.CLOCK.syncs} time(s) from {ntp.queries} NTP queries, ntp offset {args.ntp_offset}s"
+          + (f", last round trip {syncs[-1]}" if syncs else ""))
+    print(f"WiFi connects {', '.join(wlan.connects) or 'none'}, connected at end {wlan.isconnected()}")
+    windows = [body for _, body in posts if "window=" in body]
+    if windows:
+        last = dict(field.split("=") for field in windows[-1].split("&"))
+        print(f"Feature frames posted {len(windows)}, last window {last['window']}: pga {last['pga']} g, rms {last['rms']} g, "
+              f"zcr {last['zcr']}/s, dominant {last['dominant_hz']} Hz, triggered {last['triggered']}")
+    return 0 if gaps == 0 and dropped == 0 else 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the firmware pipeline under CPython against a simulated MPU6050")
+    parser.add_argument("--rate", type=int, default=200, help="sensor sample rate in Hz")
+    parser.add_argument("--seconds", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--threaded", action="store_true", help="run the sampler and detector on their own thread")
+    parser.add_argument("--network-delay", type=float, default=0.5, help="seconds each post takes")
+    parser.add_argument("--blocking-network", action="store_true", help="posts block the whole event loop, like urequests")
+    parser.add_argument("--quake-at", type=float, default=None, help="seconds into the run a 0.03 g P-wave starts")
+    parser.add_argument("--outage", type=float, default=0.0, help="posts fail for this many seconds from the start")
+    parser.add_argument("--fixed-rate", action="store_true", help="sample at --rate throughout, no motion interrupt")
+    parser.add_argument("--int-pin", action="store_true", help="wire the simulated MPU6050 INT pin instead of polling INT_STATUS")
+    parser.add_argument("--ntp-offset", type=float, default=0.0, help="seconds the simulated NTP server is off the host clock")
+    parser.add_argument("--wifi-drop-at", type=float, default=None, help="seconds into the run the WiFi link drops")
+    parser.add_argument("--virtual", action="store_true", help="virtual clock, simulated seconds pass only while the firmware waits")
+    parser.add_argument("--i2c-khz", type=float, default=400.0, help="bus clock, each transaction costs its bus time")
+    parser.add_argument("--i2c-overhead-us", type=float, default=0.0, help="software cost per bus transaction")
+    parser.add_argument("--url", help="post to this API base url instead of the simulated network")
+    parser.add_argument("--uploader", type=int, default=0, help="instead, send this many posts through the uploader to a local stand-in API")
+    parser.add_argument("--pipeline", type=int, default=8, help="posts sent as one pipelined batch after the sequential ones")
+    parser.add_argument("--standin-delay", type=float, default=0.0, help="seconds the stand-in API takes per post")
+    parser.add_argument("--drop-every", type=int, default=0, help="stand-in closes the connection after this many posts")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
@@ -1,12 +1,20 @@
 ## main.py
 
 ## imports
+import gc
+import math
 import machine
+import network
 import os
+import struct
+import _thread
+import ntptime
 import utime as time
+import usocket as socket
 import ujson as json
-import urequests as requests
+import uasyncio as asyncio
 
+from array import array
 from boot import *
 from configs.config import *
 from configs import parameters as param
@@ -15,38 +23,167 @@ from configs import parameters as param
 ## classes
 ## MPU6050 Driver
 class MPU6050:
-    def __init__(self, i2c, addr=0x68):
+    REG_SMPLRT_DIV = 0x19
+    REG_CONFIG = 0x1A
+    REG_ACCEL_CONFIG = 0x1C
+    REG_MOT_THR = 0x1F
+    REG_MOT_DUR = 0x20
+    REG_FIFO_EN = 0x23
+    REG_INT_PIN_CFG = 0x37
+    REG_INT_ENABLE = 0x38
+    REG_INT_STATUS = 0x3A
+    REG_ACCEL_XOUT_H = 0x3B
+    REG_USER_CTRL = 0x6A
+    REG_PWR_MGMT_1 = 0x6B
+    REG_FIFO_COUNT_H = 0x72
+    REG_FIFO_R_W = 0x74
+
+    FIFO_SIZE = 1024
+    SAMPLE_BYTES = 6
+
+    def __init__(self, i2c, addr=0x68, sample_rate=None, dlpf=None, batch=None):
         self.i2c = i2c
         self.addr = addr
+        self.counts = array('i', (0, 0, 0))
+
+        # reusable i2c buffers, one burst per read
+        self.buf = bytearray(self.SAMPLE_BYTES)
+        self.count_buf = bytearray(2)
+        self.status_buf = bytearray(1)
+        self.batch = batch or param.FIFO_BATCH
+        self.fifo_buf = bytearray(self.SAMPLE_BYTES * self.batch)
+        fifo_view = memoryview(self.fifo_buf)
+        self.fifo_views = [fifo_view[:self.SAMPLE_BYTES * n] for n in range(self.batch + 1)]
+        self.fifo = False
+
         try:
             devices = i2c.scan()
             if addr not in devices:
                 raise OSError(f"MPU6050 not found at address 0x{addr:02X}")
-            self.i2c.writeto_mem(self.addr, 0x6B, b'\x00')
+            self.i2c.writeto_mem(self.addr, self.REG_PWR_MGMT_1, b'\x00')
             time.sleep(0.1)
+            self.configure(sample_rate or param.SAMPLE_RATE_HZ, param.DLPF_CFG if dlpf is None else dlpf)
         except Exception as e:
             eprint(PRINTSTATUS.ERROR, f"MPU6050 init failed: {e}")
             raise
 
-    def read_raw(self, reg):
+    def configure(self, sample_rate, dlpf):
+        # the gyro output rate the divider counts down from: 8 kHz with the DLPF off (0) or reserved (7), 1 kHz otherwise
+        self.dlpf = dlpf & 0x07
+        self.clock_hz = 8000 if self.dlpf in (0, 7) else 1000
+        self.i2c.writeto_mem(self.addr, self.REG_CONFIG, bytes([self.dlpf]))
+        self.set_rate(sample_rate)
+        self.i2c.writeto_mem(self.addr, self.REG_ACCEL_CONFIG, b'\x00')     # +-2 g, 16384 counts per g
+        self.reset_fifo()
+
+    def set_rate(self, sample_rate):
+        # rate = gyro output rate / (1 + divider), one register write; the accel itself updates at 1 kHz at most
+        divider = max(0, min(255, int(self.clock_hz / sample_rate + 1e-6) - 1))
+        self.sample_rate = self.clock_hz / (1 + divider)
+        self.i2c.writeto_mem(self.addr, self.REG_SMPLRT_DIV, bytes([divider]))
+
+    def enable_motion(self, threshold_mg, duration_ms):
+        # motion interrupt on the 5 Hz high-passed accel, the high-pass only feeds the motion detector
+        self.i2c.writeto_mem(self.addr, self.REG_ACCEL_CONFIG, b'\x01')
+        self.i2c.writeto_mem(self.addr, self.REG_MOT_THR, bytes([max(1, min(255, threshold_mg // 2))]))
+        self.i2c.writeto_mem(self.addr, self.REG_MOT_DUR, bytes([max(1, min(255, duration_ms))]))
+        # INT stays high until INT_STATUS is read
+        self.i2c.writeto_mem(self.addr, self.REG_INT_PIN_CFG, b'\x20')
+        self.i2c.writeto_mem(self.addr, self.REG_INT_ENABLE, b'\x40')
+
+    def motion(self):
+        # reading INT_STATUS also releases the latched INT pin
+        try:
+            self.i2c.readfrom_mem_into(self.addr, self.REG_INT_STATUS, self.status_buf)
+            return self.status_buf[0] & 0x40 != 0
+        except:
+            return False
+
+    def reset_fifo(self):
+        # stop, reset and re-enable the FIFO with only the accelerometer in it
+        self.i2c.writeto_mem(self.addr, self.REG_FIFO_EN, b'\x00')
+        self.i2c.writeto_mem(self.addr, self.REG_USER_CTRL, b'\x04')
+        self.i2c.writeto_mem(self.addr, self.REG_FIFO_EN, b'\x08')
+        self.i2c.writeto_mem(self.addr, self.REG_USER_CTRL, b'\x40')
+        self.fifo = True
+
+    def _decode(self, buf, offset):
+        # big endian int16 per axis, unrolled so decoding allocates nothing
+        counts = self.counts
+        value = (buf[offset] << 8) | buf[offset + 1]
+        counts[0] = value - 65536 if value > 32767 else value
+        value = (buf[offset + 2] << 8) | buf[offset + 3]
+        counts[1] = value - 65536 if value > 32767 else value
+        value = (buf[offset + 4] << 8) | buf[offset + 5]
+        counts[2] = value - 65536 if value > 32767 else value
+        return counts
+
+    def fifo_count(self):
         try:
-            high = self.i2c.readfrom_mem(self.addr, reg, 1)[0]
-            low = self.i2c.readfrom_mem(self.addr, reg + 1, 1)[0]
-            value = (high << 8) | low
-            if value > 32767:
-                value -= 65536
-            return value
+            self.i2c.readfrom_mem_into(self.addr, self.REG_FIFO_COUNT_H, self.count_buf)
+            return (self.count_buf[0] << 8) | self.count_buf[1]
         except:
             return 0
 
-    def read_accel(self):
+    def read_fifo(self):
+        # drain up to one batch of samples into fifo_buf, returns how many
+        count = self.fifo_count()
+        if count >= self.FIFO_SIZE:
+            # overflowed, the byte stream may no longer be aligned to samples
+            eprint(PRINTSTATUS.WARN, "MPU6050 FIFO overflow, samples dropped")
+            self.reset_fifo()
+            return 0
+
+        samples = count // self.SAMPLE_BYTES
+        if samples > self.batch:
+            samples = self.batch
+        if samples:
+            try:
+                self.i2c.readfrom_mem_into(self.addr, self.REG_FIFO_R_W, self.fifo_views[samples])
+            except:
+                return 0
+        return samples
+
+    def fifo_sample(self, index):
+        return self._decode(self.fifo_buf, index * self.SAMPLE_BYTES)
+
+    def read_counts(self):
+        # latest sample straight from the output registers, 16384 counts per g
         try:
-            x_axis = self.read_raw(0x3B) / 16384.0
-            y_axis = self.read_raw(0x3D) / 16384.0
-            z_axis = self.read_raw(0x3F) / 16384.0
-            return x_axis, y_axis, z_axis
+            self.i2c.readfrom_mem_into(self.addr, self.REG_ACCEL_XOUT_H, self.buf)
+            return self._decode(self.buf, 0)
         except:
-            return 0.0, 0.0, 0.0
+            counts = self.counts
+            counts[0] = counts[1] = counts[2] = 0
+            return counts
+
+    def read_accel(self):
+        counts = self.read_counts()
+        return counts[0] / 16384.0, counts[1] / 16384.0, counts[2] / 16384.0
+
+
+## Locked I2C
+class LockedI2C:
+    # serialises the shared bus when the sampler runs on its own thread
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.lock = _thread.allocate_lock()
+
+    def scan(self):
+        with self.lock:
+            return self.i2c.scan()
+
+    def writeto(self, addr, buf):
+        with self.lock:
+            return self.i2c.writeto(addr, buf)
+
+    def writeto_mem(self, addr, reg, buf):
+        with self.lock:
+            return self.i2c.writeto_mem(addr, reg, buf)
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        with self.lock:
+            return self.i2c.readfrom_mem_into(addr, reg, buf)
 
 
 ## LCD Driver
@@ -56,8 +193,9 @@ class I2cLcd:
     LCD_DISPLAY_CTRL = 0x08
     LCD_FUNCTION = 0x20
     LCD_SET_DDRAM = 0x80
+    ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54)
 
-    def __init__(self, i2c, addr, rows=2, cols=16, rs_mask=0x01, rw_mask=0x02, en_mask=0x04, bl_mask=0x08):
+    def __init__(self, i2c, addr, rows=2, cols=16, rs_mask=0x01, rw_mask=0x02, en_mask=0x04, bl_mask=0x08, min_interval_ms=200):
         self.i2c = i2c
         self.addr = addr
         self.rows = rows
@@ -69,6 +207,17 @@ class I2cLcd:
         self.EN = en_mask
         self.BL = bl_mask
 
+        # frame is what should be shown, shadow what the display holds, only differences are sent
+        self.frame = bytearray(b' ' * (rows * cols))
+        self.shadow = bytearray(b' ' * (rows * cols))
+        self.cursor = 0
+        self.min_interval_ms = min_interval_ms
+        self.last_flush = time.ticks_ms()
+
+        # one address command and a full row, 3 PCF8574 writes per nibble
+        self.out = bytearray(6 * (cols + 1))
+        self.out_view = memoryview(self.out)
+
         time.sleep_ms(50)
 
         self._write4(0x03 << 4)
@@ -110,21 +259,77 @@ class I2cLcd:
     def _cmd(self, cmd):
         self._send(cmd, 0)
 
-    def _write_char(self, char):
-        self._send(ord(char), self.RS)
+    def _queue(self, n, value, mode):
+        # one byte as two nibbles, each latched by an EN pulse, all in the out buffer
+        out = self.out
+        data = (value & 0xF0) | mode | (self.BL if self.backlight else 0)
+        out[n] = data
+        out[n + 1] = data | self.EN
+        out[n + 2] = data
+        data = ((value << 4) & 0xF0) | mode | (self.BL if self.backlight else 0)
+        out[n + 3] = data
+        out[n + 4] = data | self.EN
+        out[n + 5] = data
+        return n + 6
 
     def clear(self):
         self._cmd(self.LCD_CLR)
         time.sleep_ms(2)
+        for i in range(len(self.frame)):
+            self.frame[i] = 32
+            self.shadow[i] = 32
+        self.cursor = 0
 
     def move_to(self, col, row):
-        row_offsets = [0x00, 0x40]
-        addr = col + row_offsets[row]
-        self._cmd(self.LCD_SET_DDRAM | addr)
+        self.cursor = row * self.cols + col
 
     def putstr(self, string):
         for ch in string:
-            self._write_char(ch)
+            if self.cursor >= len(self.frame):
+                break
+            self.frame[self.cursor] = ord(ch)
+            self.cursor += 1
+        self.flush(True)
+
+    def write_line(self, row, text, length=None):
+        # whole row from bytes, padded with spaces, shown on the next flush
+        base = row * self.cols
+        if length is None:
+            length = len(text)
+        for col in range(self.cols):
+            self.frame[base + col] = text[col] if col < length else 32
+
+    def flush(self, force=False):
+        now = time.ticks_ms()
+        if not force and time.ticks_diff(now, self.last_flush) < self.min_interval_ms:
+            return False
+        self.last_flush = now
+
+        frame = self.frame
+        shadow = self.shadow
+        cols = self.cols
+
+        for row in range(self.rows):
+            base = row * cols
+            col = 0
+            while col < cols:
+                if frame[base + col] == shadow[base + col]:
+                    col += 1
+                    continue
+
+                # a run of changed cells is one address command and its characters in one writeto
+                n = self._queue(0, self.LCD_SET_DDRAM | (self.ROW_OFFSETS[row] + col), 0)
+                while col < cols and frame[base + col] != shadow[base + col]:
+                    n = self._queue(n, frame[base + col], self.RS)
+                    shadow[base + col] = frame[base + col]
+                    col += 1
+
+                try:
+                    self.i2c.writeto(self.addr, self.out_view[:n])
+                except:
+                    pass
+
+        return True
 
 
 ## buzzer
@@ -140,84 +345,1311 @@ class Buzzer:
         self.pin.value(0)
 
 
+## STA/LTA Detector
+class StaLta:
+    # integer math on raw counts, floats are heap objects on the ESP32 port
+    CF_SHIFT = 7            # scales the characteristic function so LTA sums stay small ints
+    HP_CLAMP = 8191         # +-0.5 g high-passed deviation
+    NOISE_SHIFT = 9         # noise floor follows quiet samples over ~10 s at 50 Hz
+    NOISE_CLAMP = 1 << 20   # ~0.06 g, anything louder is not noise
+
+    def __init__(self, sta_len, lta_len, on_ratio, off_ratio, fallback_pga, hp_shift):
+        self.sta_len = sta_len
+        self.lta_len = lta_len
+        self.on_x10 = int(on_ratio * 10)
+        self.off_x10 = int(off_ratio * 10)
+        self.fallback_sq = int(fallback_pga * 16384) ** 2
+        self.hp_shift = hp_shift
+
+        self.ring = array('i', bytes(4 * lta_len))
+        self.base = array('i', (0, 0, 0))   # gravity per axis, counts << 8
+        self.hp = array('i', (0, 0, 0))     # high-passed last sample per axis, counts
+        self.dyn_sq = 0                     # dynamic acceleration of the last sample, counts squared
+        self.peak_sq = 0                    # largest dyn_sq since take_peak()
+        self.noise = 0                      # mean quiet dyn_sq, counts squared << 8
+        self.index = 0
+        self.count = 0
+        self.sta_sum = 0
+        self.lta_sum = 0
+        self.ratio_x10 = 0
+        self.triggered = False
+        self.primed = False
+
+    def _highpass(self, axis, value):
+        base = self.base[axis]
+        base += ((value << 8) - base) >> self.hp_shift
+        self.base[axis] = base
+        hp = value - (base >> 8)
+        if hp > self.HP_CLAMP:
+            return self.HP_CLAMP
+        if hp < -self.HP_CLAMP:
+            return -self.HP_CLAMP
+        return hp
+
+    def update(self, counts):
+        x_raw = counts[0]
+        y_raw = counts[1]
+        z_raw = counts[2]
+
+        if not self.primed:
+            self.base[0] = x_raw << 8
+            self.base[1] = y_raw << 8
+            self.base[2] = z_raw << 8
+            self.primed = True
+
+        # gravity removed, so the mounting orientation does not matter
+        hx = self._highpass(0, x_raw)
+        hy = self._highpass(1, y_raw)
+        hz = self._highpass(2, z_raw)
+        self.hp[0] = hx
+        self.hp[1] = hy
+        self.hp[2] = hz
+        dyn_sq = hx * hx + hy * hy + hz * hz
+        self.dyn_sq = dyn_sq
+        if dyn_sq > self.peak_sq:
+            self.peak_sq = dyn_sq
+        if not self.triggered:
+            quiet = dyn_sq if dyn_sq < self.NOISE_CLAMP else self.NOISE_CLAMP
+            self.noise += ((quiet << 8) - self.noise) >> self.NOISE_SHIFT
+        cf = dyn_sq >> self.CF_SHIFT
+
+        # slot i drops out of the LTA window, slot i - sta_len out of the STA window
+        ring = self.ring
+        i = self.index
+        self.sta_sum += cf - ring[(i - self.sta_len) % self.lta_len]
+        self.lta_sum += cf - ring[i]
+        ring[i] = cf
+        self.index = (i + 1) % self.lta_len
+
+        # fixed PGA threshold until the LTA window is full
+        if self.count < self.lta_len:
+            self.count += 1
+            self.triggered = dyn_sq >= self.fallback_sq
+            return self.triggered
+
+        sta = self.sta_sum // self.sta_len
+        lta = self.lta_sum // self.lta_len
+        if lta < 1:
+            lta = 1
+        self.ratio_x10 = sta * 10 // lta
+
+        if self.triggered:
+            if self.ratio_x10 < self.off_x10:
+                self.triggered = False
+        elif self.ratio_x10 > self.on_x10:
+            self.triggered = True
+
+        return self.triggered
+
+    def calibrate(self, gravity, variance):
+        # boot-time rest measurement, gravity per axis in counts and total variance in counts squared
+        self.base[0] = gravity[0] << 8
+        self.base[1] = gravity[1] << 8
+        self.base[2] = gravity[2] << 8
+        self.primed = True
+        self.noise = min(variance, self.NOISE_CLAMP) << 8
+
+    def noise_counts(self):
+        return isqrt(self.noise >> 8)
+
+    def take_peak(self):
+        # largest dynamic acceleration since the last call, counts
+        peak = isqrt(self.peak_sq)
+        self.peak_sq = 0
+        return peak
+
+
+## Feature Window
+class FeatureWindow:
+    # PGA, RMS, zero-crossing rate and a Goertzel dominant frequency over fixed windows of the detector's high-passed samples
+    WIDTH = 8                           # window, time, ms, pga, rms, zero crossings per s x10, dominant Hz x10, triggered
+    Q = 12                              # Goertzel coefficients are 2 cos(w) << Q
+    ENERGY_SHIFT = 6                    # energy sums stay small ints up to ~300 samples per window
+    GOERTZEL_SHIFT = 3                  # input scaling, keeps the filter state a small int at full scale
+
+    def __init__(self, length, rate, bins_hz, frames, active_factor):
+        self.length = length
+        self.rate = rate
+        self.active_factor = active_factor
+        self.bins = len(bins_hz)
+        self.bins_x10 = array('i', [int(f * 10) for f in bins_hz])
+        self.coeffs = array('i', [int(2 * math.cos(2 * math.pi * f / rate) * (1 << self.Q)) for f in bins_hz])
+
+        # one Goertzel filter per axis and bin
+        self.s1 = array('i', bytes(4 * 3 * self.bins))
+        self.s2 = array('i', bytes(4 * 3 * self.bins))
+        self.axis_energy = array('i', (0, 0, 0))
+        self.crossings = array('i', (0, 0, 0))
+        self.signs = array('i', (0, 0, 0))
+
+        self.frame = array('i', bytes(4 * self.WIDTH))
+        self.frames = LockedRing(frames, self.WIDTH)    # active windows waiting for upload
+        self.window = 0
+        self._reset()
+
+    def _reset(self):
+        self.n = 0
+        self.energy = 0
+        self.peak_sq = 0
+        self.triggered = False
+        for i in range(3 * self.bins):
+            self.s1[i] = 0
+            self.s2[i] = 0
+        for axis in range(3):
+            self.axis_energy[axis] = 0
+            self.crossings[axis] = 0
+
+    def push(self, detector):
+        # after detector.update(), returns True when a window completed
+        dyn_sq = detector.dyn_sq
+        self.energy += dyn_sq >> self.ENERGY_SHIFT
+        if dyn_sq > self.peak_sq:
+            self.peak_sq = dyn_sq
+        if detector.triggered:
+            self.triggered = True
+
+        hp = detector.hp
+        coeffs = self.coeffs
+        s1 = self.s1
+        s2 = self.s2
+        bins = self.bins
+        for axis in range(3):
+            value = hp[axis]
+            self.axis_energy[axis] += (value * value) >> self.ENERGY_SHIFT
+
+            sign = 1 if value > 0 else (-1 if value < 0 else 0)
+            if sign and sign != self.signs[axis]:
+                if self.signs[axis]:
+                    self.crossings[axis] += 1
+                self.signs[axis] = sign
+
+            value >>= self.GOERTZEL_SHIFT
+            i = axis * bins
+            for b in range(bins):
+                s_new = value + ((coeffs[b] * s1[i]) >> self.Q) - s2[i]
+                s2[i] = s1[i]
+                s1[i] = s_new
+                i += 1
+
+        self.n += 1
+        if self.n < self.length:
+            return False
+
+        self._finish(detector)
+        return True
+
+    def _finish(self, detector):
+        # once per window, the bin powers may briefly be big ints
+        n = self.n
+        frame = self.frame
+        frame[0] = self.window
+        CLOCK.stamp(frame, 1)
+        frame[3] = isqrt(self.peak_sq)
+        frame[4] = isqrt((self.energy // n) << self.ENERGY_SHIFT)
+
+        # zero crossings on the axis that moved most
+        axis = 0
+        for a in (1, 2):
+            if self.axis_energy[a] > self.axis_energy[axis]:
+                axis = a
+        frame[5] = self.crossings[axis] * self.rate * 10 // n
+
+        best = 0
+        best_power = -1
+        for b in range(self.bins):
+            power = 0
+            coeff = self.coeffs[b]
+            for a in range(3):
+                i = a * self.bins + b
+                x = self.s1[i]
+                y = self.s2[i]
+                power += x * x + y * y - ((coeff * x) >> self.Q) * y
+            if power > best_power:
+                best = b
+                best_power = power
+        frame[6] = self.bins_x10[best]
+        frame[7] = 1 if self.triggered else 0
+
+        # quiet windows are not worth a post
+        if self.triggered or frame[3] > self.active_factor * detector.noise_counts():
+            self.frames.put(frame)
+
+        self.window += 1
+        self._reset()
+
+
+## Sample Queue
+class SampleQueue:
+    # bounded ring of raw samples from the sampler to the detector, the oldest is dropped when full
+    def __init__(self, size):
+        self.size = size
+        self.buf = array('i', bytes(12 * size))
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+        self.event = asyncio.Event()
+
+    def put(self, counts):
+        i = ((self.head + self.count) % self.size) * 3
+        if self.count == self.size:
+            self.head = (self.head + 1) % self.size
+            self.dropped += 1
+        else:
+            self.count += 1
+
+        self.buf[i] = counts[0]
+        self.buf[i + 1] = counts[1]
+        self.buf[i + 2] = counts[2]
+        self.event.set()
+
+    def get(self, counts):
+        if not self.count:
+            return False
+
+        i = self.head * 3
+        counts[0] = self.buf[i]
+        counts[1] = self.buf[i + 1]
+        counts[2] = self.buf[i + 2]
+        self.head = (self.head + 1) % self.size
+        self.count -= 1
+        return True
+
+    async def wait(self):
+        await self.event.wait()
+        self.event.clear()
+
+
+## Locked Ring
+class LockedRing:
+    # preallocated ring of fixed width int records between the sampler thread and the network side
+    def __init__(self, size, width):
+        self.size = size
+        self.width = width
+        self.buf = array('i', bytes(4 * size * width))
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+        self.running = True
+        self.lock = _thread.allocate_lock()
+
+    def put(self, record):
+        with self.lock:
+            i = ((self.head + self.count) % self.size) * self.width
+            if self.count == self.size:
+                self.head = (self.head + 1) % self.size
+                self.dropped += 1
+            else:
+                self.count += 1
+
+            j = 0
+            while j < self.width:
+                self.buf[i + j] = record[j]
+                j += 1
+
+    def get(self, record):
+        with self.lock:
+            if not self.count:
+                return False
+
+            i = self.head * self.width
+            j = 0
+            while j < self.width:
+                record[j] = self.buf[i + j]
+                j += 1
+            self.head = (self.head + 1) % self.size
+            self.count -= 1
+            return True
+
+    def peek(self, index, record):
+        # copies the index-th oldest record and leaves it in place
+        with self.lock:
+            if index >= self.count:
+                return False
+
+            i = ((self.head + index) % self.size) * self.width
+            j = 0
+            while j < self.width:
+                record[j] = self.buf[i + j]
+                j += 1
+            return True
+
+    def drop(self, n):
+        with self.lock:
+            n = max(0, min(n, self.count))
+            self.head = (self.head + n) % self.size
+            self.count -= n
+
+
+## Decimator
+class Decimator:
+    # averages capture-rate samples down to the detector rate, so STA/LTA windows keep their length in seconds
+    def __init__(self):
+        self.sums = array('i', (0, 0, 0))
+        self.counts = array('i', (0, 0, 0))
+        self.factor = 1
+        self.n = 0
+
+    def set_factor(self, factor):
+        self.factor = factor
+        self.n = 0
+        self.sums[0] = self.sums[1] = self.sums[2] = 0
+
+    def push(self, counts):
+        # returns the averaged sample once a group is complete, None until then
+        if self.factor == 1:
+            return counts
+
+        sums = self.sums
+        sums[0] += counts[0]
+        sums[1] += counts[1]
+        sums[2] += counts[2]
+        self.n += 1
+        if self.n < self.factor:
+            return None
+
+        out = self.counts
+        out[0] = sums[0] // self.factor
+        out[1] = sums[1] // self.factor
+        out[2] = sums[2] // self.factor
+        sums[0] = sums[1] = sums[2] = 0
+        self.n = 0
+        return out
+
+
+## Rate Control
+class RateControl:
+    # idle at the detector rate, capture at CAPTURE_RATE_HZ from the first motion interrupt until CAPTURE_HOLD_MS after the last
+    def __init__(self, mpu, state, pin=None):
+        self.mpu = mpu
+        self.state = state
+        self.pin = pin
+        self.decimator = Decimator()
+        self.capturing = False
+        self.motion_flag = False
+        self.hold_until = 0
+        self.flag = asyncio.ThreadSafeFlag()
+
+        mpu.enable_motion(param.MOTION_THRESHOLD_MG, param.MOTION_DURATION_MS)
+        mpu.set_rate(param.SAMPLE_RATE_HZ)
+        self.idle_rate = mpu.sample_rate
+        self.capture_rate = self.capture_rate_for(mpu)
+        state.capturing = False
+
+        if pin is not None:
+            pin.irq(trigger=machine.Pin.IRQ_RISING, handler=self._irq)
+            if param.IDLE_LIGHTSLEEP:
+                import esp32
+                esp32.wake_on_ext0(pin, esp32.WAKEUP_ANY_HIGH)
+
+    def capture_rate_for(self, mpu):
+        # the fastest rate up to the requested one the divider hits exactly as a whole multiple of the idle rate,
+        # so the decimator averages complete groups; capped in the cooperative loop, where a blocked post stalls drains
+        wanted = param.CAPTURE_RATE_HZ if param.SAMPLER_THREAD else min(param.CAPTURE_RATE_HZ, param.COOPERATIVE_CAPTURE_MAX_HZ)
+        steps = round(mpu.clock_hz / self.idle_rate)     # 1 + the idle divider
+        factor = 1
+        for f in range(2, steps + 1):
+            if steps % f == 0 and self.idle_rate * f <= wanted + 0.5:
+                factor = f
+        return self.idle_rate * factor
+
+    def _irq(self, pin):
+        self.motion_flag = True
+        self.flag.set()
+
+    def _switch(self, capturing):
+        # called right after a drain, so at most a sample or two in the FIFO is at the old rate
+        started = time.ticks_us()
+        rate = self.capture_rate if capturing else self.idle_rate
+        self.mpu.set_rate(rate)
+        # from the rate the divider actually gave, not the one asked for
+        self.decimator.set_factor(max(1, round(self.mpu.sample_rate / self.idle_rate)))
+        self.capturing = capturing
+        self.state.capturing = capturing
+        self.state.stats.switched(time.ticks_diff(time.ticks_us(), started))
+
+    def update(self):
+        # returns the drain interval for the current rate
+        if self.pin is None:
+            motion = self.mpu.motion()
+        else:
+            motion = self.motion_flag
+            if motion:
+                self.motion_flag = False
+                self.mpu.motion()
+
+        if motion or self.state.mode == MODE_EARTHQUAKE:
+            self.hold_until = time.ticks_add(time.ticks_ms(), param.CAPTURE_HOLD_MS)
+            if not self.capturing:
+                self._switch(True)
+        elif self.capturing and time.ticks_diff(time.ticks_ms(), self.hold_until) >= 0:
+            self._switch(False)
+
+        if self.capturing or self.pin is None:
+            return param.SAMPLER_INTERVAL_MS
+        return param.IDLE_SAMPLER_INTERVAL_MS
+
+    async def idle(self, interval_ms):
+        # idle drains are far apart, the motion interrupt cuts the wait short
+        if param.IDLE_LIGHTSLEEP:
+            machine.lightsleep(interval_ms)
+            await asyncio.sleep_ms(0)
+            return
+        try:
+            await asyncio.wait_for_ms(self.flag.wait(), interval_ms)
+        except asyncio.TimeoutError:
+            pass
+
+
+## Clock
+class Clock:
+    # millisecond wall clock, ticks_ms() anchored to an SNTP reply; times are seconds and ms so both stay small ints
+    NTP_PORT = 123
+
+    def __init__(self):
+        self.anchor = (time.time(), 0, time.ticks_ms())    # seconds, ms, ticks at that instant; replaced whole, never edited
+        self.syncs = 0                  # anchors taken from NTP, the server starts its estimate over on a new one
+
+        # round trip of the last single post: send and reply times, and the server's arrival time as it sent it
+        self.sending = array('i', (0, 0, 0, 0))
+        self.probe = array('i', (0, 0, 0, 0))
+        self.server = bytearray(16)
+        self.server_len = 0
+
+    def stamp(self, record, i):
+        # writes the time into record[i] and record[i + 1]
+        seconds, ms, ticks = self.anchor
+        ms += time.ticks_diff(time.ticks_ms(), ticks)
+        record[i] = seconds + ms // 1000
+        record[i + 1] = ms % 1000
+
+    def rebase(self):
+        # moves the anchor to now without changing the timeline, ticks_diff() only reaches half the ticks period
+        seconds, ms, ticks = self.anchor
+        now = time.ticks_ms()
+        ms += time.ticks_diff(now, ticks)
+        self.anchor = (seconds + ms // 1000, ms % 1000, now)
+
+    async def sync(self, host, timeout_ms):
+        # one SNTP query, the reply's transmit time plus half the round trip becomes the anchor
+        query = bytearray(48)
+        query[0] = 0x1B
+        try:
+            address = socket.getaddrinfo(host, self.NTP_PORT)[0][-1]
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        except OSError:
+            return False
+
+        try:
+            sock.setblocking(False)
+            sent = time.ticks_ms()
+            sock.sendto(query, address)
+            while True:
+                try:
+                    reply = sock.recv(48)
+                    break
+                except OSError:
+                    if time.ticks_diff(time.ticks_ms(), sent) > timeout_ms:
+                        return False
+                    await asyncio.sleep_ms(5)
+        except OSError:
+            return False
+        finally:
+            sock.close()
+
+        received = time.ticks_ms()
+        if len(reply) < 48 or not reply[1]:
+            return False
+
+        seconds = struct.unpack_from("!I", reply, 40)[0] - ntptime.NTP_DELTA
+        ms = ((struct.unpack_from("!I", reply, 44)[0] * 1000) >> 32) + time.ticks_diff(received, sent) // 2
+        self.anchor = (seconds + ms // 1000, ms % 1000, received)
+        self.syncs += 1
+
+        # a round trip measured against the old anchor would mislead the server
+        self.server_len = 0
+        return True
+
+    def reply(self, content):
+        # keeps the server's arrival time of the post just answered, digits as sent, for the next post's sync field
+        i = content.find(b'"server_ms":')
+        if i < 0:
+            return
+        i += 12
+        end = len(content)
+        while i < end and content[i] == 32:
+            i += 1
+
+        n = 0
+        while i < end and 48 <= content[i] <= 57 and n < len(self.server):
+            self.server[n] = content[i]
+            n += 1
+            i += 1
+
+        if n:
+            self.server_len = n
+            for j in range(4):
+                self.probe[j] = self.sending[j]
+
+
+## Uploader
+class Uploader:
+    # one kept-alive HTTP/1.1 connection, requests are built in a preallocated buffer and can be pipelined
+    def __init__(self, url, buffer_size=512):
+        self.host, self.port, path, self.ssl = split_url(url)
+        self.reader = None
+        self.writer = None
+        self.connects = 0
+        self.requests = 0
+
+        self.prefix = (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {self.host}\r\n"
+            "Content-Type: application/x-www-form-urlencoded\r\n"
+            "Connection: keep-alive\r\n"
+            "Content-Length: "
+        ).encode()
+        self.buf = bytearray(max(buffer_size, 2 * len(self.prefix)))
+        self.view = memoryview(self.buf)
+
+    def _reserve(self, n, end):
+        if end > len(self.buf):
+            # grows once for an oversized batch, then stays that size
+            buf = bytearray(max(end, 2 * len(self.buf)))
+            buf[:n] = self.view[:n]
+            self.buf = buf
+            self.view = memoryview(buf)
+
+    def _put(self, n, data):
+        end = n + len(data)
+        self._reserve(n, end)
+        self.buf[n:end] = data
+        return end
+
+    def _encode(self, bodies):
+        n = 0
+        for body in bodies:
+            if isinstance(body, str):
+                body = body.encode()
+            n = self._put(n, self.prefix)
+            self._reserve(n, n + 12)
+            n = put_int(self.buf, n, len(body))
+            n = self._put(n, b"\r\n\r\n")
+            n = self._put(n, body)
+        return self.view[:n]
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        self.connects += 1
+
+    def _drop(self):
+        if self.writer:
+            try:
+                self.writer.close()
+            except:
+                pass
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        writer = self.writer
+        self._drop()
+        if writer:
+            try:
+                await writer.wait_closed()
+            except:
+                pass
+
+    async def _read_response(self):
+        line = await self.reader.readline()
+        if not line:
+            raise OSError("connection closed")
+
+        version, status = line.split()[:2]
+        keep_alive = version == b"HTTP/1.1"
+        length = None
+
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, value = line.decode().split(":", 1)
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection":
+                keep_alive = value == "keep-alive" or (keep_alive and value != "close")
+
+        if length is None:
+            keep_alive = False
+            content = await self.reader.read(-1)
+        else:
+            content = await self.reader.readexactly(length)
+
+        return int(status), content, keep_alive
+
+    async def pipeline(self, bodies):
+        # all requests go out in one write, responses come back in order
+        results = []
+        retried = False
+
+        while len(results) < len(bodies):
+            pending = bodies[len(results):]
+            reused = self.writer is not None
+
+            try:
+                if not reused:
+                    await self._connect()
+
+                self.writer.write(self._encode(pending))
+                await self.writer.drain()
+
+                for _ in pending:
+                    status, content, keep_alive = await self._read_response()
+                    results.append((status, content))
+                    if not keep_alive:
+                        # server will not take more on this socket, the rest go on a new one
+                        await self.close()
+                        break
+
+            except asyncio.CancelledError:
+                self._drop()
+                raise
+
+            except Exception:
+                await self.close()
+                # an idle kept-alive socket can go stale, retry once on a fresh one
+                if not reused or retried:
+                    raise
+                retried = True
+
+        self.requests += len(bodies)
+        return results
+
+    async def request(self, body):
+        return (await self.pipeline([body]))[0]
+
+
+## Event Log
+class EventLog:
+    # triggered samples waiting for upload, the oldest half spills to a flash log when the RAM ring is full
+    WIDTH = 8                           # boot, seq, time, ms, x, y, z, pga
+    RECORD = struct.Struct('<iiiHhhhh')
+
+    def __init__(self, size, spill_file=None):
+        self.size = size
+        self.buf = array('i', bytes(4 * size * self.WIDTH))
+        self.head = 0
+        self.count = 0
+        self.seq = 0
+        self.boot = time.time()         # sequence numbers restart with every boot
+        self.lost = 0
+
+        self.spill_file = spill_file
+        self.spill_buf = bytearray(self.RECORD.size * (size // 2))
+        self.spilled = 0                # records in the flash log
+        self.spill_offset = 0           # of which already uploaded
+        self.in_flight_flash = 0        # last batch, from the flash log
+        self.in_flight = 0              # last batch, from the RAM ring
+
+        # records left from before a restart are sent again, the server drops repeats
+        if spill_file:
+            try:
+                self.spilled = os.stat(spill_file)[6] // self.RECORD.size
+            except OSError:
+                pass
+
+    def pending(self):
+        return self.count + self.spilled - self.spill_offset
+
+    def append(self, counts, seconds, ms, pga):
+        if self.count == self.size:
+            self._spill(self.size // 2)
+            if self.count == self.size:
+                self.lost += 1
+                return
+
+        i = ((self.head + self.count) % self.size) * self.WIDTH
+        buf = self.buf
+        buf[i] = self.boot
+        buf[i + 1] = self.seq
+        buf[i + 2] = seconds
+        buf[i + 3] = ms
+        buf[i + 4] = counts[0]
+        buf[i + 5] = counts[1]
+        buf[i + 6] = counts[2]
+        buf[i + 7] = pga
+        self.count += 1
+        self.seq += 1
+
+    def _spill(self, n):
+        # records in flight stay in RAM, commit() still has to find them there
+        n = min(n, self.count - self.in_flight)
+        if n <= 0:
+            return
+
+        buf = self.buf
+        if self.spill_file:
+            try:
+                for k in range(n):
+                    i = ((self.head + self.in_flight + k) % self.size) * self.WIDTH
+                    self.RECORD.pack_into(self.spill_buf, k * self.RECORD.size,
+                                          buf[i], buf[i + 1], buf[i + 2], buf[i + 3], buf[i + 4], buf[i + 5], buf[i + 6], buf[i + 7])
+                with open(self.spill_file, "ab") as f:
+                    f.write(memoryview(self.spill_buf)[:n * self.RECORD.size])
+                self.spilled += n
+            except OSError:
+                self.lost += n
+        else:
+            self.lost += n
+
+        # the spilled records sit after the in-flight ones, close the gap
+        for k in range(self.in_flight - 1, -1, -1):
+            src = ((self.head + k) % self.size) * self.WIDTH
+            dst = ((self.head + k + n) % self.size) * self.WIDTH
+            for j in range(self.WIDTH):
+                buf[dst + j] = buf[src + j]
+        self.head = (self.head + n) % self.size
+        self.count -= n
+
+    def batch(self, limit):
+        # oldest first: the flash log, then the RAM ring
+        records = []
+        flash = min(limit, self.spilled - self.spill_offset)
+        if flash > 0:
+            try:
+                with open(self.spill_file, "rb") as f:
+                    f.seek(self.spill_offset * self.RECORD.size)
+                    chunk = f.read(flash * self.RECORD.size)
+                for k in range(len(chunk) // self.RECORD.size):
+                    records.append(self.RECORD.unpack_from(chunk, k * self.RECORD.size))
+            except OSError:
+                self.spilled = self.spill_offset = 0
+
+        self.in_flight_flash = len(records)
+        ram = min(limit - len(records), self.count)
+        for k in range(ram):
+            i = ((self.head + k) % self.size) * self.WIDTH
+            records.append(tuple(self.buf[i:i + self.WIDTH]))
+
+        self.in_flight = ram
+        return records
+
+    def commit(self, n):
+        # the first n records of the last batch reached the server
+        flash = min(n, self.in_flight_flash)
+        if flash > 0:
+            self.spill_offset += flash
+            if self.spill_offset >= self.spilled:
+                try:
+                    os.remove(self.spill_file)
+                except OSError:
+                    pass
+                self.spilled = self.spill_offset = 0
+
+        ram = min(n - flash, self.in_flight)
+        self.head = (self.head + ram) % self.size
+        self.count -= ram
+        self.in_flight_flash = 0
+        self.in_flight = 0
+
+
+## Payload Encoder
+class PayloadEncoder:
+    # form bodies written into one preallocated buffer, numbers as fixed-point digits so no floats or strings are made
+    FIELDS_SIZE = 348                   # every field after device_id plus MAX_ACKS_PER_POST acks and a round trip
+
+    def __init__(self, device_id, slots):
+        self.device = b"device_id=" + device_id.encode()
+        self.size = len(self.device) + self.FIELDS_SIZE
+        self.buf = bytearray(slots * self.size)
+        self.view = memoryview(self.buf)
+        self.now = array('i', (0, 0))
+
+    def _put_tail(self, n, acks, sync):
+        # first body of a batch: command acks and the last measured round trip
+        buf = self.buf
+        if acks:
+            n = put_bytes(buf, n, FIELD_ACK)
+            for i in range(len(acks)):
+                if i:
+                    buf[n] = 44
+                    n += 1
+                n = put_int(buf, n, acks[i])
+
+        clock = CLOCK
+        if sync and clock.server_len:
+            probe = clock.probe
+            server = clock.server
+            n = put_bytes(buf, n, FIELD_SYNC)
+            n = put_time(buf, n, probe[0], probe[1])
+            buf[n] = 44
+            n += 1
+            for i in range(clock.server_len):
+                buf[n] = server[i]
+                n += 1
+            buf[n] = 44
+            n += 1
+            n = put_time(buf, n, probe[2], probe[3])
+            buf[n] = 44
+            n += 1
+            n = put_int(buf, n, clock.syncs)
+
+        return n
+
+    def encode(self, slot, record=None, acks=None, pga=0, noise=0, sync=False):
+        # record is an event log tuple, None for a heartbeat; pga and noise in counts, pga from the record if there is one
+        buf = self.buf
+        start = slot * self.size
+        n = put_bytes(buf, start, self.device)
+        n = put_bytes(buf, n, FIELD_EPOCH)
+
+        if record:
+            seconds = record[2]
+            ms = record[3]
+            x_raw = record[4]
+            y_raw = record[5]
+            z_raw = record[6]
+            pga = record[7]
+        else:
+            CLOCK.stamp(self.now, 0)
+            seconds = self.now[0]
+            ms = self.now[1]
+            x_raw = y_raw = z_raw = 0
+
+        if param.SEND_AXIS:
+            n = put_bytes(buf, n, FIELD_X_AXIS)
+            n = put_fixed(buf, n, counts_e4(x_raw), 4)
+            n = put_bytes(buf, n, FIELD_Y_AXIS)
+            n = put_fixed(buf, n, counts_e4(y_raw), 4)
+            n = put_bytes(buf, n, FIELD_Z_AXIS)
+            n = put_fixed(buf, n, counts_e4(z_raw), 4)
+
+        if param.SEND_GFORCE:
+            n = put_bytes(buf, n, FIELD_G_FORCE)
+            n = put_fixed(buf, n, g_e4(x_raw, y_raw, z_raw) if record else 0, 4)
+
+        # dynamic acceleration and the noise floor, gravity removed on the device
+        if param.SEND_PGA:
+            n = put_bytes(buf, n, FIELD_PGA)
+            n = put_fixed(buf, n, counts_e4(pga), 4)
+            n = put_bytes(buf, n, FIELD_NOISE)
+            n = put_fixed(buf, n, counts_e4(noise), 4)
+
+        # triggered samples carry the time they were detected, uploads can lag behind
+        if param.SEND_TIMESTAMP:
+            n = put_bytes(buf, n, FIELD_TIMESTAMP)
+            n = put_time(buf, n, seconds, ms)
+
+        # store-and-forward records, the server orders and de-duplicates on these
+        if record:
+            n = put_bytes(buf, n, FIELD_BOOT)
+            n = put_int(buf, n, record[0])
+            n = put_bytes(buf, n, FIELD_SEQ)
+            n = put_int(buf, n, record[1])
+
+        n = self._put_tail(n, acks, sync)
+        return self.view[start:n]
+
+    def encode_frame(self, slot, frame, boot, acks=None, noise=0, sync=False):
+        # one FeatureWindow frame, pga and rms in g, zero-crossing rate and dominant frequency to 0.1
+        buf = self.buf
+        start = slot * self.size
+        n = put_bytes(buf, start, self.device)
+        n = put_bytes(buf, n, FIELD_EPOCH)
+
+        n = put_bytes(buf, n, FIELD_TIMESTAMP)
+        n = put_time(buf, n, frame[1], frame[2])
+        n = put_bytes(buf, n, FIELD_BOOT)
+        n = put_int(buf, n, boot)
+        n = put_bytes(buf, n, FIELD_WINDOW)
+        n = put_int(buf, n, frame[0])
+
+        n = put_bytes(buf, n, FIELD_PGA)
+        n = put_fixed(buf, n, counts_e4(frame[3]), 4)
+        n = put_bytes(buf, n, FIELD_RMS)
+        n = put_fixed(buf, n, counts_e4(frame[4]), 4)
+        n = put_bytes(buf, n, FIELD_ZCR)
+        n = put_fixed(buf, n, frame[5], 1)
+        n = put_bytes(buf, n, FIELD_DOMINANT_HZ)
+        n = put_fixed(buf, n, frame[6], 1)
+        n = put_bytes(buf, n, FIELD_TRIGGERED)
+        n = put_int(buf, n, frame[7])
+        n = put_bytes(buf, n, FIELD_NOISE)
+        n = put_fixed(buf, n, counts_e4(noise), 4)
+
+        n = self._put_tail(n, acks, sync)
+        return self.view[start:n]
+
+
+## Loop Stats
+class LoopStats:
+    # sampler wake-up lateness and gc pauses in microseconds since the last report
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.wakes = 0
+        self.late_sum = 0
+        self.late_max = 0
+        self.collects = 0
+        self.gc_max = 0
+        self.switches = 0
+        self.switch_max = 0
+
+    def wake(self, late_us):
+        if late_us < 0:
+            late_us = -late_us
+        self.wakes += 1
+        self.late_sum += late_us
+        if late_us > self.late_max:
+            self.late_max = late_us
+
+    def collected(self, pause_us):
+        self.collects += 1
+        if pause_us > self.gc_max:
+            self.gc_max = pause_us
+
+    def switched(self, took_us):
+        self.switches += 1
+        if took_us > self.switch_max:
+            self.switch_max = took_us
+
+    def report(self):
+        if self.wakes:
+            tprint(PRINTSTATUS.INFO, f"Loop jitter mean {self.late_sum // self.wakes} us, max {self.late_max} us, "
+                                     f"{self.collects} gc max {self.gc_max} us, {self.switches} rate switches max {self.switch_max} us, "
+                                     f"{gc.mem_free()} bytes free")
+        self.reset()
+
+
+## Device State
+MODE_NORMAL = 0
+MODE_EARTHQUAKE = 1
+
+class DeviceState:
+    # shared by the tasks, only touched between awaits so no locking is needed
+    def __init__(self, detector=None):
+        self.mode = MODE_NORMAL
+        self.detector = detector        # read for the noise floor and peak PGA of heartbeats
+        self.events = EventLog(param.EVENT_BUFFER_SIZE, SPILL_FILE if param.EVENT_SPILL else None)
+        self.encoder = PayloadEncoder(param.DEVICE_ID, param.UPLOAD_BATCH)
+        self.stats = LoopStats()
+        self.features = init_features()
+        self.capturing = True           # full rate unless a RateControl says otherwise
+        self.g_force = 0                # shown on the display, 1/10000 g
+        self.exit_deadline = None
+        self.upload = asyncio.Event()
+
+
+## downlink commands
+PENDING_ACKS = []           # executed command ids to acknowledge on the next post
+EXECUTED_COMMANDS = []      # recently executed command ids, guards against redelivery
+RECEIVED_COMMANDS = []      # commands received in the last post response
+MAX_EXECUTED_COMMANDS = 8
+MAX_ACKS_PER_POST = 8       # the rest go with the following posts
+HEARTBEAT = (None,)         # post_batch records for an idle post
+
+
+## cached payload fields
+FIELD_X_AXIS = b"&x_axis="
+FIELD_Y_AXIS = b"&y_axis="
+FIELD_Z_AXIS = b"&z_axis="
+FIELD_G_FORCE = b"&g_force="
+FIELD_PGA = b"&pga="
+FIELD_NOISE = b"&noise="
+FIELD_TIMESTAMP = b"&device_timestamp="
+FIELD_BOOT = b"&boot="
+FIELD_SEQ = b"&seq="
+FIELD_ACK = b"&ack="
+FIELD_WINDOW = b"&window="
+FIELD_RMS = b"&rms="
+FIELD_ZCR = b"&zcr="
+FIELD_DOMINANT_HZ = b"&dominant_hz="
+FIELD_TRIGGERED = b"&triggered="
+FIELD_SYNC = b"&sync="
+FIELD_EPOCH = b"&epoch=" + str(time.gmtime(0)[0]).encode()     # timestamps count from 2000 on the ESP32 port
+
+TEXT_NORMAL = b"Mode: Normal"
+TEXT_EARTHQUAKE = b"Earthquake!"
+TEXT_G_IDLE = b"G: 0.000 g"
+
+
 ## helpers
-def magnitude(x_axis, y_axis, z_axis):
-    return (x_axis**2 + y_axis**2 + z_axis**2) ** 0.5
+def isqrt(value):
+    if value <= 0:
+        return 0
+    x = value
+    y = (x + 1) >> 1
+    while y < x:
+        x = y
+        y = (x + value // x) >> 1
+    return x
+
+
+def g_e4(x_raw, y_raw, z_raw):
+    # magnitude in 1/10000 g, counts >> 2 keep the squares small ints
+    x_raw >>= 2
+    y_raw >>= 2
+    z_raw >>= 2
+    return isqrt(x_raw * x_raw + y_raw * y_raw + z_raw * z_raw) * 10000 >> 12
+
+
+def counts_e4(raw):
+    # one axis in 1/10000 g, rounded toward zero like the float it replaces
+    if raw < 0:
+        return -((-raw * 10000) >> 14)
+    return (raw * 10000) >> 14
+
+
+def put_bytes(buf, n, data):
+    end = n + len(data)
+    buf[n:end] = data
+    return end
+
+
+def put_int(buf, n, value):
+    # decimal digits written in place, no str() on the way
+    if value < 0:
+        buf[n] = 45
+        n += 1
+        value = -value
+
+    start = n
+    while True:
+        buf[n] = 48 + value % 10
+        n += 1
+        value //= 10
+        if not value:
+            break
+
+    i = start
+    j = n - 1
+    while i < j:
+        buf[i], buf[j] = buf[j], buf[i]
+        i += 1
+        j -= 1
+    return n
+
+
+def put_fixed(buf, n, value, decimals):
+    # value in 1/10**decimals units written as a decimal fraction
+    if value < 0:
+        buf[n] = 45
+        n += 1
+        value = -value
+
+    scale = 10 ** decimals
+    n = put_int(buf, n, value // scale)
+    buf[n] = 46
+    n += 1
+
+    fraction = value % scale
+    i = n + decimals
+    while i > n:
+        i -= 1
+        buf[i] = 48 + fraction % 10
+        fraction //= 10
+    return n + decimals
+
+
+def put_time(buf, n, seconds, ms):
+    # clock time as seconds.mmm
+    n = put_int(buf, n, seconds)
+    buf[n] = 46
+    buf[n + 1] = 48 + ms // 100
+    buf[n + 2] = 48 + ms // 10 % 10
+    buf[n + 3] = 48 + ms % 10
+    return n + 4
+
+
+def init_detector():
+    return StaLta(
+        param.STA_SAMPLES,
+        param.LTA_SAMPLES,
+        param.STA_LTA_ON,
+        param.STA_LTA_OFF,
+        param.PGA_THRESHOLD,
+        param.HIGHPASS_SHIFT
+    )
 
 
-def detect_earthquake(mpu):
-    try:
-        x_axis, y_axis, z_axis = mpu.read_accel()
-        g_force = magnitude(x_axis, y_axis, z_axis)
-
-        data = {
-            "x_axis": x_axis,
-            "y_axis": y_axis,
-            "z_axis": z_axis,
-            "g_force": g_force
-        }
-
-        if g_force >= param.EARTHQUAKE_THRESHOLD:
-            return data
-        return None
-    except:
+def init_features():
+    if not param.SEND_FEATURES:
         return None
 
+    return FeatureWindow(param.FEATURE_WINDOW, param.SAMPLE_RATE_HZ, param.FEATURE_BINS_HZ,
+                         param.FEATURE_FRAMES, param.FEATURE_ACTIVE_FACTOR)
 
-def payload(data=None):
 
-    if data:
-        x_axis = data["x_axis"]
-        y_axis = data["y_axis"]
-        z_axis = data["z_axis"]
-        g_force = data["g_force"]
+def split_url(url):
+    scheme, rest = url.split("://", 1)
+    if "/" in rest:
+        host, path = rest.split("/", 1)
+        path = "/" + path
     else:
-        x_axis = y_axis = z_axis = 0.0
-        g_force = 0.0
+        host, path = rest, "/"
 
-    payload = {}
+    port = 443 if scheme == "https" else 80
+    if ":" in host:
+        host, port = host.split(":", 1)
+        port = int(port)
 
-    if param.SEND_AXIS:
-        payload["x_axis"] = x_axis
-        payload["y_axis"] = y_axis
-        payload["z_axis"] = z_axis
+    return host, port, path, scheme == "https"
 
-    if param.SEND_GFORCE:
-        payload["g_force"] = g_force
 
-    if param.SEND_TIMESTAMP:
-        payload["device_timestamp"] = time.time()
+# one millisecond clock for every timestamp
+CLOCK = Clock()
 
-    payload["device_id"] = param.DEVICE_ID
+# one keep-alive connection for every post
+UPLOADER = Uploader(f"{API_URL}/post", param.REQUEST_BUFFER_SIZE)
 
-    return payload
 
+async def post_batch(state, records, frames=False):
+    # pipelined posts of event log records, None for a heartbeat, or of feature frames,
+    # returns how many in a row from the first were accepted
 
-def post_data(data):
+    acks = PENDING_ACKS[:MAX_ACKS_PER_POST]
+    detector = state.detector
+    noise = detector.noise_counts() if detector else 0
+    pga = detector.take_peak() if detector and records is HEARTBEAT else 0
 
-    url = f"{API_URL}/post"
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    encoder = state.encoder
+    if frames:
+        boot = state.events.boot
+        bodies = [encoder.encode_frame(i, records[i], boot, acks if i == 0 else None, noise, i == 0) for i in range(len(records))]
+    else:
+        bodies = [encoder.encode(i, records[i], acks if i == 0 else None, pga, noise, i == 0) for i in range(len(records))]
 
+    clock = CLOCK
+    clock.stamp(clock.sending, 0)
     try:
-        payload_str = "&".join([f"{k}={v}" for k, v in data.items()])
-        r = requests.post(url, data=payload_str, headers=headers)
-        r.close()
-        return True
+        results = await asyncio.wait_for(UPLOADER.pipeline(bodies), param.HTTP_TIMEOUT)
+    except asyncio.CancelledError:
+        raise
     except:
-        return False
+        return 0
+    clock.stamp(clock.sending, 2)
+
+    # a pipelined batch would count the later responses into the round trip
+    if len(results) == 1 and results[0][0] == 200:
+        clock.reply(results[0][1])
+
+    sent = 0
+    for status, content in results:
+        if status != 200:
+            break
+        sent += 1
+
+        # most responses carry no commands, skip building a dict for those
+        if b'"id"' not in content:
+            continue
+
+        try:
+            commands = json.loads(content).get("commands")
+        except:
+            commands = None
 
+        # commands stay queued server side until acked, skip repeats
+        if commands:
+            queued = [c.get("id") for c in RECEIVED_COMMANDS]
+            for command in commands:
+                if command.get("id") not in queued:
+                    RECEIVED_COMMANDS.append(command)
 
-def fetch_data():
+    if acks and sent:
+        for a in acks:
+            PENDING_ACKS.remove(a)
+        save_acks()
 
-    url = f"{API_URL}/eews/fetch"
+    return sent
 
+
+def load_acks():
+    try:
+        with open(ACK_FILE, "r") as f:
+            for part in f.read().split(","):
+                if part:
+                    PENDING_ACKS.append(int(part))
+                    EXECUTED_COMMANDS.append(int(part))
+    except:
+        pass
+
+
+def save_acks():
     try:
-        r = requests.get(url)
-        r.close()
+        with open(ACK_FILE, "w") as f:
+            f.write(",".join([str(a) for a in PENDING_ACKS]))
     except:
         pass
 
 
+def acknowledge(cmd_id):
+    if cmd_id not in PENDING_ACKS:
+        PENDING_ACKS.append(cmd_id)
+
+    EXECUTED_COMMANDS.append(cmd_id)
+    if len(EXECUTED_COMMANDS) > MAX_EXECUTED_COMMANDS:
+        EXECUTED_COMMANDS.pop(0)
+
+    save_acks()
+
+
+async def sleep_uploads(state, duration):
+    # pauses the uploader for duration seconds, a trigger or event samples waiting to go out end it early
+    deadline = time.ticks_add(time.ticks_ms(), int(duration * 1000))
+
+    while state.mode == MODE_NORMAL and not state.events.pending():
+        remaining = time.ticks_diff(deadline, time.ticks_ms())
+        if remaining <= 0:
+            return
+        state.upload.clear()
+        try:
+            await asyncio.wait_for_ms(state.upload.wait(), remaining)
+        except asyncio.TimeoutError:
+            return
+
+
+async def run_commands(state, lcd=None, buzzer=None):
+    # runs in the uploader task, a sleep pauses uploads while the sampler and detector keep going
+
+    while RECEIVED_COMMANDS:
+        command = RECEIVED_COMMANDS.pop(0)
+        cmd_id = command.get("id")
+        cmd = command.get("cmd")
+
+        if cmd_id is None:
+            continue
+
+        # already executed, the server just has not seen the ack yet
+        if cmd_id in EXECUTED_COMMANDS:
+            if cmd_id not in PENDING_ACKS:
+                PENDING_ACKS.append(cmd_id)
+            continue
+
+        # ack is persisted before acting so a restart cannot loop
+        acknowledge(cmd_id)
+
+        if cmd == "restart":
+            if lcd:
+                lcd.clear()
+                lcd.putstr("Restarting...")
+            machine.reset()
+
+        elif cmd == "sleep":
+            duration = command.get("duration", param.SLEEP_INTERVAL)
+            if not isinstance(duration, (int, float)) or duration <= 0:
+                continue
+            if buzzer:
+                buzzer.off()
+            if lcd:
+                lcd.clear()
+                lcd.putstr("Sleeping...")
+            await sleep_uploads(state, duration)
+            if lcd:
+                lcd.clear()
+
+
 ## init
 def init_mpu6050(i2c):
     devices = i2c.scan()
@@ -232,11 +1664,57 @@ def init_lcd(i2c):
 
     for addr in (0x27, 0x3F):
         if addr in devices:
-            return I2cLcd(i2c, addr, 2, 16)
+            return I2cLcd(i2c, addr, 2, 16, min_interval_ms=param.LCD_MIN_REFRESH_MS)
 
     return None
 
 
+def init_rate_control(mpu, state):
+    if not param.ADAPTIVE_RATE:
+        return None
+
+    pin = None
+    if param.MPU_INT_PIN is not None:
+        pin = machine.Pin(param.MPU_INT_PIN, machine.Pin.IN)
+
+    try:
+        return RateControl(mpu, state, pin)
+    except Exception as e:
+        eprint(PRINTSTATUS.WARN, f"Motion interrupt unavailable, fixed rate: {e}")
+        return None
+
+
+def calibrate(mpu, detector, samples):
+    # gravity vector and noise floor from the first samples at boot, the device should be at rest
+    sums = [0, 0, 0]
+    squares = [0, 0, 0]
+    n = 0
+    deadline = time.ticks_add(time.ticks_ms(), int(samples * 1000 // mpu.sample_rate) + 1000)
+
+    while n < samples and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+        got = mpu.read_fifo()
+        for i in range(got):
+            counts = mpu.fifo_sample(i)
+            for axis in range(3):
+                sums[axis] += counts[axis]
+                squares[axis] += counts[axis] * counts[axis]
+        n += got
+        if got < mpu.batch:
+            time.sleep_ms(param.SAMPLER_INTERVAL_MS)
+
+    if n < 2:
+        eprint(PRINTSTATUS.WARN, "Calibration got no samples, gravity is learned on the fly")
+        return False
+
+    gravity = [total // n for total in sums]
+    variance = sum((n * squares[axis] - sums[axis] * sums[axis]) // (n * n) for axis in range(3))
+    detector.calibrate(gravity, variance)
+
+    tprint(PRINTSTATUS.INFO, f"Calibrated on {n} samples, gravity {g_e4(*gravity) / 10000:.3f} g, "
+                             f"noise floor {detector.noise_counts() / 16384:.4f} g")
+    return True
+
+
 def init_buzzer():
     try:
         return Buzzer(param.BUZZER_PIN)
@@ -244,107 +1722,377 @@ def init_buzzer():
         return None
 
 
-## main
-def main():
+## tasks
+async def sampler_task(mpu, queue, stats=None, rate=None):
+    # the only task that touches the MPU6050, never waits on the network
+    interval_ms = param.SAMPLER_INTERVAL_MS
+    decimator = rate.decimator if rate else None
+    woke = time.ticks_us()
+    slept = False
 
-    shared_i2c = machine.SoftI2C(
-        scl=machine.Pin(param.SLC_PINOUT),
-        sda=machine.Pin(param.SDA_PINOUT),
-        freq=param.I2C_FREQUENCY
-    )
+    while True:
+        # how late the scheduler woke us, only after a full interval sleep
+        now = time.ticks_us()
+        if slept and stats:
+            stats.wake(time.ticks_diff(now, woke) - interval_ms * 1000)
+        woke = now
+
+        samples = mpu.read_fifo()
+        i = 0
+        while i < samples:
+            counts = mpu.fifo_sample(i)
+            if decimator:
+                counts = decimator.push(counts)
+            if counts is not None:
+                queue.put(counts)
+            i += 1
+
+        # rate switches happen here, right after a drain
+        if rate:
+            interval_ms = rate.update()
+
+        slept = samples < mpu.batch
+        if not slept:
+            await asyncio.sleep_ms(0)
+        elif rate and rate.pin is not None and not rate.capturing:
+            # woken early on motion by design, not counted as jitter
+            slept = False
+            await rate.idle(interval_ms)
+        else:
+            await asyncio.sleep_ms(interval_ms)
+
+
+def report_trigger(state, counts, seconds, ms, pga, buzzer):
+    state.events.append(counts, seconds, ms, pga)
+
+    state.g_force = g_e4(counts[0], counts[1], counts[2])
+    state.exit_deadline = None
+
+    if state.mode == MODE_NORMAL:
+        state.mode = MODE_EARTHQUAKE
+        if buzzer:
+            buzzer.on()
+
+    state.upload.set()
+
+
+def report_quiet(state, buzzer):
+    if state.mode != MODE_EARTHQUAKE:
+        return
 
-    mpu = init_mpu6050(shared_i2c)
-    lcd = init_lcd(shared_i2c)
-    buzzer = init_buzzer()
+    now = time.time()
 
-    if mpu is None:
-        return
+    if state.exit_deadline is None:
+        state.exit_deadline = now + param.STABLE_TIME
+
+    elif now >= state.exit_deadline:
 
-    MODE_NORMAL = 0
-    MODE_EARTHQUAKE = 1
+        if buzzer:
+            buzzer.off()
 
-    mode = MODE_NORMAL
-    exit_deadline = None
+        state.mode = MODE_NORMAL
+        state.exit_deadline = None
+        state.g_force = 0
 
-    normal_loop_counter = 0
+
+async def detector_task(queue, detector, state, buzzer):
+    counts = array('i', (0, 0, 0))
+    peak_counts = array('i', (0, 0, 0))
+    now = array('i', (0, 0))
+    features = state.features
 
     while True:
+        await queue.wait()
+
+        # strongest triggered sample in this batch, by dynamic acceleration
+        peak = -1
+        while queue.get(counts):
+            triggered = detector.update(counts)
+            if features and features.push(detector) and features.frames.count:
+                state.upload.set()
+            if triggered and detector.dyn_sq > peak:
+                peak = detector.dyn_sq
+                peak_counts[0] = counts[0]
+                peak_counts[1] = counts[1]
+                peak_counts[2] = counts[2]
+
+        if peak >= 0:
+            CLOCK.stamp(now, 0)
+            report_trigger(state, peak_counts, now[0], now[1], isqrt(peak), buzzer)
+        else:
+            report_quiet(state, buzzer)
+
+
+def sampler_thread(mpu, detector, ring, stats=None, rate=None, features=None):
+    # sampler and detector on their own thread, only triggered peaks cross over as x, y, z, time, ms, pga
+    peak_counts = array('i', (0, 0, 0, 0, 0, 0))
+    decimator = rate.decimator if rate else None
+    interval_us = param.SAMPLER_INTERVAL_MS * 1000
+    woke = time.ticks_us()
+    slept = False
+
+    while ring.running:
+        now = time.ticks_us()
+        if slept and stats:
+            stats.wake(time.ticks_diff(now, woke) - interval_us)
+        woke = now
+        slept = True
+
+        peak = -1
+        samples = mpu.read_fifo()
+        while samples:
+            i = 0
+            while i < samples:
+                counts = mpu.fifo_sample(i)
+                i += 1
+                if decimator:
+                    counts = decimator.push(counts)
+                    if counts is None:
+                        continue
+                triggered = detector.update(counts)
+                if features:
+                    features.push(detector)
+                if triggered and detector.dyn_sq > peak:
+                    peak = detector.dyn_sq
+                    peak_counts[0] = counts[0]
+                    peak_counts[1] = counts[1]
+                    peak_counts[2] = counts[2]
+            samples = mpu.read_fifo() if samples == mpu.batch else 0
+
+        if peak >= 0:
+            CLOCK.stamp(peak_counts, 3)
+            peak_counts[5] = isqrt(peak)
+            ring.put(peak_counts)
+
+        # this thread has its own core to spare, it keeps the short drain period in both rates
+        if rate:
+            rate.update()
+
+        time.sleep_ms(param.SAMPLER_INTERVAL_MS)
+
+
+async def ring_task(ring, state, buzzer):
+    record = array('i', (0, 0, 0, 0, 0, 0))
+    features = state.features
 
-        if mode == MODE_NORMAL:
+    while True:
+        triggered = False
+        while ring.get(record):
+            report_trigger(state, record, record[3], record[4], record[5], buzzer)
+            triggered = True
 
-            if buzzer:
-                buzzer.off()
+        if features and features.frames.count:
+            state.upload.set()
 
-            shake_detected = False
+        if not triggered:
+            report_quiet(state, buzzer)
 
-            for _ in range(param.REQUIRED_SHAKE_COUNT):
+        await asyncio.sleep_ms(param.SAMPLER_INTERVAL_MS)
 
-                data = detect_earthquake(mpu)
 
-                if data:
-                    shake_detected = True
+async def uploader_task(state, lcd, buzzer):
+    events = state.events
+    frames = state.features.frames if state.features else None
+    rows = [array('i', bytes(4 * FeatureWindow.WIDTH)) for _ in range(param.UPLOAD_BATCH)] if frames else None
+    backoff_ms = 0
 
-                time.sleep(param.NORMAL_INTERVAL / param.REQUIRED_SHAKE_COUNT)
+    while True:
+        if backoff_ms:
+            await asyncio.sleep_ms(backoff_ms)
+
+        elif not events.pending() and not (frames and frames.count):
+            try:
+                # idle devices check in every SLEEP_INTERVAL seconds instead
+                interval_ms = param.HEARTBEAT_INTERVAL_MS if state.capturing else param.SLEEP_INTERVAL * 1000
+                await asyncio.wait_for_ms(state.upload.wait(), interval_ms)
+            except asyncio.TimeoutError:
+                pass
+            state.upload.clear()
+
+        # a slow post only delays the next one, samples wait in the event log meanwhile
+        if events.pending():
+            records = events.batch(param.UPLOAD_BATCH)
+            sent = await post_batch(state, records)
+            events.commit(sent)
+
+            if sent < len(records):
+                backoff_ms = min(max(2 * backoff_ms, param.UPLOAD_BACKOFF_MIN_MS), param.UPLOAD_BACKOFF_MAX_MS)
+                continue
 
-            if shake_detected:
+            backoff_ms = 0
+            await asyncio.sleep(param.EARTHQUAKE_INTERVAL)
 
-                mode = MODE_EARTHQUAKE
-                exit_deadline = None
+        # feature frames after the event samples, they stand in for a heartbeat
+        elif frames and frames.count:
+            dropped = frames.dropped
+            n = 0
+            while n < len(rows) and frames.peek(n, rows[n]):
+                n += 1
 
-                if buzzer:
-                    buzzer.on()
+            sent = await post_batch(state, rows[:n], frames=True)
+            # frames overwritten while posting were the oldest, the sent ones among them are gone already
+            frames.drop(sent - (frames.dropped - dropped))
 
-                if lcd:
-                    lcd.clear()
-                    lcd.move_to(0,0)
-                    lcd.putstr("Earthquake!")
+            if sent < n:
+                backoff_ms = min(max(2 * backoff_ms, param.UPLOAD_BACKOFF_MIN_MS), param.UPLOAD_BACKOFF_MAX_MS)
+                continue
+            backoff_ms = 0
 
+        elif state.mode == MODE_NORMAL:
+            if not await post_batch(state, HEARTBEAT):
+                backoff_ms = min(max(2 * backoff_ms, param.UPLOAD_BACKOFF_MIN_MS), param.UPLOAD_BACKOFF_MAX_MS)
                 continue
+            backoff_ms = 0
 
+        if state.mode == MODE_NORMAL:
+            await run_commands(state, lcd, buzzer)
 
-            normal_loop_counter += 1
 
-            if normal_loop_counter >= 5:
-                post_data(payload(None))
-                #fetch_data()
-                normal_loop_counter = 0
+async def clock_task():
+    # NTP at start and every CLOCK_SYNC_INTERVAL_MS, rebased in between so the anchor never ages past the ticks range
+    clock = CLOCK
+    sync_at = time.ticks_ms()
 
+    while True:
+        if time.ticks_diff(time.ticks_ms(), sync_at) >= 0:
+            if await clock.sync(ntptime.host, param.CLOCK_SYNC_TIMEOUT_MS):
+                sync_at = time.ticks_add(time.ticks_ms(), param.CLOCK_SYNC_INTERVAL_MS)
+            else:
+                sync_at = time.ticks_add(time.ticks_ms(), param.CLOCK_SYNC_RETRY_MS)
 
-            if lcd:
-                lcd.move_to(0,0)
-                lcd.putstr("Mode: Normal ")
-                lcd.move_to(0,1)
-                lcd.putstr("G: 0.000 g ")
+        clock.rebase()
+        await asyncio.sleep_ms(param.CLOCK_REBASE_INTERVAL_MS)
+
+
+async def await_connected(wlan, timeout_ms):
+    deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+    while not wlan.isconnected():
+        if time.ticks_diff(time.ticks_ms(), deadline) >= 0:
+            return False
+        await asyncio.sleep_ms(WIFI_POLL_MS)
+    return True
 
-            time.sleep(param.NORMAL_INTERVAL)
+
+async def wifi_task():
+    # re-associates in the background when the link drops, cached access point first, instead of resetting the MCU
+    wlan = network.WLAN(network.STA_IF)
+
+    while True:
+        await asyncio.sleep_ms(param.WIFI_CHECK_INTERVAL_MS)
+        if wlan.isconnected():
             continue
 
+        tprint(PRINTSTATUS.WARN, "WiFi lost, reconnecting")
+        await UPLOADER.close()
+        started = time.ticks_ms()
+
+        cache = load_wifi_cache()
+        if not (cache and begin_fast_connect(wlan, cache) and await await_connected(wlan, WIFI_FAST_TIMEOUT_MS)):
+            begin_connect(wlan)
+            if not await await_connected(wlan, WIFI_TIMEOUT_MS):
+                tprint(PRINTSTATUS.WARN, "WiFi still down")
+                continue
+            # read from the new link, no scan, so the sampler is not held up
+            save_wifi_cache(wlan)
+
+        tprint(PRINTSTATUS.SUCCESS, f"WiFi back in {time.ticks_diff(time.ticks_ms(), started)} ms")
 
-        if mode == MODE_EARTHQUAKE:
 
-            data = detect_earthquake(mpu)
-            now = time.time()
+async def display_task(state, lcd):
+    line = bytearray(lcd.cols)
 
-            if data:
+    while True:
+        if state.mode == MODE_EARTHQUAKE:
+            n = put_bytes(line, 0, b"G:")
+            n = put_fixed(line, n, state.g_force // 10, 3)
+            n = put_bytes(line, n, b" g")
+            lcd.write_line(0, TEXT_EARTHQUAKE)
+            lcd.write_line(1, line, n)
+        else:
+            lcd.write_line(0, TEXT_NORMAL)
+            lcd.write_line(1, TEXT_G_IDLE)
 
-                exit_deadline = None
-                post_data(payload(data))
+        # unchanged cells cost no bus time
+        lcd.flush()
 
-                if lcd:
-                    lcd.move_to(0,1)
-                    lcd.putstr(f"G:{data['g_force']:.3f} g")
+        await asyncio.sleep_ms(param.DISPLAY_INTERVAL_MS)
 
-            else:
 
-                if exit_deadline is None:
-                    exit_deadline = now + param.STABLE_TIME
+async def gc_task(state):
+    # collections happen here while idle, not whenever an allocation finds the heap full mid-burst
+    stats = state.stats
+    report_at = time.ticks_add(time.ticks_ms(), param.LOOP_STATS_INTERVAL_MS)
+
+    while True:
+        await asyncio.sleep_ms(param.GC_INTERVAL_MS)
+
+        if state.mode == MODE_NORMAL or gc.mem_free() < param.GC_MIN_FREE:
+            started = time.ticks_us()
+            gc.collect()
+            stats.collected(time.ticks_diff(time.ticks_us(), started))
+
+        if param.LOOP_STATS and time.ticks_diff(time.ticks_ms(), report_at) >= 0:
+            stats.report()
+            report_at = time.ticks_add(time.ticks_ms(), param.LOOP_STATS_INTERVAL_MS)
+
+
+async def run_tasks(mpu, lcd, buzzer, threaded=False):
+
+    detector = init_detector()
+    state = DeviceState(detector)
+    rate = init_rate_control(mpu, state)
+    calibrate(mpu, detector, param.CALIBRATION_SAMPLES)
+
+    if buzzer:
+        buzzer.off()
+
+    if threaded:
+        ring = LockedRing(param.EVENT_RING_SIZE, 6)
+        _thread.start_new_thread(sampler_thread, (mpu, detector, ring, state.stats, rate, state.features))
+        tasks = [asyncio.create_task(ring_task(ring, state, buzzer))]
+    else:
+        queue = SampleQueue(param.SAMPLE_QUEUE_SIZE)
+        tasks = [
+            asyncio.create_task(sampler_task(mpu, queue, state.stats, rate)),
+            asyncio.create_task(detector_task(queue, detector, state, buzzer))
+        ]
+
+    tasks.append(asyncio.create_task(uploader_task(state, lcd, buzzer)))
+    tasks.append(asyncio.create_task(gc_task(state)))
+
+    if param.CLOCK_SYNC:
+        tasks.append(asyncio.create_task(clock_task()))
 
-                elif now >= exit_deadline:
+    if param.WIFI_WATCHDOG:
+        tasks.append(asyncio.create_task(wifi_task()))
 
-                    if buzzer:
-                        buzzer.off()
+    if lcd:
+        tasks.append(asyncio.create_task(display_task(state, lcd)))
+
+    await asyncio.gather(*tasks)
+
+
+## main
+def main():
+
+    shared_i2c = machine.SoftI2C(
+        scl=machine.Pin(param.SLC_PINOUT),
+        sda=machine.Pin(param.SDA_PINOUT),
+        freq=param.I2C_FREQUENCY
+    )
+
+    # the sampler thread and the display share the bus
+    if param.SAMPLER_THREAD:
+        shared_i2c = LockedI2C(shared_i2c)
+
+    mpu = init_mpu6050(shared_i2c)
+    lcd = init_lcd(shared_i2c)
+    buzzer = init_buzzer()
+
+    if mpu is None:
+        return
 
-                    mode = MODE_NORMAL
-                    exit_deadline = None
+    load_acks()
+    gc.collect()
 
-            time.sleep(param.EARTHQUAKE_INTERVAL)
+    asyncio.run(run_tasks(mpu, lcd, buzzer, param.SAMPLER_THREAD))
@@ -0,0 +1,75 @@
+## make_manifest.py - writes the signed update manifest devices fetch at boot (host side)
+##
+##   python make_manifest.py --status live --version v0.9.47 main.py configs/parameters.py
+##   OTA_KEY=... python make_manifest.py --status test --version v0.9.47beta main.py
+##
+## The key comes from --key, OTA_KEY in the environment or configs/ota_key.py, the same
+## uncommitted file that is copied to each device:  OTA_KEY = "..."
+
+import os
+import sys
+import hmac
+import json
+import hashlib
+import argparse
+
+
+def manifest_message(manifest):
+    # must match boot.manifest_message()
+    lines = [manifest["status"], manifest["version"]]
+    for path in sorted(manifest["files"]):
+        entry = manifest["files"][path]
+        lines.append(f"{path}:{entry['sha256']}:{entry['size']}")
+    return "\n".join(lines).encode()
+
+
+def local_key():
+    # configs/ota_key.py next to this script, ignored by git
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        from configs.ota_key import OTA_KEY
+        return OTA_KEY
+    except ImportError:
+        return None
+
+
+def file_entry(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write a signed update manifest for the files devices should run")
+    parser.add_argument("files", nargs="+", help="paths relative to iot/, as they sit on the device")
+    parser.add_argument("--status", required=True, choices=("live", "test", "hold"), help="devices only update from live and test")
+    parser.add_argument("--version", required=True, help="version string written to the device's version.txt")
+    parser.add_argument("--key", default=os.environ.get("OTA_KEY"), help="signing key, OTA_KEY in the environment or configs/ota_key.py by default")
+    parser.add_argument("--output", default="manifest.json", help="manifest path")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.key = args.key or local_key()
+    if not args.key:
+        print("No signing key, pass --key, set OTA_KEY or write configs/ota_key.py", file=sys.stderr)
+        return 1
+
+    manifest = {
+        "status": args.status,
+        "version": args.version,
+        "files": {path: file_entry(path) for path in args.files}
+    }
+    manifest["signature"] = hmac.new(args.key.encode(), manifest_message(manifest), hashlib.sha256).hexdigest()
+
+    with open(args.output, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+
+    print(f"{args.output}: {args.status} {args.version}, {len(args.files)} file(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
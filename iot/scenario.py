@@ -0,0 +1,130 @@
+## scenario.py - seismic wave propagation scenarios for the emulator (host side, needs numpy)
+
+import math
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+## defaults
+P_VELOCITY = 6.0            # km/s
+S_VELOCITY = 3.5            # km/s
+DEPTH_KM = 10.0             # hypocenter depth
+P_TO_S_RATIO = 0.3          # P-wave amplitude relative to S-wave
+P_FREQUENCY = 6.0           # Hz, dominant frequency of the P-wave
+S_FREQUENCY = 2.0           # Hz, dominant frequency of the S-wave
+P_RISE = 0.5                # seconds from arrival to P envelope peak
+S_RISE = 1.5                # seconds from arrival to S envelope peak
+NOISE_G = 0.005             # sensor noise, g
+TICK = 0.02                 # seconds, the whole fleet's waveforms are computed once per tick and shared
+
+## simplified attenuation: log10(PGA[g]) = A*M - log10(R + B) - C*R + D
+ATTEN_A = 0.5
+ATTEN_B = 10.0
+ATTEN_C = 0.002
+ATTEN_D = -2.2
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def peak_ground_acceleration(magnitude, distance_km):
+    return 10 ** (ATTEN_A * magnitude - np.log10(distance_km + ATTEN_B) - ATTEN_C * distance_km + ATTEN_D)
+
+
+def envelope(tau, rise):
+    # zero before arrival, peaks at 1.0 when tau == rise, then decays
+    x = np.maximum(tau, 0.0) / rise
+    return x * np.exp(1.0 - x)
+
+
+class WaveScenario:
+    def __init__(self, latitude, longitude, origin_time=0.0, magnitude=6.0, depth_km=DEPTH_KM,
+                 vp=P_VELOCITY, vs=S_VELOCITY, noise=NOISE_G, seed=1, tick=TICK):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.origin_time = origin_time
+        self.magnitude = magnitude
+        self.depth_km = depth_km
+        self.vp = vp
+        self.vs = vs
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.tick = tick
+        self.index = {}
+        self.frame = None
+        self.frame_tick = None
+
+    def bind(self, devices):
+        lats = np.array([d["latitude"] for d in devices], dtype=float)
+        lons = np.array([d["longitude"] for d in devices], dtype=float)
+        self.index = {d["id"]: i for i, d in enumerate(devices)}
+
+        self.epicentral_km = haversine_km(self.latitude, self.longitude, lats, lons)
+        self.hypocentral_km = np.sqrt(self.epicentral_km ** 2 + self.depth_km ** 2)
+        self.p_arrival = self.origin_time + self.hypocentral_km / self.vp
+        self.s_arrival = self.origin_time + self.hypocentral_km / self.vs
+        self.pga = peak_ground_acceleration(self.magnitude, self.hypocentral_km)
+        self.azimuth = self.rng.uniform(0, 2 * np.pi, len(devices))
+        self.p_phase = self.rng.uniform(0, 2 * np.pi, len(devices))
+        self.s_phase = self.rng.uniform(0, 2 * np.pi, len(devices))
+        self.frame = self.frame_tick = None
+        return self
+
+    def waveforms(self, times, indices=None):
+        """Acceleration in g for the bound devices (all, or the given indices), arrays shaped (devices, len(times))"""
+        sel = slice(None) if indices is None else np.asarray(indices)
+        pga = self.pga[sel]
+        t = np.asarray(times, dtype=float)[None, :]
+        p = (pga * P_TO_S_RATIO)[:, None] * envelope(t - self.p_arrival[sel][:, None], P_RISE) \
+            * np.sin(2 * np.pi * P_FREQUENCY * t + self.p_phase[sel][:, None])
+        s = pga[:, None] * envelope(t - self.s_arrival[sel][:, None], S_RISE) \
+            * np.sin(2 * np.pi * S_FREQUENCY * t + self.s_phase[sel][:, None])
+        shape = (len(pga), t.shape[1])
+        azimuth = self.azimuth[sel][:, None]
+        x = s * np.cos(azimuth) + self.rng.normal(0, self.noise, shape)
+        y = s * np.sin(azimuth) + self.rng.normal(0, self.noise, shape)
+        z = 1.0 + p + self.rng.normal(0, self.noise, shape)
+        return x, y, z
+
+    def fleet(self, elapsed):
+        """x, y, z arrays for every bound device at elapsed rounded to the tick, one vectorized call per tick"""
+        tick = round(elapsed / self.tick)
+        frame = self.frame
+        if frame is None or self.frame_tick != tick:
+            x, y, z = self.waveforms([tick * self.tick])
+            frame = self.frame = (x[:, 0], y[:, 0], z[:, 0])
+            self.frame_tick = tick
+        return frame
+
+    def acceleration(self, index, elapsed):
+        x, y, z = self.fleet(elapsed)
+        return float(x[index]), float(y[index]), float(z[index])
+
+    def g_force(self, device, elapsed):
+        i = self.index.get(device["id"])
+        if i is None or elapsed < self.p_arrival[i]:
+            return None
+        return math.sqrt(sum(a * a for a in self.acceleration(i, elapsed)))
+
+    def ground_truth(self):
+        first = int(np.argmin(self.p_arrival)) if len(self.p_arrival) else None
+        devices = sorted(self.index, key=self.index.get)
+        return {
+            "epicenter": [self.latitude, self.longitude],
+            "origin_time": self.origin_time,
+            "magnitude": self.magnitude,
+            "first_p_arrival": float(self.p_arrival[first]) if first is not None else None,
+            "first_device": devices[first] if first is not None else None,
+            "devices": {
+                device_id: {
+                    "distance_km": round(float(self.hypocentral_km[i]), 3),
+                    "p_arrival": round(float(self.p_arrival[i]), 3),
+                    "s_arrival": round(float(self.s_arrival[i]), 3),
+                    "pga_g": round(float(self.pga[i]), 4)
+                }
+                for device_id, i in self.index.items()
+            }
+        }
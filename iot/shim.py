@@ -0,0 +1,669 @@
+## shim.py - MicroPython modules for CPython, runs boot.py and main.py unchanged on Linux (host side)
+##
+##   python shim.py --seconds 30 --quake-at 15
+##   python shim.py --virtual --seconds 600 --quake-at 300 --stats-every 60
+##   python shim.py --waveform recording.csv --i2c-khz 100 --boot
+##
+## other host tools call install() first, it puts utime, uasyncio, ujson, usocket, machine, esp32,
+## network, ntptime and urequests in sys.modules with the simulated hardware behind them
+
+import os
+import sys
+import math
+import time
+import types
+import json
+import bisect
+import random
+import socket
+import struct
+import asyncio
+import argparse
+import selectors
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+
+## clocks
+class HostClock:
+    # the host's own clocks: sleeps really sleep and bus time is spent spinning, like a CPU driving the bus
+    virtual = False
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def spend(self, seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    def new_event_loop(self):
+        return asyncio.new_event_loop()
+
+
+class VirtualClock(HostClock):
+    # simulated time that moves only when the firmware sleeps or spends bus time, so an hour runs in seconds;
+    # code between sleeps takes no time, what it measures is scheduling and bus cost, not CPython speed
+    virtual = True
+
+    def __init__(self, start=None):
+        self.now = 0.0
+        self.epoch = time.time() if start is None else start
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.epoch + self.now
+
+    def advance(self, seconds):
+        with self.lock:
+            self.now += max(0.0, seconds)
+
+    sleep = advance
+    spend = advance
+
+    def new_event_loop(self):
+        clock = self
+
+        class VirtualSelector(selectors.DefaultSelector):
+            # ready I/O first, otherwise jump to the next timer instead of waiting for it
+            def select(self, timeout=None):
+                events = super().select(0)
+                if events or timeout == 0:
+                    return events
+                if timeout is None:
+                    return super().select(None)
+                clock.advance(timeout)
+                return []
+
+        class VirtualLoop(asyncio.SelectorEventLoop):
+            def time(self):
+                return clock.now
+
+        return VirtualLoop(VirtualSelector())
+
+
+class SimulationEnd(BaseException):
+    # ends a run at its deadline, a BaseException so the firmware's own except clauses let it through
+    pass
+
+
+class ThreadSafeFlag:
+    # uasyncio.ThreadSafeFlag, set() may come from an interrupt handler or another thread
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    async def wait(self):
+        await self.event.wait()
+        self.event.clear()
+
+
+## waveforms
+class QuakeWave:
+    # 1 g on z with sensor noise, and from quake_at a sine on z; returns g per axis
+    def __init__(self, quake_at=None, amplitude=0.03, frequency=6.0, noise=20 / 16384):
+        self.quake_at = quake_at
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.noise = noise
+
+    def __call__(self, t):
+        shake = 0.0
+        if self.quake_at is not None and t >= self.quake_at:
+            shake = self.amplitude * math.sin(2 * math.pi * self.frequency * t)
+        return (random.gauss(0, self.noise), random.gauss(0, self.noise), 1.0 + random.gauss(0, self.noise) + shake)
+
+
+class ReplayWave:
+    # a recording replayed from CSV rows of seconds, x, y, z in g; linear between rows, held after the last
+    def __init__(self, path, offset=0.0, loop=False):
+        self.times = []
+        self.rows = []
+        with open(path) as f:
+            for line in f:
+                fields = line.split("#", 1)[0].replace(",", " ").split()
+                try:
+                    t, x, y, z = (float(v) for v in fields[:4])
+                except ValueError:
+                    continue            # header
+                self.times.append(t)
+                self.rows.append((x, y, z))
+        if not self.rows:
+            raise ValueError(f"{path}: no rows of seconds, x, y, z")
+
+        self.offset = offset - self.times[0]
+        self.loop = loop
+        self.length = self.times[-1] - self.times[0]
+
+    def __call__(self, t):
+        t -= self.offset
+        if self.loop and self.length > 0:
+            t = self.times[0] + (t - self.times[0]) % self.length
+
+        i = bisect.bisect_right(self.times, t)
+        if i == 0:
+            return self.rows[0]
+        if i == len(self.times):
+            return self.rows[-1]
+
+        t0, t1 = self.times[i - 1], self.times[i]
+        a, b = self.rows[i - 1], self.rows[i]
+        k = (t - t0) / (t1 - t0)
+        return tuple(a[j] + (b[j] - a[j]) * k for j in range(3))
+
+
+## simulated hardware
+class SimulatedI2C:
+    # machine.SoftI2C with devices at their addresses; each transaction costs bus time, 9 clocks per byte
+    # including the address byte, plus a fixed software overhead per transaction
+    def __init__(self, devices, freq=400000, overhead_us=0, clock=None):
+        self.devices = {device.ADDRESS: device for device in devices}
+        self.freq = freq
+        self.overhead = overhead_us / 1000000
+        self.clock = clock or HostClock()
+        self.transactions = 0
+        self.bytes = 0
+        self.busy = 0.0
+
+    def _device(self, addr):
+        device = self.devices.get(addr)
+        if device is None:
+            raise OSError(19)           # ENODEV, as MicroPython reports a missing ACK
+        return device
+
+    def _spend(self, nbytes):
+        seconds = (nbytes + 1) * 9 / self.freq + self.overhead
+        self.transactions += 1
+        self.bytes += nbytes
+        self.busy += seconds
+        self.clock.spend(seconds)
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def writeto(self, addr, buf):
+        self._device(addr).writeto(buf)
+        self._spend(len(buf))
+
+    def writeto_mem(self, addr, reg, buf):
+        self._device(addr).writeto_mem(reg, buf)
+        self._spend(len(buf) + 1)
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        self._device(addr).readfrom_mem_into(reg, buf)
+        self._spend(len(buf) + 2)       # register write, repeated start with the address again
+
+    def readfrom_mem(self, addr, reg, nbytes):
+        buf = bytearray(nbytes)
+        self.readfrom_mem_into(addr, reg, buf)
+        return bytes(buf)
+
+
+class SimulatedMPU6050:
+    # an MPU6050 whose FIFO fills from the clock at the configured rate with samples from a waveform
+    ADDRESS = 0x68
+    FIFO_SIZE = 1024
+    HIGHPASS = 1 / 64                   # motion detection compares against a slow per-axis baseline
+
+    def __init__(self, wave=None, clock=None):
+        self.wave = wave or QuakeWave()
+        self.clock = clock or HostClock()
+        self.regs = {}
+        self.fifo = bytearray()
+        self.lock = threading.Lock()
+        self.start = self.clock.monotonic()
+        self.rate_start = self.start    # when the current rate took effect
+        self.produced = 0               # samples taken while the FIFO was enabled
+        self.dropped = 0                # lost to overflow or a FIFO reset
+        self.samples = 0
+        self.baseline = None
+        self.motion = False             # latched motion interrupt, cleared by reading INT_STATUS
+        self.motion_at = None           # first time motion latched
+
+    @property
+    def rate(self):
+        clock = 8000 if self.regs.get(0x1A, 0) & 0x07 in (0, 7) else 1000
+        return clock / (1 + self.regs.get(0x19, 0))
+
+    def _sample(self, t):
+        counts = [max(-32768, min(32767, int(g * 16384))) for g in self.wave(t)]
+
+        if self.baseline is None:
+            self.baseline = list(counts)
+        dynamic = 0
+        for axis in range(3):
+            self.baseline[axis] += (counts[axis] - self.baseline[axis]) * self.HIGHPASS
+            dynamic = max(dynamic, abs(counts[axis] - self.baseline[axis]))
+
+        threshold = self.regs.get(0x1F, 0) * 2 * 16.384
+        if self.regs.get(0x38, 0) & 0x40 and threshold and dynamic > threshold:
+            self.motion = True
+            if self.motion_at is None:
+                self.motion_at = t
+        return counts
+
+    @property
+    def enabled(self):
+        return self.regs.get(0x6A, 0) & 0x40 and self.regs.get(0x23, 0) & 0x08
+
+    def fill(self):
+        # catches the FIFO up with the clock, call with the lock held
+        due = int((self.clock.monotonic() - self.rate_start) * self.rate)
+        enabled = self.enabled
+        offset = self.rate_start - self.start
+        while self.samples < due:
+            sample = self._sample(offset + self.samples / self.rate)
+            self.samples += 1
+            if not enabled:
+                continue
+            self.produced += 1
+            if len(self.fifo) + 6 <= self.FIFO_SIZE:
+                self.fifo += struct.pack(">hhh", *sample)
+            else:
+                self.dropped += 1
+
+    def writeto(self, buf):
+        pass
+
+    def writeto_mem(self, reg, buf):
+        with self.lock:
+            self.fill()
+            self.regs[reg] = buf[0]
+            if reg == 0x19:
+                # new rate, restart the sample clock so old samples are not replayed
+                self.rate_start = self.clock.monotonic()
+                self.samples = 0
+            if reg == 0x6A and buf[0] & 0x04:
+                self.dropped += len(self.fifo) // 6
+                self.fifo = bytearray()
+
+    def readfrom_mem_into(self, reg, buf):
+        with self.lock:
+            self.fill()
+            if reg == 0x72:
+                count = min(len(self.fifo), self.FIFO_SIZE)
+                buf[0], buf[1] = count >> 8, count & 0xFF
+            elif reg == 0x74:
+                n = len(buf)
+                buf[:] = self.fifo[:n]
+                del self.fifo[:n]
+            elif reg == 0x3A:
+                buf[0] = 0x40 if self.motion else 0
+                self.motion = False
+            elif reg == 0x3B:
+                buf[:] = struct.pack(">hhh", *self._sample(self.clock.monotonic() - self.start))
+            else:
+                buf[:] = bytes(len(buf))
+
+
+class SimulatedLcd:
+    # PCF8574 backpack of a 16x2 HD44780, takes every byte and keeps none
+    ADDRESS = 0x27
+
+    def __init__(self):
+        self.writes = 0
+
+    def writeto(self, buf):
+        self.writes += len(buf)
+
+
+class SimulatedPin:
+    # the MPU6050 INT line, raised while the motion latch is set
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.handler = None
+
+    def irq(self, trigger=None, handler=None):
+        self.handler = handler
+
+    async def watch(self):
+        level = False
+        while True:
+            with self.sensor.lock:
+                self.sensor.fill()
+                high = self.sensor.motion
+            if high and not level and self.handler:
+                self.handler(self)
+            level = high
+            await asyncio.sleep(0.001)
+
+
+class SimulatedWlan:
+    # the station interface: a directed connect to the known BSSID takes FAST_S, a full scan and association FULL_S
+    FAST_S = 0.15
+    FULL_S = 2.5
+    BSSID = bytes.fromhex("a0b1c2d3e4f5")
+    CHANNEL = 6
+
+    def __init__(self, clock=None, ssid=None):
+        self.clock = clock or HostClock()
+        self.ssid = ssid
+        self.up_at = self.clock.monotonic()
+        self.down_at = None
+        self.address = ("192.168.1.50", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+        self.connects = []
+        self.channel = None             # set before a connect, directs it like a BSSID does
+
+    def drop(self, at):
+        self.down_at = at
+
+    def active(self, *args):
+        return True
+
+    def isconnected(self):
+        now = self.clock.monotonic()
+        if self.down_at is not None and now >= self.down_at:
+            self.up_at = self.down_at = None
+        return self.up_at is not None and now >= self.up_at
+
+    def connect(self, ssid, key, bssid=None):
+        fast = bssid == self.BSSID or self.channel == self.CHANNEL
+        self.channel = None
+        self.up_at = self.clock.monotonic() + (self.FAST_S if fast else self.FULL_S)
+        self.connects.append("fast" if fast else "full")
+
+    def disconnect(self):
+        self.up_at = None
+
+    def ifconfig(self, config=None):
+        return self.address
+
+    def config(self, *args, **kwargs):
+        if "channel" in kwargs:
+            self.channel = kwargs["channel"]
+        if args == ("channel",):
+            return self.CHANNEL if self.isconnected() else 0
+        if args == ("bssid",):
+            return self.BSSID
+        return None
+
+    def scan(self):
+        if self.ssid is None:
+            from configs.network_config import SSID
+            self.ssid = SSID
+        return [(self.ssid.encode(), self.BSSID, self.CHANNEL, -48, 3, False)]
+
+
+class SimulatedNtp:
+    # SNTP server on localhost answering with the clock's wall time, optionally off by a fixed offset
+    def __init__(self, offset=0.0, clock=None):
+        self.offset = offset
+        self.clock = clock or HostClock()
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            _, address = self.sock.recvfrom(48)
+            now = self.clock.time() + self.offset + 2208988800
+            reply = bytearray(48)
+            reply[0] = 0x24                     # no leap warning, version 4, server
+            reply[1] = 2                        # stratum
+            struct.pack_into("!II", reply, 40, int(now), int((now % 1) * (1 << 32)))
+            self.sock.sendto(reply, address)
+            self.queries += 1
+
+
+class SimulatedUploader:
+    # stands in for main.Uploader: each batch takes delay seconds, fails during the outage, and is kept as text
+    def __init__(self, delay=0.5, outage=0.0, blocking=False, clock=None):
+        self.delay = delay
+        self.outage = outage
+        self.blocking = blocking
+        self.clock = clock or HostClock()
+        self.start = self.clock.monotonic()
+        self.posts = []                 # (seconds into the run, body)
+
+    async def pipeline(self, bodies):
+        started = self.clock.monotonic()
+        if self.blocking:
+            self.clock.sleep(self.delay)        # like urequests, the whole loop stalls
+        else:
+            await asyncio.sleep(self.delay)
+        if started - self.start < self.outage:
+            raise OSError("network down")
+
+        # bodies are views into the encoder buffer, copy them before it is reused
+        self.posts.extend((round(started - self.start, 2), bytes(body).decode()) for body in bodies)
+
+        # the server saw the posts halfway through the delay
+        arrived = int((self.clock.time() - self.delay / 2) * 1000)
+        return [(200, b'{"success": true, "commands": [], "server_ms": %d}' % arrived)] * len(bodies)
+
+    async def request(self, body):
+        return (await self.pipeline([body]))[0]
+
+    async def close(self):
+        pass
+
+
+## urequests over urllib
+class Response:
+    # the parts of urequests.Response the firmware uses
+    def __init__(self, raw):
+        self.raw = raw
+        self.status_code = getattr(raw, "status", None) or raw.code
+        self.headers = dict(raw.headers.items())
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.raw.read()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        self.raw.close()
+
+
+dumps = json.dumps                  # urequests takes a json= keyword that hides the module
+
+
+def make_urequests(online=True):
+    urequests = types.ModuleType("urequests")
+
+    def request(method, url, data=None, json=None, headers=None, timeout=None, stream=None):
+        if not online:
+            raise OSError("offline")
+        if json is not None:
+            data = dumps(json)
+        if isinstance(data, str):
+            data = data.encode()
+        req = urllib.request.Request(url, data=data, headers=headers or {}, method=method)
+        try:
+            return Response(urllib.request.urlopen(req, timeout=timeout))
+        except urllib.error.HTTPError as e:
+            return Response(e)
+        except urllib.error.URLError as e:
+            raise OSError(str(e.reason))
+
+    urequests.request = request
+    urequests.get = lambda url, **kwargs: request("GET", url, **kwargs)
+    urequests.post = lambda url, **kwargs: request("POST", url, **kwargs)
+    urequests.Response = Response
+    return urequests
+
+
+## install
+RUN_SECONDS = None                  # uasyncio.run() raises SimulationEnd after this long
+
+
+def install(clock=None, bus=None, wlan=None, online=True):
+    # registers the MicroPython modules, returns the clock they run on
+    clock = clock or HostClock()
+    bus = bus or SimulatedI2C([SimulatedMPU6050(clock=clock), SimulatedLcd()], clock=clock)
+    wlan = wlan or SimulatedWlan(clock)
+
+    utime = types.ModuleType("utime")
+    utime.__dict__.update(time.__dict__)
+    utime.time = lambda: int(clock.time())
+    utime.localtime = lambda seconds=None: time.localtime(clock.time() if seconds is None else seconds)
+    utime.sleep = clock.sleep
+    utime.sleep_ms = lambda ms: clock.sleep(ms / 1000)
+    utime.sleep_us = lambda us: clock.sleep(us / 1000000)
+    utime.ticks_ms = lambda: int(clock.monotonic() * 1000)
+    utime.ticks_us = lambda: int(clock.monotonic() * 1000000)
+    utime.ticks_add = lambda ticks, delta: ticks + delta
+    utime.ticks_diff = lambda a, b: a - b
+
+    def run(coro):
+        loop = clock.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            if RUN_SECONDS is None:
+                return loop.run_until_complete(coro)
+            try:
+                return loop.run_until_complete(asyncio.wait_for(coro, RUN_SECONDS))
+            except asyncio.TimeoutError:
+                raise SimulationEnd()
+        finally:
+            loop.close()
+
+    uasyncio = types.ModuleType("uasyncio")
+    uasyncio.__dict__.update(asyncio.__dict__)
+    uasyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    uasyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+    uasyncio.ThreadSafeFlag = ThreadSafeFlag
+    uasyncio.run = run
+
+    machine = types.ModuleType("machine")
+    machine.Pin = type("Pin", (), {"OUT": 1, "IN": 0, "IRQ_RISING": 1, "__init__": lambda self, *a, **k: None,
+                                   "value": lambda self, *a: 0, "irq": lambda self, *a, **k: None})
+    machine.SoftI2C = machine.I2C = lambda *args, **kwargs: bus
+    machine.reset = lambda: sys.exit(0)
+    machine.lightsleep = lambda ms=0: clock.sleep(ms / 1000)
+    machine.RTC = type("RTC", (), {"datetime": lambda self: (lambda t: t[:3] + (t[6],) + t[3:6] + (0,))(time.localtime(clock.time()))})
+
+    esp32 = types.ModuleType("esp32")
+    esp32.WAKEUP_ANY_HIGH = 1
+    esp32.wake_on_ext0 = lambda pin, level: None
+
+    network = types.ModuleType("network")
+    network.STA_IF = 0
+    network.WLAN = lambda interface: wlan
+
+    ntptime = types.ModuleType("ntptime")
+    ntptime.settime = lambda: None
+    ntptime.host = "127.0.0.1"
+    ntptime.NTP_DELTA = 2208988800          # CPython time() counts from 1970
+
+    # CPython's gc has no heap figures, pretend there is always room
+    import gc
+    if not hasattr(gc, "mem_free"):
+        gc.mem_free = lambda: 1 << 20
+        gc.mem_alloc = lambda: 0
+
+    for name, module in (("utime", utime), ("uasyncio", uasyncio), ("ujson", json), ("usocket", socket),
+                         ("machine", machine), ("esp32", esp32), ("network", network), ("ntptime", ntptime),
+                         ("urequests", make_urequests(online))):
+        sys.modules[name] = module
+    return clock
+
+
+## run
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the unmodified firmware under CPython against simulated hardware")
+    parser.add_argument("--seconds", type=float, default=30.0, help="seconds to run, simulated ones with --virtual")
+    parser.add_argument("--virtual", action="store_true", help="virtual clock, time only moves when the firmware waits")
+    parser.add_argument("--boot", action="store_true", help="run boot.process(): WiFi, NTP and the update check, then main")
+    parser.add_argument("--quake-at", type=float, default=None, help="seconds into the run a 0.03 g 6 Hz shake starts")
+    parser.add_argument("--waveform", help="replay a CSV of seconds, x, y, z in g instead")
+    parser.add_argument("--waveform-at", type=float, default=0.0, help="seconds into the run the replay starts")
+    parser.add_argument("--loop", action="store_true", help="repeat the replay")
+    parser.add_argument("--i2c-khz", type=float, default=400.0, help="bus clock")
+    parser.add_argument("--i2c-overhead-us", type=float, default=0.0, help="software cost per bus transaction")
+    parser.add_argument("--network-delay", type=float, default=0.1, help="seconds each post takes")
+    parser.add_argument("--ntp-offset", type=float, default=0.0, help="seconds the simulated NTP server is off")
+    parser.add_argument("--stats-every", type=float, default=10.0, help="seconds between the firmware's loop stats lines")
+    parser.add_argument("--online", action="store_true", help="let urequests reach the internet, for the update check")
+    return parser.parse_args()
+
+
+def main():
+    global RUN_SECONDS
+    args = parse_args()
+
+    clock = VirtualClock() if args.virtual else HostClock()
+    if args.waveform:
+        wave = ReplayWave(args.waveform, args.waveform_at, args.loop)
+    else:
+        wave = QuakeWave(args.quake_at)
+    sensor = SimulatedMPU6050(wave, clock)
+    lcd = SimulatedLcd()
+    bus = SimulatedI2C([sensor, lcd], args.i2c_khz * 1000, args.i2c_overhead_us, clock)
+    wlan = SimulatedWlan(clock)
+    install(clock, bus, wlan, args.online)
+
+    # the firmware reads and writes its files in the working directory, give it an empty one
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    os.chdir(tempfile.mkdtemp(prefix="eews-"))
+
+    import main as firmware
+    from configs import parameters as param
+
+    param.LOOP_STATS_INTERVAL_MS = int(args.stats_every * 1000)
+    if args.virtual and param.SAMPLER_THREAD:
+        print("Sampler thread needs real time, running it cooperatively under the virtual clock")
+        param.SAMPLER_THREAD = False
+
+    ntp = SimulatedNtp(args.ntp_offset, clock)
+    firmware.Clock.NTP_PORT = ntp.port
+    uploader = SimulatedUploader(args.network_delay, clock=clock)
+    firmware.UPLOADER = uploader
+
+    RUN_SECONDS = args.seconds
+    started = time.monotonic()
+    try:
+        if args.boot:
+            import boot
+            boot.process()
+        else:
+            firmware.main()
+    except (SimulationEnd, SystemExit):
+        pass
+    elapsed = time.monotonic() - started
+
+    with sensor.lock:
+        sensor.fill()
+        pending = len(sensor.fifo) // 6
+
+    print(f"{'virtual' if args.virtual else 'real'} run of {args.seconds:.0f}s took {elapsed:.1f}s on the host")
+    print(f"MPU6050 produced {sensor.produced}, dropped {sensor.dropped}, still in FIFO {pending}, "
+          f"rate at end {sensor.rate:.0f} Hz, motion latched at {sensor.motion_at}")
+    print(f"I2C {bus.transactions} transactions, {bus.bytes} bytes, busy {bus.busy * 1000:.0f} ms "
+          f"({100 * bus.busy / args.seconds:.1f}% at {args.i2c_khz:.0f} kHz), LCD took {lcd.writes} bytes")
+    events = [body for _, body in uploader.posts if "seq=" in body]
+    frames = [body for _, body in uploader.posts if "window=" in body]
+    print(f"Posts {len(uploader.posts)}: {len(events)} event samples, {len(frames)} feature frames, "
+          f"{len(uploader.posts) - len(events) - len(frames)} heartbeats; NTP queries {ntp.queries}, "
+          f"WiFi connects {', '.join(wlan.connects) or 'none'}")
+    return 0 if sensor.dropped == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())